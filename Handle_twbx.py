@@ -3,64 +3,162 @@ Extract data from Tableau packaged workbooks.
 XML must be removed from the archive and then reconstructed
 """
 import contextlib
+import copy
+import functools
+import hashlib
+import mmap
 import os
-import shutil
+import struct
 import tempfile
+import time
 import zipfile
 
 # import lxml.etree as
 import xml.etree.ElementTree as ET
+from io import BytesIO
 from pathlib import Path
 
+import xml_backend
+import xml_payloads
 
-def xml_open(filename):
-    """Opens the provided 'filename'. Handles detecting if the file is an archive,
-    detecting the document version, and validating the root tag."""
 
-    # Is the file a zip (.twbx or .tdsx)
-    if zipfile.is_zipfile(filename):
-        tree, contents = get_xml_from_archive(filename)
-    else:
-        print(Path(filename).name)
-        with open(filename, encoding="utf-8") as f:
-            contents = f.read()
+class WorkbookSource:
+    """
+    A workbook or data source file opened once. The file is memory mapped and the parser, the
+    style validator and hashing all read that one buffer; a packaged file's document is read
+    out of the mapping. The decoded text is only built if something asks for .text:
+
+        with WorkbookSource(path) as source:
+            content_hash = source.sha256()
+            root = source.parse()
+            styles = validate_styles(style_guide, source.markup())
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
         try:
-            tree = ET.parse(filename)
+            # an empty file can't be mapped, and parses (and fails) as empty bytes
+            self.buffer = (
+                mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                if os.fstat(self._file.fileno()).st_size
+                else b""
+            )
+        except BaseException:
+            self._file.close()
+            raise
+        self.packaged = bool(self.buffer) and zipfile.is_zipfile(self._file)
+        # the document's name in a packaged file, found when the document is first read
+        self.member = None
+        self.payloads = {}
+
+    @functools.cached_property
+    def document(self):
+        """the document's bytes: the mapping itself, or the member read out of a packaged
+        file (.twbx or .tdsx)"""
+        if not self.packaged:
+            return self.buffer
+        # zipfile needs a seekable file object, which mmap isn't
+        with zipfile.ZipFile(self._file) as zf:
+            self.member = find_file_in_zip(zf)
+            return zf.read(self.member)
+
+    @property
+    def open_source(self):
+        """opener of the document for PayloadReference"""
+        if self.packaged:
+            return xml_payloads.zip_member_opener(self.path, self.member)
+        return xml_payloads.file_opener(self.path)
+
+    def parse(self, keep_payloads=False):
+        """the document's root element. Payloads left out are kept in self.payloads"""
+        document = self.document
+        root, self.payloads = xml_payloads.parse_document(
+            document, self.open_source, keep_payloads
+        )
+        return root
+
+    def sha256(self) -> str:
+        """sha256 of the whole file, hashed straight from the mapping"""
+        return hashlib.sha256(self.buffer).hexdigest()
+
+    def markup(self) -> bytes:
+        """the document's bytes without the payloads left out of the parsed tree, for
+        consumers that take bytes, such as BeautifulSoup"""
+        return xml_payloads.without_payloads(self.document, self.payloads)
 
-        except ET.ParseError:
-            # Fix to deal with namespace problem in application Data Models
-            # can be removed when Data Models are fixed
-            with temporary_directory() as temppath:
-                fixedfile = fix_namespace(filename, temppath)
-                tree = ET.parse(fixedfile)
+    @functools.cached_property
+    def text(self) -> str:
+        """the document as text, without the payloads left out of the parsed tree"""
+        return self.markup().decode("utf-8")
 
-    return tree, contents
+    def close(self):
+        self.__dict__.pop("document", None)
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self._file.close()
 
+    def __enter__(self):
+        return self
 
-@contextlib.contextmanager
-def temporary_directory(*args, **kwargs):
-    """Create temporary directory and delete when finished"""
-    d = tempfile.mkdtemp(*args, **kwargs)
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def xml_open(filename, keep_payloads=True):
+    """Opens the provided 'filename'. Handles detecting if the file is an archive,
+    detecting the document version, and validating the root tag. Thumbnails and images
+    are kept, so the tree can be saved back with save_file; pass keep_payloads=False to
+    leave them out of a tree that is only read (see xml_payloads)"""
+    with WorkbookSource(filename) as source:
+        root = source.parse(keep_payloads)
+        return xml_backend.element_tree(root), source.text
+
+
+def open_document(filename, keep_payloads=False, contents=True):
+    """Parse a workbook or data source, packaged or not, from one memory mapped read.
+    filename is a path or an open WorkbookSource. Returns (root, source, payloads): the
+    WorkbookSource when contents is True (else None; a source opened here is then closed)
+    and {element: PayloadReference} for the thumbnails and images left out of the tree,
+    unless keep_payloads is set. See xml_payloads"""
+    if isinstance(filename, WorkbookSource):
+        source = filename
+    else:
+        source = WorkbookSource(filename)
+        if not source.packaged:
+            print(Path(filename).name)
+
+    # the namespace problem in application Data Models is repaired by the parser
     try:
-        yield d
-    finally:
-        shutil.rmtree(d)
+        root = source.parse(keep_payloads)
+    except BaseException:
+        if source is not filename:
+            source.close()
+        raise
+    if contents:
+        return root, source, source.payloads
+    if source is not filename:
+        source.close()
+    return root, None, source.payloads
 
 
 def find_file_in_zip(zip_file):
     """Returns the twb/tds file from a Tableau packaged file format. Packaged
     files can contain cache entries which are also valid XML, so only look for
-    files with a .tds or .twb extension.
+    files with a .tds or .twb extension. When there is only one it is returned
+    without parsing it, as the caller is about to.
     """
 
-    candidate_files = filter(
-        lambda x: x.split(".")[-1] in ("twb", "tds"), zip_file.namelist()
-    )
+    candidate_files = [
+        name for name in zip_file.namelist() if name.split(".")[-1] in ("twb", "tds")
+    ]
+    if len(candidate_files) == 1:
+        return candidate_files[0]
 
     for filename in candidate_files:
         with zip_file.open(filename) as xml_candidate:
             try:
-                ET.parse(xml_candidate)
+                xml_payloads.parse_document(xml_candidate)
                 return filename
             except ET.ParseError:
                 # That's not an XML file by gosh
@@ -69,27 +167,9 @@ def find_file_in_zip(zip_file):
 
 def get_xml_from_archive(filename):
     """Extract workbook xml from archive"""
-    with zipfile.ZipFile(filename) as zf:
-        with zf.open(find_file_in_zip(zf), "r") as xml_file:
-            with temporary_directory() as temppath:
-                # print(os.path.join(temppath, "temp_file"))
-                temp_file_name = os.path.join(temppath, "temp_file")
-                # print("xml file: {}".format(xml_file))
-                with open(temp_file_name, "a", encoding="utf-8") as temp_file:
-                    for line in xml_file:
-                        temp_file.write(line.decode("utf-8"))
-                xml_contents = xml_file.read()
-
-                try:
-                    with open(temp_file_name, encoding="utf-8") as file:
-                        xml_tree = ET.parse(file)
-                except ET.ParseError:
-                    # Fix to deal with namespace problem in application Data Models
-                    fixedfile = fix_namespace(temp_file_name, temppath)
-                    with open(fixedfile, encoding="utf-8") as file:
-                        xml_tree = ET.parse(file)
-
-    return xml_tree, xml_contents
+    with WorkbookSource(filename) as source:
+        root = source.parse(keep_payloads=True)
+        return xml_backend.element_tree(root), source.text
 
 
 def build_archive_file(archive_contents, zip_file):
@@ -105,35 +185,96 @@ def build_archive_file(archive_contents, zip_file):
             zip_file.write(temp_file_full_path, arcname=zipname)
 
 
+def _strip_zip64_extra(extra):
+    """remove the zip64 extra field, which ZipInfo.FileHeader adds back when it is needed"""
+    stripped = b""
+    while len(extra) >= 4:
+        header_id, size = struct.unpack("<HH", extra[:4])
+        if header_id != 1:
+            stripped += extra[: 4 + size]
+        extra = extra[4 + size :]
+    return stripped
+
+
+def copy_member_raw(source_fp, info, target_zip):
+    """Copy an archive member's compressed bytes from the source zip file object into
+    target_zip without decompressing or recompressing them. target_zip must be open for writing.
+    zipfile has no public API for this, so the local header is written with ZipInfo.FileHeader
+    and the member registered the same way ZipFile.write does."""
+    source_fp.seek(info.header_offset)
+    local_header = source_fp.read(zipfile.sizeFileHeader)
+    name_length, extra_length = struct.unpack("<HH", local_header[26:30])
+    source_fp.seek(name_length + extra_length, os.SEEK_CUR)
+
+    target_info = copy.copy(info)
+    target_info.extra = _strip_zip64_extra(info.extra)
+    # sizes and crc go in the local header, so no data descriptor is written after the data
+    target_info.flag_bits &= ~0x08
+    target_info.header_offset = target_zip.fp.tell()
+    target_zip.fp.write(target_info.FileHeader())
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = source_fp.read(min(remaining, 1 << 20))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated archive member {info.filename}")
+        target_zip.fp.write(chunk)
+        remaining -= len(chunk)
+    target_zip.filelist.append(target_info)
+    target_zip.NameToInfo[target_info.filename] = target_info
+    target_zip.start_dir = target_zip.fp.tell()
+
+
+def rewrite_archive(source, target, member_name, member_data):
+    """
+    Write a copy of the archive source to target with member_name replaced by member_data.
+    source and target are paths or binary file objects. Every other member, e.g. multi-GB
+    .hyper extracts, is copied raw, so the cost is about one copy of the archive's bytes
+    """
+    with contextlib.ExitStack() as stack:
+        if isinstance(source, (str, os.PathLike)):
+            source = stack.enter_context(open(source, "rb"))
+        source_zip = stack.enter_context(zipfile.ZipFile(source))
+        target_zip = stack.enter_context(
+            zipfile.ZipFile(target, "w", compression=zipfile.ZIP_DEFLATED)
+        )
+        for info in source_zip.infolist():
+            if info.filename == member_name:
+                new_info = zipfile.ZipInfo(
+                    member_name, date_time=time.localtime(time.time())[:6]
+                )
+                new_info.compress_type = zipfile.ZIP_DEFLATED
+                new_info.external_attr = info.external_attr
+                target_zip.writestr(new_info, member_data)
+            else:
+                copy_member_raw(source, info, target_zip)
+
+
 def save_into_archive(xml_tree, filename, new_filename=None):
     """
-    Saving an archive means extracting the contents into a temp folder,
-    saving the changes over the twb/tds in that folder, and then
-    packaging it back up into a zip with a very specific format
-    e.g. no empty files for directories, which Windows and Mac do by default
+    Saving an archive means re-serializing the twb/tds and writing a new zip with it in
+    place of the old one. The other members are copied across raw (see rewrite_archive),
+    keeping the archive's original member names and order, with no empty directory entries
     """
 
     if new_filename is None:
         new_filename = filename
 
-    # Extract to temp directory
-    with temporary_directory() as temp_path:
-        with zipfile.ZipFile(filename) as zf:
-            xml_file = find_file_in_zip(zf)
-            zf.extractall(temp_path)
-        # Write the new version of the file to the temp directory
-        xml_tree.write(
-            os.path.join(temp_path, xml_file),
-            encoding="utf-8",
-            pretty_print=True,
-            xml_declaration=True,
-        )
+    with zipfile.ZipFile(filename) as zf:
+        xml_file = find_file_in_zip(zf)
+    output = BytesIO()
+    xml_backend.write(xml_tree, output, pretty_print=True)
 
-        # Write the new archive with the contents of the temp folder
-        with zipfile.ZipFile(
-            new_filename, "w", compression=zipfile.ZIP_DEFLATED
-        ) as new_archive:
-            build_archive_file(temp_path, new_archive)
+    # write next to the destination and swap in, so saving over the source is safe
+    fd, temp_name = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(new_filename)), suffix=".tmp"
+    )
+    os.close(fd)
+    try:
+        rewrite_archive(filename, temp_name, xml_file, output.getvalue())
+        os.replace(temp_name, new_filename)
+    except BaseException:
+        os.remove(temp_name)
+        raise
 
 
 def save_file(container_file, xml_tree, new_filename=None):
@@ -145,32 +286,4 @@ def save_file(container_file, xml_tree, new_filename=None):
     if zipfile.is_zipfile(container_file):
         save_into_archive(xml_tree, container_file, new_filename)
     else:
-        xml_tree.write(
-            new_filename, encoding="utf-8", pretty_print=True, xml_declaration=True
-        )
-
-
-def fix_namespace(filename, outpath):
-    """Namespace issues within the xml. Fix so that parsing works correctly"""
-    replacements = {" user:": " "}
-
-    # print("File exists: {}".format(os.path.isfile(filename)))
-    # with open(filename,'r') as temp_file:
-    #     for line in temp_file:
-    #         print(line)
-    outfile_name = os.path.join(outpath, Path(filename).name)
-    tempfile_name = os.path.join(outpath, "tempfile")
-
-    shutil.copyfile(filename, tempfile_name)
-
-    with open(tempfile_name, "r", encoding="utf-8") as infile, open(
-        outfile_name, "w", encoding="utf-8"
-    ) as outfile:
-        for line in infile:
-            for src, target in replacements.items():
-                line = line.replace(src, target)
-            outfile.write(line)
-
-    os.remove(tempfile_name)
-
-    return outfile_name
+        xml_backend.write(xml_tree, new_filename, pretty_print=True)
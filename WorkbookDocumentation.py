@@ -3,24 +3,239 @@ import os
 import time
 import logging
 import json
+import zipfile
 import xml.etree.ElementTree as ET
-import openpyxl
-from openpyxl.styles import Font
+from typing import NamedTuple
 import Handle_twbx
-from validator.validate_styles import validate_styles
+import xml_backend
+from calc_linter import lint_calculations
+from custom_sql import datasource_custom_sql
+from dashboard_cost import estimate_dashboard, profile_worksheet
+
+# openpyxl and the style validator are imported where they're used, so importing this module
+# (every entry point does) doesn't pay for the Excel writer or the validator's dependencies
 
 # from tkinter import messagebox
 
+# elements looked up by attribute value once per column or dashboard zone. Each is indexed by
+# that attribute in one pass (see xml_backend.XPath.index) rather than searched per lookup
+COLUMN_MAP_XPATH = xml_backend.XPath(".//connection/cols/map")
+COLUMN_INSTANCE_XPATH = xml_backend.XPath("./column-instance")
+QUICK_FILTER_XPATH = xml_backend.XPath(".//style-rule[@element='quick-filter']/format")
+
+# Column layout of every extracted table, keyed by sheet name. This is the shared schema used by the
+# xlsx sheets and the columnar writers. Resolved names/formulas are filled in after extraction.
+SPREADSHEET_COLUMNS = {
+    "Connections": ["datasource", "connection", "type"],
+    "Parameters": [
+        "datasource",
+        "caption",
+        "value",
+        "datatype",
+        "type",
+        "role",
+        "name",
+        "description",
+    ],
+    "Tables": ["datasource", "connection", "name", "table"],
+    "Custom SQL": ["datasource", "connection", "name", "SQL"],
+    "Custom SQL Findings": [
+        "datasource",
+        "connection",
+        "name",
+        "rule",
+        "severity",
+        "score",
+        "detail",
+    ],
+    "Columns": [
+        "datasource",
+        "key",
+        "table",
+        "column",
+        "caption",
+        "datatype",
+        "hidden",
+        "description",
+    ],
+    "Field Map": ["datasource", "key", "relation", "column"],
+    "Calculations": [
+        "datasource",
+        "caption",
+        "name",
+        "role",
+        "calculation_type",
+        "hidden",
+        "datatype",
+        "default_format",
+        "calculation",
+        "description",
+        "calc_resolved",
+        "calc_renamed",
+    ],
+    "Sets": [
+        "datasource",
+        "caption",
+        "name",
+        "element",
+        "type",
+        "condition_calculation",
+        "number",
+        "end",
+        "direction",
+        "members",
+        "expression",
+        "description",
+    ],
+    "Style validation": ["styles"],
+    "Worksheet Captions": ["worksheet", "caption"],
+    "Worksheet Columns": [
+        "worksheet",
+        "datasource",
+        "caption",
+        "name",
+        "role",
+        "datatype",
+        "type",
+        "calculation",
+        "computation",
+        "calc_resolved",
+        "name_resolved",
+    ],
+    "Dashboard Objects": ["dashboard", "dashboard_object", "type"],
+    "Assets": ["file", "type", "size", "compressed_size", "modified"],
+    "Data Source Access": [
+        "datasource",
+        "mode",
+        "connection_types",
+        "extract_file",
+        "extract_size",
+        "compressed_size",
+        "refresh",
+        "increment_key",
+        "last_refresh",
+        "rows",
+        "row_limit",
+        "extract_filters",
+        "extract_columns",
+    ],
+    "Dashboard Cost": [
+        "dashboard",
+        "score",
+        "worksheets",
+        "datasources",
+        "quick_filters",
+        "relevant_filters",
+        "marks_heavy_fields",
+        "table_calcs",
+        "detail",
+    ],
+    "Performance Findings": [
+        "datasource",
+        "caption",
+        "name",
+        "rule",
+        "severity",
+        "score",
+        "detail",
+        "calculation",
+    ],
+}
+
+# Asset type of packaged file members by extension. Anything else is "other"
+ASSET_TYPES = {
+    ".hyper": "extract",
+    ".tde": "extract",
+    ".twb": "workbook",
+    ".tds": "datasource",
+    ".png": "image",
+    ".jpg": "image",
+    ".jpeg": "image",
+    ".gif": "image",
+    ".bmp": "image",
+    ".svg": "image",
+    ".csv": "data",
+    ".txt": "data",
+    ".tsv": "data",
+    ".xls": "data",
+    ".xlsx": "data",
+    ".xlsm": "data",
+    ".json": "data",
+    ".mdb": "data",
+    ".accdb": "data",
+    ".shp": "data",
+    ".kml": "data",
+    ".geojson": "data",
+    ".pdf": "data",
+}
+
+# connection classes of extract files, read in place of a live connection
+EXTRACT_CONNECTION_TYPES = frozenset(("hyper", "dataengine"))
+
+# (sheet name, attribute holding the records, record type) for each extracted table, in output order
+EXTRACTED_TABLES = [
+    ("Connections", "connections", "connection"),
+    ("Data Source Access", "datasource_access", "datasource_access"),
+    ("Parameters", "parameters", "parameter"),
+    ("Tables", "tables", "table"),
+    ("Custom SQL", "custom_sql_queries", "custom_sql"),
+    ("Custom SQL Findings", "custom_sql_findings", "custom_sql_finding"),
+    ("Columns", "columns", "column"),
+    ("Field Map", "field_map", "field_map"),
+    ("Calculations", "calculations", "calculation"),
+    ("Sets", "sets", "set"),
+    ("Style validation", "styles", "style"),
+    ("Worksheet Captions", "worksheet_captions", "worksheet_caption"),
+    ("Worksheet Columns", "worksheet_columns", "worksheet_column"),
+    ("Dashboard Objects", "dashboard_objects", "dashboard_object"),
+    ("Dashboard Cost", "dashboard_costs", "dashboard_cost"),
+    ("Assets", "assets", "asset"),
+    ("Performance Findings", "performance_findings", "performance_finding"),
+]
+
+
+class DocumentationRecord(NamedTuple):
+    """One extracted record as yielded by WorkbookDocumentation.iter_records"""
+
+    record_type: str
+    source: str
+    location: str
+    data: dict
+
+    def to_json(self):
+        """serialize the record as a single JSON line"""
+        return json.dumps(self._asdict(), default=str)
+
 
 class WorkbookDocumentation:
     """Core workbook class with methods to extract metadata"""
 
-    def __init__(self, input_file: str | ET.Element, style_guide=None):
-
+    def __init__(
+        self,
+        input_file: str | Handle_twbx.WorkbookSource | ET.Element,
+        style_guide=None,
+        stream: bool = False,
+        keep_payloads: bool = False,
+        package=None,
+    ):
+
+        # thumbnails and images are left out of the tree unless keep_payloads is set.
+        # self.payloads maps their elements to references that can read them back
+        self.payloads = {}
+        source = None
+        if isinstance(input_file, Handle_twbx.WorkbookSource):
+            # a file the caller already opened, e.g. to hash it. The caller closes it
+            source, input_file = input_file, input_file.path
         if isinstance(input_file, str):
-            workbook_tree, workbook_contents = Handle_twbx.xml_open(input_file)
-            root = workbook_tree.getroot()
-        elif isinstance(input_file, ET.Element):
+            root, workbook_contents, self.payloads = Handle_twbx.open_document(
+                source or input_file, keep_payloads, contents=style_guide is not None
+            )
+            if package is None and (
+                source.packaged if source else zipfile.is_zipfile(input_file)
+            ):
+                package = input_file
+        elif ET.iselement(input_file):
+            # an element from either XML backend (see xml_backend)
             root = input_file
         else:
             print("Incorrect data type used in input")
@@ -34,56 +249,150 @@ class WorkbookDocumentation:
         self.tables = []
         self.parameters = []
         self.custom_sql_queries = []
+        # patterns in the custom SQL that slow its queries (see custom_sql.analyze_sql)
+        self.custom_sql_findings = []
         self.calculations = []
         self.columns = []
+        # every field key of a data source and the relation column it reads, for lineage
+        self.field_map = []
         self.sets = []
         self.styles = []
+        # members of a packaged .twbx/.tdsx, read from the zip central directory.
+        # package is the path or binary file object of the zip the document came from
+        self.assets = []
+        self._package = package
+        # whether each data source runs live or from an extract, with the extract's refresh
+        # settings and, for packaged files, its size. _extract_members maps the packaged
+        # extract files to their Assets records, kept as the assets are streamed
+        self.datasource_access = []
+        self._extract_members = {}
+        # calculations whose formulas match slow query patterns (see calc_linter)
+        self.performance_findings = []
 
         # self.document_type = workbook_tree.getroot().tag
         self.document_type = root.tag
+        if self.document_type != "datasource":
+            self.worksheet_columns = []
+            self.worksheet_captions = []
+            self.dashboard_objects = []
+            # estimated render cost of each dashboard (see dashboard_cost), from the profiles
+            # of the worksheets, which are kept as the worksheet records are streamed
+            self.dashboard_costs = []
+            self._worksheet_profiles = {}
+
+        if style_guide is not None:
+            # the memory mapped WorkbookSource, held until the styles are validated
+            self._workbook_contents = workbook_contents
+            self._close_contents = source is None
+
+        self.out_file = ""
+
+        # in stream mode nothing is extracted until iter_records is consumed
+        self._extracted = False
+        if not stream:
+            for _ in self._extract():
+                pass
+
+    def _extract(self):
+        """Run the find_* methods over the document. After each datasource, worksheet, dashboard
+        and the style validation, yield the location processed and the position of each table's
+        list before the step, so callers can pick up the records it added"""
+        self._extracted = True
+
+        if self._package is not None:
+            marks = self._table_marks()
+            self.find_assets(self._package)
+            self._package = None
+            yield "package", marks
 
         if self.document_type == "datasource":
             # self.datasource_root = workbook_tree.getroot()
             # self.process_datasource(workbook_tree.getroot())
-            self.datasource_root = root
-            self.process_datasource(root)
+            self.datasource_root = self.root
+            marks = self._table_marks()
+            self.process_datasource(self.root)
+            yield f"datasource[{self._datasource_name(self.root)}]", marks
         else:
             # self.datasource_root = workbook_tree.find(".//datasources")
-            self.datasource_root = root.find(".//datasources")
+            self.datasource_root = self.root.find(".//datasources")
             try:
                 for datasource_node in self.datasource_root.findall("./datasource"):
+                    marks = self._table_marks()
                     self.process_datasource(datasource_node)
+                    yield f"datasource[{self._datasource_name(datasource_node)}]", marks
             except AttributeError:
                 print("No data sources found")
 
             # self.worksheet_root = workbook_tree.find(".//worksheets")
-            self.worksheet_root = root.find(".//worksheets")
-            self.worksheet_columns = []
-            self.worksheet_captions = []
+            self.worksheet_root = self.root.find(".//worksheets")
             try:
                 for worksheet_node in self.worksheet_root.findall("./worksheet"):
+                    marks = self._table_marks()
                     self.find_worksheet_columns(worksheet_node)
+                    self._worksheet_profiles[worksheet_node.attrib["name"]] = (
+                        profile_worksheet(
+                            worksheet_node, self.worksheet_columns[marks["worksheet_columns"] :]
+                        )
+                    )
                     self.find_worksheet_captions(worksheet_node)
+                    yield f"worksheet[{worksheet_node.attrib['name']}]", marks
             except AttributeError:
                 print("No worksheets found")
 
             # self.dashboard_root = workbook_tree.find(".//dashboards")
-            self.dashboard_root = root.find(".//dashboards")
-            self.dashboard_objects = []
+            self.dashboard_root = self.root.find(".//dashboards")
             try:
                 for dashboard_node in self.dashboard_root.findall("./dashboard"):
+                    marks = self._table_marks()
                     self.find_dashboards(dashboard_node)
+                    self.find_dashboard_cost(dashboard_node)
+                    yield f"dashboard[{dashboard_node.attrib['name']}]", marks
             except AttributeError:
                 print("No dashboards found")
 
-        if style_guide is not None:
+        if self.style_guide is not None:
+            marks = self._table_marks()
             style_guide_json = self.ingest_style_guide()
             style_guide_json.pop("_README")
             # workbook_file = self.ingest_tableau_workbook()
             # self.styles = validate_styles(style_guide_json, workbook_file)
-            self.styles = validate_styles(style_guide_json, workbook_contents)
-
-        self.out_file = ""
+            from validator.validate_styles import validate_styles
+
+            # BeautifulSoup decodes the bytes itself, so no str copy of the document is made
+            self.styles = validate_styles(style_guide_json, self._workbook_contents.markup())
+            if self._close_contents:
+                self._workbook_contents.close()
+            self._workbook_contents = None
+            yield "styles", marks
+
+    def _table_marks(self):
+        """current length of each table's list"""
+        return {
+            attribute: len(getattr(self, attribute))
+            for _, attribute, _ in EXTRACTED_TABLES
+            if hasattr(self, attribute)
+        }
+
+    def iter_records(self):
+        """Yield a DocumentationRecord for each record as it is extracted.
+
+        The object must be created with stream=True. Records are removed from the list attributes
+        once yielded, so memory stays bounded by the largest datasource, worksheet or dashboard.
+        Calculations are kept since later formulas and worksheet columns are resolved against them.
+        """
+        if self._extracted:
+            raise RuntimeError("records already extracted. Use stream=True to iterate records")
+
+        source = self.workbook_id
+        for location, marks in self._extract():
+            for _, attribute, record_type in EXTRACTED_TABLES:
+                if attribute not in marks:
+                    continue
+                records = getattr(self, attribute)
+                for data in records[marks[attribute] :]:
+                    yield DocumentationRecord(record_type, source, location, data)
+                if attribute != "calculations":
+                    del records[marks[attribute] :]
 
     def ingest_tableau_workbook(self):
         """Ingest Tableau Workbook file (~/foo.twb) from command line arguments."""
@@ -114,20 +423,20 @@ class WorkbookDocumentation:
 
     def process_datasource(self, datasource_node):
         """iterate through each data source and find information"""
-        if "caption" in datasource_node.attrib:
-            datasource_name = datasource_node.attrib["caption"]
-        elif "formatted-name" in datasource_node.attrib:
-            datasource_name = datasource_node.attrib["formatted-name"]
-        else:
-            # todo: should there be a fallback if none of the 3 attributes exist?
-            datasource_name = datasource_node.attrib["name"]
+        datasource_name = self._datasource_name(datasource_node)
         logging.info("now processing %s data source", datasource_name)
         self.find_connections(datasource_node, datasource_name)
+        self.find_datasource_access(datasource_node, datasource_name)
         self.find_parameters(datasource_node, datasource_name)
+        start_length = len(self.calculations)
         self.find_calculations(datasource_node, datasource_name)
+        self.find_performance_findings(
+            datasource_node, self.calculations[start_length:]
+        )
         self.find_custom_sql(datasource_node, datasource_name)
         self.find_tables(datasource_node, datasource_name)
         self.find_sets(datasource_node, datasource_name)
+        self.find_field_map(datasource_node, datasource_name)
         if datasource_node.findall(
             "./connection/named-connections/named-connection/"
             + "connection[@class='excel-direct']"
@@ -137,6 +446,116 @@ class WorkbookDocumentation:
         else:
             self.find_columns(datasource_node, datasource_name)
 
+    def find_assets(self, package):
+        """list the members of a packaged file with their sizes. Only the zip central
+        directory is read, nothing is decompressed"""
+        spreadsheet_columns = SPREADSHEET_COLUMNS["Assets"]
+        with zipfile.ZipFile(package) as zip_file:
+            for member in zip_file.infolist():
+                if member.is_dir():
+                    continue
+                extension = os.path.splitext(member.filename)[1].lower()
+                asset_values = [
+                    member.filename,
+                    ASSET_TYPES.get(extension, "other"),
+                    member.file_size,
+                    member.compress_size,
+                    "%04d-%02d-%02d %02d:%02d:%02d" % member.date_time,
+                ]
+                self.assets.append(dict(zip(spreadsheet_columns, asset_values)))
+                if asset_values[1] == "extract":
+                    self._extract_members[member.filename] = self.assets[-1]
+        logging.info("Found %s packaged assets", str(len(self.assets)))
+
+    def find_datasource_access(self, datasource_node, datasource_name):
+        """classify a data source as live or extract, with the extract's refresh settings and
+        the size of its packaged file"""
+        spreadsheet_columns = SPREADSHEET_COLUMNS["Data Source Access"]
+        connection_types = [
+            connection_node.attrib["class"]
+            for connection_node in datasource_node.findall("./connection")
+            + datasource_node.findall(
+                "./connection/named-connections/named-connection/connection"
+            )
+            if connection_node.attrib.get("class") not in (None, "federated")
+        ]
+        extract_node = datasource_node.find("./extract[@enabled='true']")
+        if extract_node is None and not connection_types:
+            # e.g. Parameters, which queries nothing
+            return
+        extract_connection = None
+        if extract_node is not None:
+            extract_connection = extract_node.find("./connection")
+        elif set(connection_types) <= EXTRACT_CONNECTION_TYPES:
+            # a data source reading an extract file directly
+            extract_connection = datasource_node.find("./connection")
+
+        access_values = [
+            datasource_name,
+            "live" if extract_connection is None else "extract",
+            ", ".join(dict.fromkeys(connection_types)),
+        ]
+        if extract_connection is not None:
+            dbname = self._validate_attribute_(extract_connection, "dbname")
+            asset = self._packaged_extract(dbname)
+            refresh_node = extract_connection.find("./refresh")
+            refresh_events = extract_connection.findall("./refresh/refresh-event")
+            incremental = (
+                refresh_node is not None
+                and refresh_node.get("incremental-updates") == "true"
+            )
+            if refresh_events:
+                last_refresh = refresh_events[-1].get("timestamp-start", "")
+                rows = refresh_events[-1].get("rows-inserted", "")
+            else:
+                last_refresh = self._validate_attribute_(extract_connection, "update-time")
+                rows = ""
+            # count is -1 for all rows, otherwise the top or sampled rows kept
+            row_limit = self._validate_attribute_(extract_node, "count")
+            access_values += [
+                asset["file"] if asset else dbname,
+                asset["size"] if asset else None,
+                asset["compressed_size"] if asset else None,
+                "incremental" if incremental else "full",
+                refresh_node.get("increment-key", "") if incremental else "",
+                last_refresh,
+                rows,
+                "" if row_limit in ("", "-1") else row_limit,
+                len(extract_node.findall(".//filter")) if extract_node is not None else 0,
+                len(
+                    extract_connection.findall(
+                        "./metadata-records/metadata-record[@class='column']"
+                    )
+                ),
+            ]
+        self.datasource_access.append(dict(zip(spreadsheet_columns, access_values)))
+
+    def _packaged_extract(self, dbname):
+        """the Assets record of the packaged file an extract connection's dbname refers to.
+        dbname is often the path the extract had on the author's machine"""
+        path = dbname.replace("\\", "/")
+        if path in self._extract_members:
+            return self._extract_members[path]
+        for filename, asset in self._extract_members.items():
+            if path.endswith("/" + filename):
+                return asset
+        for filename, asset in self._extract_members.items():
+            if os.path.basename(path) == os.path.basename(filename):
+                return asset
+        return None
+
+    @staticmethod
+    def _datasource_name(datasource_node):
+        """name shown for a data source"""
+        if "caption" in datasource_node.attrib:
+            datasource_name = datasource_node.attrib["caption"]
+        elif "formatted-name" in datasource_node.attrib:
+            datasource_name = datasource_node.attrib["formatted-name"]
+        else:
+            # todo: should there be a fallback if none of the 3 attributes exist?
+            datasource_name = datasource_node.attrib["name"]
+        return datasource_name
+
     @staticmethod
     def _validate_attribute_(node, attribute):
         """validate that the attribute exists in the node"""
@@ -216,7 +635,7 @@ class WorkbookDocumentation:
 
     def find_connections(self, datasource_node, datasource_name):
         """iterate through connection nodes to find data"""
-        spreadsheet_columns = ["datasource", "connection", "type"]
+        spreadsheet_columns = SPREADSHEET_COLUMNS["Connections"]
         for connection_node in datasource_node.findall("./connection"):
             # find all federated connections and their data
             if connection_node.find("./named-connections"):
@@ -268,7 +687,7 @@ class WorkbookDocumentation:
     def find_tables(self, datasource_node, datasource_name):
         """iterate through relation nodes to find tables"""
         # todo More efficient to do this within each connection?
-        spreadsheet_columns = ["datasource", "connection", "name", "table"]
+        spreadsheet_columns = SPREADSHEET_COLUMNS["Tables"]
         for node in datasource_node.findall(".//relation[@type='table']"):
             if node.attrib["name"] != "Extract" and node.attrib["name"] != "sqlproxy":
                 # if 'connection' in node.attrib:
@@ -282,37 +701,26 @@ class WorkbookDocumentation:
         logging.info("Found %s tables", str(len(self.tables)))
 
     def find_custom_sql(self, datasource_node, datasource_name):
-        """iterate through relation nodes to find custom SQL"""
-        # todo More efficient to do this within each connection?
-        spreadsheet_columns = ["datasource", "connection", "name", "SQL"]
-        for node in datasource_node.findall(".//relation[@type='text']"):
-            if node.attrib["name"] != "Extract":
-                # print(node.attrib["connection"] + ',' + node.attrib["name"] + ',' + node.text)
-                custom_sql_values = [
-                    datasource_name,
-                    self._validate_attribute_(node, "connection")
-                    + ","
-                    + self._validate_attribute_(node, "name")
-                    + ","
-                    + node.text,
-                ]
-                self.custom_sql_queries.append(
-                    dict(zip(spreadsheet_columns, custom_sql_values))
+        """iterate through relation nodes to find custom SQL and analyze it for performance"""
+        spreadsheet_columns = SPREADSHEET_COLUMNS["Custom SQL"]
+        finding_columns = SPREADSHEET_COLUMNS["Custom SQL Findings"]
+        for query in datasource_custom_sql(datasource_node, datasource_name):
+            custom_sql_values = [datasource_name, query.connection, query.name, query.sql]
+            self.custom_sql_queries.append(dict(zip(spreadsheet_columns, custom_sql_values)))
+            for finding in query.findings():
+                self.custom_sql_findings.append(
+                    dict(
+                        zip(
+                            finding_columns,
+                            [datasource_name, query.connection, query.name, *finding],
+                        )
+                    )
                 )
         logging.info("Found %s custom SQL queries", str(len(self.custom_sql_queries)))
 
     def find_parameters(self, datasource_node, datasource_name):
         """iterate through data sources nodes to find Parameter source"""
-        spreadsheet_columns = [
-            "datasource",
-            "caption",
-            "value",
-            "datatype",
-            "type",
-            "role",
-            "name",
-            "description",
-        ]
+        spreadsheet_columns = SPREADSHEET_COLUMNS["Parameters"]
         for node in datasource_node.findall(".[@hasconnection='false']/column"):
             parameter_values = [
                 datasource_name,
@@ -339,16 +747,8 @@ class WorkbookDocumentation:
     def find_columns(self, datasource_node, datasource_name):
         """iterate through column nodes to find columns"""
         # todo More efficient to do this within each connection?
-        spreadsheet_columns = [
-            "datasource",
-            "key",
-            "table",
-            "column",
-            "caption",
-            "datatype",
-            "hidden",
-            "description",
-        ]
+        spreadsheet_columns = SPREADSHEET_COLUMNS["Columns"]
+        column_maps = COLUMN_MAP_XPATH.index(self.datasource_root, "key")
         for node in datasource_node.findall("./column"):
             if node.find("./calculation") is None and node.find("./aliases") is None:
                 # print(node.attrib["name"] + " is not a calculation")
@@ -356,10 +756,7 @@ class WorkbookDocumentation:
                 caption = self._validate_attribute_(node, "caption")
                 datatype = self._validate_attribute_(node, "datatype")
                 hidden = self._validate_attribute_(node, "hidden")
-                column_node = self.datasource_root.find(
-                    ".//connection/cols/map[@key='" + name + "']"
-                )
-                # print("./connection/cols/map[@key='" + name + "']")
+                column_node = column_maps.get(name, [None])[0]
                 if column_node is not None:
                     table, column = column_node.attrib["value"].split("].[")
                     table = table + "]"
@@ -383,21 +780,33 @@ class WorkbookDocumentation:
                 self.columns.append(dict(zip(spreadsheet_columns, column_values)))
         logging.info("Found %s columns", str(len(self.columns)))
 
+    def find_field_map(self, datasource_node, datasource_name):
+        """map each field key of a data source to its relation and column, from the
+        connection's cols/map entries and metadata records. Unlike find_columns this doesn't
+        need <column> elements, which Tableau only writes for fields with changed properties"""
+        spreadsheet_columns = SPREADSHEET_COLUMNS["Field Map"]
+        fields = {}
+        for map_node in datasource_node.findall("./connection/cols/map"):
+            relation, separator, column = map_node.get("value", "").partition("].[")
+            if separator:
+                fields[map_node.attrib["key"]] = (relation + "]", "[" + column)
+        for record_node in datasource_node.findall(
+            "./connection/metadata-records/metadata-record[@class='column']"
+        ):
+            key = record_node.findtext("local-name")
+            relation = record_node.findtext("parent-name")
+            remote_name = record_node.findtext("remote-name")
+            if key and relation and remote_name:
+                fields.setdefault(key, (relation, f"[{remote_name}]"))
+        for key, (relation, column) in fields.items():
+            field_values = [datasource_name, key, relation, column]
+            self.field_map.append(dict(zip(spreadsheet_columns, field_values)))
+        logging.info("Found %s mapped fields", str(len(fields)))
+
     def find_calculations(self, datasource_node, datasource_name):
         """iterate through column nodes to find calculations"""
         # todo More efficient to do this within each connection?
-        spreadsheet_columns = [
-            "datasource",
-            "caption",
-            "name",
-            "role",
-            "calculation_type",
-            "hidden",
-            "datatype",
-            "default_format",
-            "calculation",
-            "description",
-        ]
+        spreadsheet_columns = SPREADSHEET_COLUMNS["Calculations"]
         for node in datasource_node.findall("./column[@caption][calculation]"):
             # print(node.attrib)
             caption = node.attrib["caption"]
@@ -433,22 +842,22 @@ class WorkbookDocumentation:
 
         logging.info("Found %s calculations", str(len(self.calculations)))
 
+    def find_performance_findings(self, datasource_node, calculations):
+        """lint the formulas of a data source's calculations for patterns that slow its queries.
+        References are followed into every calculation found so far"""
+        spreadsheet_columns = SPREADSHEET_COLUMNS["Performance Findings"]
+        field_types = {
+            node.attrib["name"]: node.attrib["datatype"]
+            for node in datasource_node.findall("./column[@datatype]")
+            if "name" in node.attrib
+        }
+        for finding in lint_calculations(calculations, field_types, self.calculations):
+            self.performance_findings.append(dict(zip(spreadsheet_columns, finding)))
+        logging.info("Found %s performance findings", str(len(self.performance_findings)))
+
     def find_sets(self, datasource_node, datasource_name):
         """iterate through datasource node to find sets"""
-        spreadsheet_columns = [
-            "datasource",
-            "caption",
-            "name",
-            "element",
-            "type",
-            "condition_calculation",
-            "number",
-            "end",
-            "direction",
-            "members",
-            "expression",
-            "description",
-        ]
+        spreadsheet_columns = SPREADSHEET_COLUMNS["Sets"]
 
         for set_node in datasource_node.findall(
             "./group[@{http://www.tableausoftware.com/xml/user}ui-builder='filter-group']"
@@ -519,17 +928,7 @@ class WorkbookDocumentation:
 
         worksheet_name = worksheet_node.attrib["name"]
         start_length = len(self.worksheet_columns)
-        spreadsheet_columns = [
-            "worksheet",
-            "datasource",
-            "caption",
-            "name",
-            "role",
-            "datatype",
-            "type",
-            "calculation",
-            "computation",
-        ]
+        spreadsheet_columns = SPREADSHEET_COLUMNS["Worksheet Columns"]
         for datasource_dependency_node in worksheet_node.findall(
             ".//datasource-dependencies"
         ):
@@ -541,6 +940,9 @@ class WorkbookDocumentation:
                     and "caption" in datasource_node.attrib
                 ):
                     datasource = datasource_node.attrib["caption"]
+            column_instances = COLUMN_INSTANCE_XPATH.index(
+                datasource_dependency_node, "column"
+            )
             for column_node in datasource_dependency_node.findall("./column"):
                 name = column_node.attrib["name"]
                 # print(worksheet_name + ", " + datasource + ", " + name)
@@ -557,14 +959,7 @@ class WorkbookDocumentation:
                 calc_node = column_node.find(".//calculation")
                 calculation = self._validate_attribute_(calc_node, "formula")
 
-                if name.find("'") == -1:
-                    searchstring = f"./column-instance[@column='{name}']"
-                    # print(searchstring)
-                else:
-                    searchstring = f'./column-instance[@column="{name}"]'
-                    # print(searchstring)
-
-                computation_node = datasource_dependency_node.findall(searchstring)
+                computation_node = column_instances.get(name, [])
                 computation = None
                 for column_instance in computation_node:
                     computation = self._validate_attribute_(
@@ -607,7 +1002,7 @@ class WorkbookDocumentation:
 
         worksheet_name = worksheet_node.attrib["name"]
         start_length = len(self.worksheet_columns)
-        spreadsheet_columns = ["worksheet", "caption"]
+        spreadsheet_columns = SPREADSHEET_COLUMNS["Worksheet Captions"]
         caption = ""
         for caption_node in worksheet_node.findall(
             "./layout-options/caption/formatted-text/run"
@@ -629,7 +1024,8 @@ class WorkbookDocumentation:
     def find_dashboards(self, dashboard_node):
         """iterate through dashboard nodes to find worksheets and filters"""
         dashboard_name = dashboard_node.attrib["name"]
-        spreadsheet_columns = ["dashboard", "dashboard_object", "type"]
+        spreadsheet_columns = SPREADSHEET_COLUMNS["Dashboard Objects"]
+        quick_filters = QUICK_FILTER_XPATH.index(self.root, "field")
         for node in dashboard_node.findall(".//zone[@name]"):
             # print(node.attrib)
 
@@ -638,25 +1034,8 @@ class WorkbookDocumentation:
                 object_type = "filter"
                 # print(".//style-rule[@element='quick-filter']/format[@field='" + node.attrib["param"] + "']")
 
-                # Added a check to see if the objects have an embedded single quote
-                # The current code will break if the object name has both single and double quotes
-                if node.attrib["param"].find("'") == -1:
-                    searchstring = (
-                        ".//style-rule[@element='quick-filter']/format[@field='"
-                        + node.attrib["param"]
-                        + "']"
-                    )
-                    # print(searchstring)
-                else:
-                    searchstring = (
-                        './/style-rule[@element="quick-filter"]/format[@field="'
-                        + node.attrib["param"]
-                        + '"]'
-                    )
-                    # print(searchstring)
-
                 # find the quickfilter node that has the name of the object
-                name_node = self.root.find(searchstring)
+                name_node = quick_filters.get(node.attrib["param"], [None])[0]
 
                 # found
                 if name_node is not None:
@@ -732,20 +1111,59 @@ class WorkbookDocumentation:
 
         logging.info("Found %s dashboards", str(len(self.dashboard_objects)))
 
+    def find_dashboard_cost(self, dashboard_node):
+        """estimate the render cost of a dashboard from its zones and worksheets"""
+        spreadsheet_columns = SPREADSHEET_COLUMNS["Dashboard Cost"]
+        cost = estimate_dashboard(dashboard_node, self._worksheet_profiles)
+        self.dashboard_costs.append(dict(zip(spreadsheet_columns, cost)))
+        logging.info("Estimated cost %s for %s", cost.score, cost.dashboard)
+
     def write_documentation(self, output_dir):
         """output individual object type information to separate sheets in an Excel workbook"""
         logging.info("Writing to %s", self.out_file)
         wb = self.build_excel_workbook()
         self._save_workbook(wb, self.input_file, output_dir)
 
+    def extracted_tables(self):
+        """map each extracted table's sheet name to its list of records"""
+        return {
+            sheet_name: getattr(self, attribute)
+            for sheet_name, attribute, _ in EXTRACTED_TABLES
+            if hasattr(self, attribute)
+        }
+
+    def write_tables(self, table_writer, workbook_id=None):
+        """append every extracted table to a columnar writer (see output_writers)"""
+        if workbook_id is None:
+            workbook_id = self.workbook_id
+        logging.info("Writing tables for %s", workbook_id)
+        for sheet_name, records in self.extracted_tables().items():
+            table_writer.write_table(sheet_name, workbook_id, records)
+
+    @property
+    def workbook_id(self):
+        """identifier written with each record in the columnar outputs"""
+        if isinstance(self.input_file, str):
+            return os.path.normpath(self.input_file)
+        return self.root.get("name", "")
+
     def build_excel_workbook(self):
         """create excel workbook from class"""
         wb = self._init_workbook()
         self._write_openpyxl_worksheet(wb, self.connections, "Connections")
+        self._write_openpyxl_worksheet(wb, self.datasource_access, "Data Source Access")
         self._write_openpyxl_worksheet(wb, self.parameters, "Parameters")
         self._write_openpyxl_worksheet(wb, self.tables, "Tables")
         self._write_openpyxl_worksheet(wb, self.custom_sql_queries, "Custom SQL")
+        if self.custom_sql_findings:
+            self._write_openpyxl_worksheet(
+                wb,
+                sorted(self.custom_sql_findings, key=lambda finding: -finding["score"]),
+                "Custom SQL Findings",
+            )
         self._write_openpyxl_worksheet(wb, self.columns, "Columns")
+        if self.field_map:
+            self._write_openpyxl_worksheet(wb, self.field_map, "Field Map")
         self._write_openpyxl_worksheet(wb, self.calculations, "Calculations")
         self._write_openpyxl_worksheet(wb, self.sets, "Sets")
         self._write_openpyxl_worksheet(wb, self.styles, "Style validation")
@@ -772,11 +1190,27 @@ class WorkbookDocumentation:
             self._write_openpyxl_worksheet(
                 wb, self.dashboard_objects, "Dashboard Objects"
             )
+            self._write_openpyxl_worksheet(
+                wb,
+                sorted(self.dashboard_costs, key=lambda cost: -cost["score"]),
+                "Dashboard Cost",
+            )
+        if self.assets:
+            self._write_openpyxl_worksheet(wb, self.assets, "Assets")
+        if self.performance_findings:
+            # ranked across the workbook's data sources, worst first
+            self._write_openpyxl_worksheet(
+                wb,
+                sorted(self.performance_findings, key=lambda finding: -finding["score"]),
+                "Performance Findings",
+            )
 
         return wb
 
     @staticmethod
     def _init_workbook():
+        import openpyxl
+
         wb = openpyxl.Workbook()
         wb.remove(wb["Sheet"])
         return wb
@@ -793,6 +1227,8 @@ class WorkbookDocumentation:
 
     @staticmethod
     def _write_openpyxl_worksheet(wb, extracted_data, worksheet_name):
+        from openpyxl.styles import Font
+
         curr_sheet = wb.create_sheet(worksheet_name)
         if len(extracted_data) != 0:
             for col, name in enumerate(extracted_data[0].keys()):
@@ -806,8 +1242,9 @@ class WorkbookDocumentation:
                 row_num += 1
 
 
-def workbook_documentation(in_file, output_dir, style_guide=None):
-    """initialize the class and call output"""
+def workbook_documentation(in_file, output_dir, style_guide=None, table_writer=None):
+    """initialize the class and call output.
+    When a table_writer is given the tables are appended to it instead of writing an xlsx file"""
     start_time = time.perf_counter()
 
     logging.info("Starting to process %s", in_file)
@@ -828,7 +1265,10 @@ def workbook_documentation(in_file, output_dir, style_guide=None):
     #     return
 
     # todo - try/except? doesn't seem to be the area where errors occur.
-    documentation.write_documentation(output_dir)
+    if table_writer is not None:
+        documentation.write_tables(table_writer)
+    else:
+        documentation.write_documentation(output_dir)
 
     logging.info("Finished processing %s", in_file)
     logging.info(
@@ -836,6 +1276,13 @@ def workbook_documentation(in_file, output_dir, style_guide=None):
     )
 
 
+def iter_documentation_records(in_file, style_guide=None):
+    """yield the records of a workbook or data source as they are extracted.
+    e.g. write a JSONL file with: out.writelines(r.to_json() + "\n" for r in iter_documentation_records(f))"""
+    documentation = WorkbookDocumentation(in_file, style_guide, stream=True)
+    yield from documentation.iter_records()
+
+
 def main():
     """Process files without the GUI"""
     logging.basicConfig(
@@ -0,0 +1,134 @@
+"""
+    Time the cold import of every entry point
+
+    $ python benchmark_startup.py
+    $ python benchmark_startup.py --repeat 10 --top 5 WorkbookDocumentation doc_service
+
+    Each import runs in a fresh interpreter with -X importtime, so nothing is shared between runs.
+    The report lists the median import time, the heavy optional dependencies that were loaded and,
+    with --top, the slowest modules pulled in. Heavy dependencies are meant to be imported only
+    when their feature is used; --budget makes the run fail when an entry point is slower than that
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+ENTRY_POINTS = (
+    "processworkbookdocumentation",
+    "WorkbookDocumentation",
+    "processworkbookdocumentation_support",
+    "metadata_catalog",
+    "documentation_worker",
+    "doc_service",
+    "connection_setter_cli",
+    "output_writers",
+    "connection_setter_ui",
+    "web_ui",
+    "validator.validate_styles",
+)
+# dependencies that should only load with the feature that needs them
+HEAVY_MODULES = (
+    "openpyxl",
+    "numpy",
+    "pyarrow",
+    "bs4",
+    "lxml",
+    "colorama",
+    "streamlit",
+    "tkinter",
+)
+
+# prints the loaded heavy modules on stdout once the import finishes
+IMPORT_SCRIPT = """
+import sys
+import {module}
+print(",".join(name for name in {heavy!r} if name in sys.modules))
+"""
+
+
+def parse_importtime(output):
+    """{module: (self microseconds, cumulative microseconds)} from -X importtime output"""
+    timings = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_time, cumulative, name = line[len("import time:"):].split("|", 2)
+        try:
+            timings[name.strip()] = (int(self_time), int(cumulative))
+        except ValueError:  # the header line
+            continue
+    return timings
+
+
+def time_import(module):
+    """(cumulative import microseconds, heavy modules loaded, {module: timings}) of one cold
+    import. Raises RuntimeError when the module can't be imported here"""
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES),
+        ],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    timings = parse_importtime(result.stderr)
+    loaded = [name for name in result.stdout.strip().split(",") if name]
+    return timings[module][1], loaded, timings
+
+
+def benchmark(module, repeat):
+    """median milliseconds, heavy modules loaded and the timings of the last run"""
+    runs = []
+    for _ in range(repeat):
+        cumulative, loaded, timings = time_import(module)
+        runs.append(cumulative / 1000)
+    return statistics.median(runs), loaded, timings
+
+
+def main():
+    """Print the startup cost of each entry point"""
+    parser = argparse.ArgumentParser(description="Time the cold import of each entry point")
+    parser.add_argument(
+        "modules", nargs="*", default=ENTRY_POINTS, help="Modules to import (default: all)"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per module (default: 5)")
+    parser.add_argument(
+        "--top", type=int, default=0, help="List the slowest modules each import pulls in"
+    )
+    parser.add_argument(
+        "--budget", type=float, help="Exit with an error when a median exceeds this many ms"
+    )
+    args = parser.parse_args()
+
+    over_budget = []
+    width = max(len(module) for module in args.modules)
+    for module in args.modules:
+        try:
+            median, loaded, timings = benchmark(module, args.repeat)
+        except RuntimeError as err:
+            print(f"{module:<{width}}  not importable here: {err}")
+            continue
+        print(f"{module:<{width}}  {median:8.1f} ms  {', '.join(loaded) or '-'}")
+        if args.top:
+            slowest = sorted(
+                ((self_time, name) for name, (self_time, _) in timings.items()),
+                reverse=True,
+            )
+            for self_time, name in slowest[: args.top]:
+                print(f"{'':<{width}}    {self_time / 1000:8.1f} ms  {name}")
+        if args.budget is not None and median > args.budget:
+            over_budget.append(module)
+
+    if over_budget:
+        print(f"Over the {args.budget} ms budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+"""
+Lint calculation formulas for patterns that make Tableau queries slow.
+
+Each formula is tokenized once. The walk over its tokens flags what it can see on its own and
+records the fields it references from inside COUNTD, FIXED and table calculations, so a
+calculation that reaches string logic or another FIXED through a referenced calculation is
+flagged as well:
+
+    for finding in lint_calculations(calculations, field_types):
+        finding.name, finding.rule, finding.score
+"""
+import re
+from typing import NamedTuple
+
+# comments are matched so they can be skipped, strings and #dates# so brackets and words inside
+# them aren't read as fields and functions
+FORMULA_TOKEN = re.compile(
+    r"""
+    (?P<comment>//[^\n]*|/\*.*?(?:\*/|$))
+    |(?P<string>'(?:[^']|'')*'?|"(?:[^"]|"")*"?)
+    |(?P<field>\[(?:[^\]]|\]\])*\](?:\.\[(?:[^\]]|\]\])*\])*)
+    |(?P<date>\#[^#\n]*\#)
+    |(?P<number>\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)
+    |(?P<word>[A-Za-z_]\w*)
+    |(?P<symbol><>|<=|>=|!=|==|[^\s\w])
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+STRING_FUNCTIONS = frozenset(
+    """ASCII CHAR CONTAINS ENDSWITH FIND FINDNTH LEFT LEN LOWER LTRIM MID PROPER REPLACE RIGHT
+    RTRIM SPACE SPLIT STARTSWITH STR TRIM UPPER REGEXP_EXTRACT REGEXP_EXTRACT_NTH REGEXP_MATCH
+    REGEXP_REPLACE""".split()
+)
+TABLE_CALC_FUNCTIONS = frozenset(
+    """FIRST INDEX LAST LOOKUP PREVIOUS_VALUE RANK RANK_DENSE RANK_MODIFIED RANK_PERCENTILE
+    RANK_UNIQUE RUNNING_AVG RUNNING_COUNT RUNNING_MAX RUNNING_MIN RUNNING_SUM SIZE
+    TOTAL""".split()
+)
+LOD_KEYWORDS = frozenset(("FIXED", "INCLUDE", "EXCLUDE"))
+# literals a CASE can test against
+LITERAL_TOKENS = frozenset(("string", "number", "date"))
+# datatypes and field names (ids, keys, free text, timestamps) that usually have many values
+HIGH_CARDINALITY_DATATYPES = frozenset(("datetime",))
+HIGH_CARDINALITY_NAME = re.compile(
+    r"\b(?:id|key|guid|uuid|code|email|name|number|no|date|time|timestamp|address|phone)\b",
+    re.IGNORECASE,
+)
+# ELSEIF branches before an IF chain on a single field is better written as CASE
+IF_CHAIN_ELSEIFS = 3
+
+# rule: (severity, weight per occurrence, description)
+RULES = {
+    "countd_string": (
+        "high",
+        8,
+        "COUNTD of a string built row by row. Count a numeric key or precompute the string",
+    ),
+    "nested_fixed": (
+        "high",
+        6,
+        "FIXED LOD inside another FIXED LOD. Each level is a separate subquery joined back",
+    ),
+    "table_calc_string": (
+        "high",
+        5,
+        "table calculation over row-level string logic, evaluated for every row it is fed",
+    ),
+    "attr_high_cardinality": (
+        "medium",
+        4,
+        "ATTR of a field with many values. ATTR computes MIN and MAX over every row",
+    ),
+    "if_chain": (
+        "low",
+        2,
+        "IF/ELSEIF chain testing one field for equality. CASE evaluates the field once",
+    ),
+}
+
+
+class Finding(NamedTuple):
+    """a pattern found in a calculation's formula. score ranks findings across calculations"""
+
+    datasource: str
+    caption: str
+    name: str
+    rule: str
+    severity: str
+    score: int
+    detail: str
+    calculation: str
+
+
+def tokenize_formula(formula: str) -> list:
+    """(kind, text) tokens of a formula without comments and whitespace. Words are upper cased"""
+    return [
+        (match.lastgroup, match.group().upper() if match.lastgroup == "word" else match.group())
+        for match in FORMULA_TOKEN.finditer(formula or "")
+        if match.lastgroup != "comment"
+    ]
+
+
+def field_name(reference: str) -> str:
+    """[Field] of a field reference, without the data source of [Data Source].[Field]"""
+    return "[" + reference.rsplit("].[", 1)[-1].lstrip("[")
+
+
+def is_high_cardinality(name: str, datatype: str = "") -> bool:
+    """True for fields that likely hold many distinct values"""
+    return datatype in HIGH_CARDINALITY_DATATYPES or bool(
+        HIGH_CARDINALITY_NAME.search(name.strip("[]").replace("_", " "))
+    )
+
+
+class _Scope:
+    """an open parenthesis or LOD brace while walking a formula"""
+
+    __slots__ = ("kind", "string_functions", "comparisons", "references")
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.string_functions = set()
+        self.comparisons = False
+        self.references = []
+
+
+class FormulaAnalysis:
+    """What one walk over a formula's tokens found: direct findings as (rule, detail) and, for
+    the checks that follow references, the fields referenced inside COUNTD, FIXED and table
+    calculations"""
+
+    def __init__(self, formula: str, field_types=None):
+        self.tokens = tokenize_formula(formula)
+        self.field_types = field_types or {}
+        self.findings = []
+        self.references = set()
+        # string manipulation (functions or concatenation) anywhere in the formula
+        self.string_functions = set()
+        self.string_comparisons = False
+        self.has_fixed = False
+        # table calculation function calls
+        self.table_calcs = 0
+        self.countd_references = []
+        self.fixed_references = []
+        self.table_calc_references = []
+        self._walk()
+
+    def _walk(self):
+        tokens = self.tokens
+        scopes = []
+        # open IF and CASE blocks: [keyword, condition tokens, subjects, elseif count]
+        blocks = []
+        condition = None
+        for position, (kind, text) in enumerate(tokens):
+            previous = tokens[position - 1] if position else ("", "")
+            following = tokens[position + 1] if position + 1 < len(tokens) else ("", "")
+            if condition is not None and not (kind == "word" and text == "THEN"):
+                condition.append((kind, text))
+
+            if kind == "field":
+                name = field_name(text)
+                self.references.add(name)
+                for scope in scopes:
+                    scope.references.append(name)
+            elif kind == "word" and text in ("IF", "CASE"):
+                blocks.append([text, [], [], 0])
+                if text == "IF":
+                    condition = blocks[-1][1]
+            elif kind == "word" and text == "ELSEIF" and blocks:
+                blocks[-1][3] += 1
+                blocks[-1][1] = condition = []
+            elif kind == "word" and text == "THEN" and condition is not None:
+                blocks[-1][2].append(self._case_subject(condition))
+                condition = None
+            elif kind == "word" and text == "END" and blocks:
+                self._end_block(*blocks.pop())
+            elif kind == "word" and following[1] == "(" and text in STRING_FUNCTIONS:
+                self._string_logic(scopes, text)
+            elif text == "+" and kind == "symbol" and (
+                previous[0] == "string" or following[0] == "string"
+            ):
+                self._string_logic(scopes, "+")
+            elif text in ("=", "==", "<>", "!=") and (
+                previous[0] == "string" or following[0] == "string"
+            ):
+                self.string_comparisons = True
+                for scope in scopes:
+                    scope.comparisons = True
+            elif text == "(":
+                scopes.append(_Scope(previous[1] if previous[0] == "word" else "("))
+            elif text == "{":
+                # {SUM([Sales])} without a keyword is a FIXED over the whole table
+                lod = following[1] if following[1] in LOD_KEYWORDS else "FIXED"
+                if lod == "FIXED":
+                    if any(scope.kind == "FIXED" for scope in scopes):
+                        self.findings.append(("nested_fixed", "FIXED written inside FIXED"))
+                    self.has_fixed = True
+                scopes.append(_Scope(lod))
+            elif text in (")", "}") and scopes:
+                self._close(scopes.pop(), tokens[position - 1] if position else None)
+
+    def _string_logic(self, scopes, function):
+        self.string_functions.add(function)
+        for scope in scopes:
+            scope.string_functions.add(function)
+
+    def _close(self, scope, last_token):
+        if scope.kind == "COUNTD":
+            self.countd_references.extend(scope.references)
+            if scope.string_functions:
+                self.findings.append(
+                    ("countd_string", "COUNTD over " + ", ".join(sorted(scope.string_functions)))
+                )
+        elif scope.kind == "FIXED":
+            self.fixed_references.extend(scope.references)
+        elif scope.kind in TABLE_CALC_FUNCTIONS or scope.kind.startswith("WINDOW_"):
+            self.table_calcs += 1
+            self.table_calc_references.extend(scope.references)
+            if scope.string_functions or scope.comparisons:
+                logic = sorted(scope.string_functions) + (
+                    ["string comparison"] if scope.comparisons else []
+                )
+                self.findings.append(
+                    ("table_calc_string", f"{scope.kind} over " + ", ".join(logic))
+                )
+        elif (
+            scope.kind == "ATTR"
+            and len(scope.references) == 1
+            and last_token is not None
+            and last_token[0] == "field"
+        ):
+            name = scope.references[0]
+            if is_high_cardinality(name, self.field_types.get(name, "")):
+                self.findings.append(("attr_high_cardinality", f"ATTR({name})"))
+
+    @staticmethod
+    def _case_subject(condition):
+        """the expression a condition tests when it is `expression = literal`, optionally OR-ed
+        with more tests of the same expression. None when CASE couldn't express it"""
+        subjects = set()
+        depth = 0
+        test = []
+        for kind, text in condition + [("word", "OR")]:
+            if text in ("(", "{"):
+                depth += 1
+            elif text in (")", "}"):
+                depth -= 1
+            if depth or not (kind == "word" and text == "OR"):
+                test.append((kind, text))
+                continue
+            equals = [i for i, (_, token) in enumerate(test) if token in ("=", "==")]
+            if len(equals) != 1 or equals[0] != len(test) - 2:
+                return None
+            if len(test) < 3 or test[-1][0] not in LITERAL_TOKENS:
+                return None
+            subjects.add(tuple(text for _, text in test[:-2]))
+            test = []
+        return subjects.pop() if len(subjects) == 1 else None
+
+    def _end_block(self, keyword, _, subjects, elseifs):
+        if (
+            keyword == "IF"
+            and elseifs >= IF_CHAIN_ELSEIFS
+            and subjects[0] is not None
+            and subjects.count(subjects[0]) == len(subjects)
+        ):
+            self.findings.append(
+                ("if_chain", f"{elseifs + 1} branches testing {''.join(subjects[0])}")
+            )
+
+
+def _reaches(name, analyses, attribute, seen=None):
+    """True when the calculation name, or one it references, has attribute set"""
+    analysis = analyses.get(name)
+    if analysis is None:
+        return False
+    if getattr(analysis, attribute):
+        return True
+    seen = seen if seen is not None else set()
+    seen.add(name)
+    return any(
+        _reaches(reference, analyses, attribute, seen)
+        for reference in analysis.references
+        if reference not in seen
+    )
+
+
+def lint_calculations(calculations, field_types=None, context=None) -> list:
+    """
+    Findings for calculations (dicts with datasource, caption, name and calculation, as in
+    the Calculations sheet), highest score first. field_types maps field names to datatypes,
+    for the cardinality check. context is a wider list of calculations (e.g. the whole
+    workbook's) that references are followed into; by default only calculations itself
+    """
+    analyses = {}
+    for calculation in context if context is not None else calculations:
+        analyses[calculation["name"]] = FormulaAnalysis(calculation["calculation"], field_types)
+    for calculation in calculations:
+        analyses.setdefault(
+            calculation["name"], FormulaAnalysis(calculation["calculation"], field_types)
+        )
+
+    findings = []
+    for calculation in calculations:
+        analysis = analyses[calculation["name"]]
+        found = list(analysis.findings)
+        for reference in dict.fromkeys(analysis.countd_references):
+            if _reaches(reference, analyses, "string_functions"):
+                found.append(("countd_string", f"COUNTD over {reference}, built from strings"))
+        for reference in dict.fromkeys(analysis.fixed_references):
+            if reference != calculation["name"] and _reaches(reference, analyses, "has_fixed"):
+                found.append(("nested_fixed", f"FIXED over {reference}, itself a FIXED LOD"))
+        for reference in dict.fromkeys(analysis.table_calc_references):
+            if _reaches(reference, analyses, "string_functions") or _reaches(
+                reference, analyses, "string_comparisons"
+            ):
+                found.append(
+                    ("table_calc_string", f"table calculation over {reference}, string logic")
+                )
+
+        for rule, details in _group(found).items():
+            severity, weight, description = RULES[rule]
+            findings.append(
+                Finding(
+                    calculation["datasource"],
+                    calculation["caption"],
+                    calculation["name"],
+                    rule,
+                    severity,
+                    weight * len(details),
+                    f"{description}: " + "; ".join(details),
+                    calculation["calculation"],
+                )
+            )
+    return sorted(findings, key=lambda finding: -finding.score)
+
+
+def _group(found):
+    """{rule: [details]} of (rule, detail) pairs, keeping the first occurrence order"""
+    grouped = {}
+    for rule, detail in found:
+        if detail not in grouped.setdefault(rule, []):
+            grouped[rule].append(detail)
+    return grouped
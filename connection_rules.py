@@ -0,0 +1,201 @@
+"""
+Declarative connection rewrite rules applied in a single traversal of a workbook or data source.
+
+Connection rules set attributes on <connection> elements of a given class, relation rules move
+[schema].[table] relations to a new schema. To handle another connection class register it:
+
+    register_connection_class("postgres", {"server": "database_server", "dbname": "database_schema"})
+
+    changes = ConnectionRewriter(server_info).apply(root)
+    changes, custom_sql = repoint_document("Sales.twbx", server_info, "Sales updated.twbx")
+"""
+import os
+import re
+import zipfile
+from typing import NamedTuple
+
+from Handle_twbx import find_file_in_zip, rewrite_archive
+from custom_sql import RELATION_TAGS, find_custom_sql
+from xml_patch import parse_with_offsets, patch_attributes
+
+# [schema].[table] in a relation's table attribute
+SCHEMA_TABLE = re.compile(r"\[(.*)\]\.\[(.*)\]")
+
+# server_info keys that must all be filled in before database connections are changed
+DATABASE_FIELDS = ("database_server", "database_schema", "database_user")
+
+
+class ConnectionRule(NamedTuple):
+    """set attributes on connections of one class found directly under parent_tag"""
+
+    parent_tag: str
+    connection_class: str
+    attributes: dict  # connection attribute -> server_info key
+    required: tuple = ()  # server_info keys that must be set for the rule to apply
+
+
+class Change(NamedTuple):
+    """one attribute changed by a rewrite"""
+
+    tag: str
+    name: str
+    attribute: str
+    old: str
+    new: str
+    element: object = None  # the changed element, e.g. for xml_patch.patch_attributes
+
+    def describe(self) -> str:
+        """one line summary, e.g. for a dry run"""
+        return f"{self.tag}[{self.name}] {self.attribute}: {self.old!r} -> {self.new!r}"
+
+
+CONNECTION_RULES = [
+    # published data sources on Tableau Server
+    ConnectionRule(
+        "datasource",
+        "sqlproxy",
+        {"server": "tableau_server", "site": "tableau_site"},
+        ("tableau_server",),
+    ),
+    # direct database connections
+    ConnectionRule(
+        "named-connection",
+        "vertica",
+        {
+            "server": "database_server",
+            "schema": "database_schema",
+            "username": "database_user",
+        },
+        DATABASE_FIELDS,
+    ),
+]
+
+
+def register_connection_class(
+    connection_class, attributes, parent_tag="named-connection", required=DATABASE_FIELDS
+):
+    """add a rule for another database connection class"""
+    CONNECTION_RULES.append(
+        ConnectionRule(parent_tag, connection_class, attributes, required)
+    )
+
+
+class ConnectionRewriter:
+    """Apply connection and relation schema rules to a tree in one pass"""
+
+    def __init__(self, server_info, rules=None, relation_tags=RELATION_TAGS):
+        self.server_info = server_info
+        # (parent tag, connection class) -> rule, for the rules with everything they need
+        self.connection_rules = {
+            (rule.parent_tag, rule.connection_class): rule
+            for rule in (CONNECTION_RULES if rules is None else rules)
+            if all(server_info.get(key) for key in rule.required)
+        }
+        # relations only move schema along with the database connection details
+        self.schema = (
+            server_info["database_schema"]
+            if all(server_info.get(key) for key in DATABASE_FIELDS)
+            else None
+        )
+        self.relation_tags = frozenset(relation_tags) if self.schema else frozenset()
+
+    @staticmethod
+    def _set(element, parent, attribute, value, changes):
+        old = element.get(attribute)
+        if old != value:
+            element.set(attribute, value)
+            # connections are unnamed, so they are described by their data source
+            name = element.get("name") or parent.get("caption") or parent.get("name")
+            changes.append(
+                Change(element.tag, name or "", attribute, old, value, element)
+            )
+
+    def apply(self, root) -> list:
+        """rewrite the tree in place and return the list of Changes"""
+        changes = []
+        connection_rules = self.connection_rules
+        relation_tags = self.relation_tags
+        for parent in root.iter():
+            parent_tag = parent.tag
+            for element in parent:
+                tag = element.tag
+                if tag == "connection":
+                    rule = connection_rules.get((parent_tag, element.get("class")))
+                    if rule is not None:
+                        for attribute, key in rule.attributes.items():
+                            if self.server_info.get(key) is not None:
+                                self._set(
+                                    element,
+                                    parent,
+                                    attribute,
+                                    self.server_info[key],
+                                    changes,
+                                )
+                elif tag in relation_tags:
+                    table_name = element.get("table")
+                    match = SCHEMA_TABLE.search(table_name) if table_name else None
+                    if match:
+                        self._set(
+                            element,
+                            parent,
+                            "table",
+                            f"[{self.schema}].[{match.group(2)}]",
+                            changes,
+                        )
+        return changes
+
+
+def rewrite_connections(root, server_info) -> list:
+    """apply the registered rules for server_info to root. Returns the list of Changes"""
+    return ConnectionRewriter(server_info).apply(root)
+
+
+def custom_sql_to_review(root, server_info, file_name="") -> list:
+    """Custom SQL the rules can't rewrite: queries naming tables in another schema when
+    relations are being moved to server_info's database_schema"""
+    if not all(server_info.get(key) for key in DATABASE_FIELDS):
+        return []
+    schema = server_info["database_schema"]
+    return [
+        query
+        for query in find_custom_sql(root, file_name)
+        if query.schema_references(schema)
+    ]
+
+
+def repoint_document(source, server_info, target=None) -> tuple:
+    """Apply the rules to a workbook or data source, packaged or not. source and target are
+    paths or binary file objects. Only the changed attribute values are rewritten, and the
+    other members of a packaged file are copied raw. With no target nothing is written,
+    e.g. for a dry run. Returns (Changes, CustomSqlQuery list to fix by hand), both from the
+    one parse of the document"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as source_file:
+            return repoint_document(source_file, server_info, target)
+
+    member_name = None
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as zip_file:
+            member_name = find_file_in_zip(zip_file)
+            data = zip_file.read(member_name)
+    else:
+        source.seek(0)
+        data = source.read()
+
+    root, offsets = parse_with_offsets(data)
+    changes = rewrite_connections(root, server_info)
+    custom_sql = custom_sql_to_review(root, server_info, getattr(source, "name", ""))
+    if target is None:
+        return changes, custom_sql
+
+    patched = patch_attributes(
+        data, offsets, [(change.element, change.attribute, change.new) for change in changes]
+    )
+    if member_name is not None:
+        rewrite_archive(source, target, member_name, patched)
+    elif isinstance(target, (str, os.PathLike)):
+        with open(target, "wb") as target_file:
+            target_file.write(patched)
+    else:
+        target.write(patched)
+    return changes, custom_sql
@@ -0,0 +1,186 @@
+"""
+    Apply a connection profile to many workbooks and data sources from the command line
+
+    $ python connection_setter_cli.py --profile profile.json datasources/ --dry-run
+    $ python connection_setter_cli.py --profile profile.json datasources/ --in-place
+    $ python connection_setter_cli.py --profile profile.json datasources/ --output-dir migrated/
+
+    profile.json holds the same fields as the connection setter web form:
+    {"tableau_server": "...", "tableau_site": "...",
+     "database_server": "...", "database_schema": "...", "database_user": "..."}
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os.path import splitext, basename
+
+from connection_rules import repoint_document
+
+PROFILE_FIELDS = (
+    "tableau_server",
+    "tableau_site",
+    "database_server",
+    "database_schema",
+    "database_user",
+)
+TABLEAU_EXTENSIONS = (".twb", ".twbx", ".tds", ".tdsx")
+
+
+def find_files(paths):
+    """expand files and directories (recursively) into (path, path relative to its root)"""
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, _, files in os.walk(path):
+                for name in sorted(files):
+                    stem, extension = splitext(name)
+                    # skip the copies written by an earlier side by side run
+                    if extension.lower() in TABLEAU_EXTENSIONS and not stem.endswith(
+                        " updated"
+                    ):
+                        full_path = os.path.join(dir_path, name)
+                        yield full_path, os.path.relpath(full_path, path)
+        else:
+            yield path, basename(path)
+
+
+def side_by_side_name(path):
+    """updated copy next to the original, named like the web UI's downloads"""
+    root, extension = splitext(path)
+    return f"{root} updated{extension}"
+
+
+def repoint_file(path, server_info, output_path=None, in_place=False):
+    """Apply server_info to one file.
+    Returns (path, [change descriptions], [custom SQL to review], error).
+    Nothing is written when output_path is None and in_place is False"""
+    try:
+        if in_place:
+            # write next to the original and swap in only when something changed,
+            # so unchanged files and failures leave the original untouched
+            fd, temp_name = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp"
+            )
+            os.close(fd)
+            try:
+                changes, custom_sql = repoint_document(path, server_info, temp_name)
+                if changes:
+                    os.replace(temp_name, path)
+            finally:
+                if os.path.exists(temp_name):
+                    os.remove(temp_name)
+        elif output_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+            changes, custom_sql = repoint_document(path, server_info, output_path)
+        else:
+            changes, custom_sql = repoint_document(path, server_info)
+    except Exception as err:  # reported per file so one bad file doesn't stop the batch
+        return path, [], [], f"{type(err).__name__}: {err}"
+    schema = server_info.get("database_schema")
+    return (
+        path,
+        [change.describe() for change in changes],
+        [
+            f"custom SQL {query.datasource}[{query.name}] reads "
+            + ", ".join(str(table) for table in query.schema_references(schema))
+            for query in custom_sql
+        ],
+        None,
+    )
+
+
+def load_profile(args):
+    """server_info from the profile file, overridden by any command line values"""
+    server_info = {}
+    if args.profile:
+        with open(args.profile, encoding="utf-8") as f:
+            server_info.update(json.load(f))
+    for field in PROFILE_FIELDS:
+        value = getattr(args, field)
+        if value is not None:
+            server_info[field] = value
+    return server_info
+
+
+def main():
+    """Repoint connections from the command line"""
+    parser = argparse.ArgumentParser(
+        description="Apply a connection profile to Tableau workbooks and data sources"
+    )
+    parser.add_argument("--profile", help="json file of connection settings")
+    parser.add_argument("paths", nargs="+", help="Files or directories to update")
+    for field in PROFILE_FIELDS:
+        parser.add_argument(
+            f"--{field.replace('_', '-')}", dest=field, help="overrides the profile"
+        )
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument(
+        "--dry-run", action="store_true", help="Print the changes without writing files"
+    )
+    output.add_argument(
+        "--in-place", action="store_true", help="Overwrite the original files"
+    )
+    output.add_argument(
+        "--output-dir",
+        help="Write updated files here, keeping the directory structure. "
+        "By default updated copies are written next to the originals",
+    )
+    parser.add_argument("--workers", type=int, help="Worker processes (default: CPUs)")
+    args = parser.parse_args()
+
+    server_info = load_profile(args)
+    start_time = time.perf_counter()
+    changed, unchanged, errors, to_review = 0, 0, [], []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = []
+        for path, relative_path in find_files(args.paths):
+            if args.dry_run or args.in_place:
+                output_path = None
+            elif args.output_dir:
+                output_path = os.path.join(args.output_dir, relative_path)
+            else:
+                output_path = side_by_side_name(path)
+            futures.append(
+                executor.submit(
+                    repoint_file, path, server_info, output_path, args.in_place
+                )
+            )
+
+        for future in as_completed(futures):
+            path, changes, custom_sql, error = future.result()
+            if error:
+                errors.append((path, error))
+                continue
+            if custom_sql:
+                to_review.append((path, custom_sql))
+            if changes:
+                changed += 1
+            else:
+                unchanged += 1
+            if args.dry_run and changes:
+                print(path)
+                for change in changes:
+                    print(f"    {change}")
+
+    action = "would change" if args.dry_run else "changed"
+    print(
+        f"{changed} files {action}, {unchanged} unchanged, {len(errors)} errors "
+        f"in {round(time.perf_counter() - start_time, 2)} seconds"
+    )
+    if to_review:
+        print(f"{len(to_review)} files have custom SQL to update by hand:")
+        for path, custom_sql in to_review:
+            print(path)
+            for query in custom_sql:
+                print(f"    {query}")
+    for path, error in errors:
+        print(f"Error: {path}: {error}")
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+"""
+Find custom SQL in workbooks and data sources, the tables it reads and how it will perform.
+
+Custom SQL relations (relation type='text') hold a query rather than a table name, so the
+connection rewrite rules can't move them to a new schema. find_custom_sql collects them in one
+walk of the parsed tree and table_references tokenizes each query for the tables it names.
+analyze_sql reads the same tokens for patterns that make the query slow once Tableau wraps it
+as a subquery of its own queries:
+
+    for query in find_custom_sql(root):
+        query.tables  # (TableReference(database, schema, table), ...)
+        query.findings()  # (SqlFinding(rule, severity, score, detail), ...)
+"""
+import re
+from os.path import basename, splitext
+from typing import NamedTuple
+
+# relation tags of the plain and the object model (legacy encapsulated) layouts
+RELATION_TAGS = frozenset(
+    (
+        "relation",
+        "_.fcp.ObjectModelEncapsulateLegacy.false...relation",
+        "_.fcp.ObjectModelEncapsulateLegacy.true...relation",
+    )
+)
+
+# comments and string literals are matched so they can be skipped as a whole
+SQL_TOKEN = re.compile(
+    r"""
+    (?P<comment>--[^\n]*|/\*.*?(?:\*/|$))
+    |(?P<string>'(?:[^']|'')*'?)
+    |(?P<identifier>"(?:[^"]|"")*"|\[(?:[^\]]|\]\])*\]|`[^`]*`|[A-Za-z_@#][\w@#$]*)
+    |(?P<number>\d+(?:\.\d+)?)
+    |(?P<symbol><>|<=|>=|!=|\|\||::|[^\s\w])
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+# keywords followed by a table name, and the FROM clause that can list several of them
+TABLE_KEYWORDS = frozenset(("from", "join", "into", "update", "table"))
+# words that end a FROM list or can't be an alias
+CLAUSE_KEYWORDS = frozenset(
+    """where group order having union intersect except limit join inner left right full
+    outer cross on using natural lateral select from window qualify fetch offset for set
+    values returning""".split()
+)
+# functions that use FROM inside their arguments, e.g. EXTRACT(YEAR FROM [Order Date])
+FROM_FUNCTIONS = frozenset(("extract", "substring", "trim", "position", "overlay"))
+# keywords that keep an ORDER BY meaningful inside a subquery
+LIMIT_KEYWORDS = frozenset(("top", "limit", "fetch", "offset"))
+# select list columns from which a DISTINCT compares rows that are too wide
+WIDE_SELECT_COLUMNS = 8
+
+# rule: (severity, score, description)
+SQL_RULES = {
+    "correlated_subquery": (
+        "high",
+        6,
+        "correlated subquery, run once per outer row. Rewrite as a join",
+    ),
+    "order_by_subquery": (
+        "high",
+        5,
+        "ORDER BY without a row limit. Tableau queries custom SQL as a subquery, so the sort is "
+        "wasted work and some databases reject it",
+    ),
+    "missing_predicate": (
+        "medium",
+        4,
+        "no WHERE clause, every row of the tables is read before Tableau filters",
+    ),
+    "distinct_wide": (
+        "medium",
+        4,
+        "DISTINCT over a wide selection, sorting or hashing every column of every row",
+    ),
+    "select_star": (
+        "medium",
+        3,
+        "SELECT * fetches columns no sheet uses and breaks when the table changes",
+    ),
+    "union_without_all": (
+        "low",
+        3,
+        "UNION removes duplicates with a sort. Use UNION ALL when the branches can't overlap",
+    ),
+}
+
+
+class TableReference(NamedTuple):
+    """a table named in a query. database and schema are empty when not given"""
+
+    database: str
+    schema: str
+    table: str
+
+    @property
+    def qualified(self) -> bool:
+        """True when the reference names its schema"""
+        return bool(self.schema)
+
+    def __str__(self):
+        return ".".join(part for part in self if part)
+
+
+class SqlFinding(NamedTuple):
+    """a pattern in a query that hurts performance. score ranks findings across queries"""
+
+    rule: str
+    severity: str
+    score: int
+    detail: str
+
+
+class CustomSqlQuery(NamedTuple):
+    """a custom SQL relation"""
+
+    datasource: str
+    connection: str
+    name: str
+    sql: str
+    tables: tuple
+
+    def findings(self) -> tuple:
+        """performance findings for the query (see analyze_sql)"""
+        return analyze_sql(self.sql)
+
+    def schema_references(self, schema=None) -> list:
+        """schema qualified tables, only those outside schema when it is given"""
+        return [
+            table
+            for table in self.tables
+            if table.qualified
+            and (schema is None or unquote(table.schema).lower() != schema.lower())
+        ]
+
+
+def unquote(identifier: str) -> str:
+    """identifier without "", [] or `` quoting"""
+    if identifier[:1] == '"' and identifier[-1:] == '"':
+        return identifier[1:-1].replace('""', '"')
+    if identifier[:1] == "[" and identifier[-1:] == "]":
+        return identifier[1:-1].replace("]]", "]")
+    if identifier[:1] == "`" and identifier[-1:] == "`":
+        return identifier[1:-1]
+    return identifier
+
+
+def tokenize_sql(sql: str):
+    """(kind, text) tokens of a query, without comments and whitespace"""
+    for match in SQL_TOKEN.finditer(sql or ""):
+        if match.lastgroup != "comment":
+            yield match.lastgroup, match.group()
+
+
+def _read_name(tokens, position):
+    """dotted identifier starting at position: (parts, next position)"""
+    parts = []
+    while position < len(tokens):
+        kind, text = tokens[position]
+        if kind != "identifier":
+            break
+        parts.append(text)
+        position += 1
+        if position < len(tokens) and tokens[position] == ("symbol", "."):
+            position += 1
+        else:
+            break
+    return parts, position
+
+
+def table_references(sql: str) -> tuple:
+    """tables named after FROM, JOIN, INTO, UPDATE and TABLE, including comma separated FROM
+    lists. Subqueries are skipped over and their own FROM clauses picked up as they're read"""
+    tokens = list(tokenize_sql(sql))
+    references = []
+    # the token before each open parenthesis, to tell function arguments from subqueries
+    parentheses = []
+    position = 0
+    while position < len(tokens):
+        kind, text = tokens[position]
+        position += 1
+        if text == "(":
+            parentheses.append(tokens[position - 2][1].lower() if position > 1 else "")
+            continue
+        if text == ")":
+            if parentheses:
+                parentheses.pop()
+            continue
+        if kind != "identifier" or text.lower() not in TABLE_KEYWORDS:
+            continue
+        if parentheses and parentheses[-1] in FROM_FUNCTIONS:
+            continue
+        in_from_list = text.lower() == "from"
+        while True:
+            parts, position = _read_name(tokens, position)
+            if parts and parts[-1].lower() not in CLAUSE_KEYWORDS:
+                parts = [""] * (3 - len(parts)) + parts[-3:]
+                references.append(TableReference(*parts))
+            # skip an alias
+            if position < len(tokens) and tokens[position][1].lower() == "as":
+                position += 1
+            if (
+                position < len(tokens)
+                and tokens[position][0] == "identifier"
+                and tokens[position][1].lower() not in CLAUSE_KEYWORDS
+            ):
+                position += 1
+            if (
+                in_from_list
+                and position < len(tokens)
+                and tokens[position] == ("symbol", ",")
+            ):
+                position += 1
+                continue
+            break
+    return tuple(dict.fromkeys(references))
+
+
+class _QueryBlock:
+    """one SELECT (or UNION branch) while its tokens are read"""
+
+    __slots__ = (
+        "parent",
+        "level",
+        "clause",
+        "aliases",
+        "qualifiers",
+        "tables",
+        "has_from",
+        "has_where",
+        "has_limit",
+        "order_by",
+        "distinct",
+        "select_star",
+        "columns",
+        "union",
+    )
+
+    def __init__(self, parent, level):
+        self.parent = parent
+        # parenthesis depth of the block's own tokens
+        self.level = level
+        self.clause = ""
+        self.aliases = set()
+        self.qualifiers = set()
+        self.tables = []
+        self.has_from = self.has_where = self.has_limit = False
+        self.order_by = self.distinct = self.select_star = False
+        self.columns = 0
+        # True for a branch joined to the one before it by UNION rather than UNION ALL
+        self.union = False
+
+    def outer_aliases(self):
+        """table names and aliases of the enclosing queries"""
+        aliases = set()
+        block = self.parent
+        while block is not None:
+            aliases |= block.aliases
+            block = block.parent
+        return aliases
+
+
+def _read_from_item(tokens, position, block):
+    """record the table and alias of a FROM or JOIN item at position. Returns the position
+    after it; a subquery's opening parenthesis is left for the caller"""
+    parts, position = _read_name(tokens, position)
+    if not parts or parts[-1].lower() in CLAUSE_KEYWORDS:
+        return position - len(parts) if parts else position
+    block.tables.append(".".join(parts))
+    block.aliases.add(unquote(parts[-1]).lower())
+    return _read_alias(tokens, position, block)
+
+
+def _read_alias(tokens, position, block):
+    if position < len(tokens) and tokens[position][1].lower() == "as":
+        position += 1
+    if (
+        position < len(tokens)
+        and tokens[position][0] == "identifier"
+        and tokens[position][1].lower() not in CLAUSE_KEYWORDS
+    ):
+        block.aliases.add(unquote(tokens[position][1]).lower())
+        position += 1
+    return position
+
+
+def _query_blocks(tokens) -> list:
+    """the SELECT blocks of a query, each UNION branch and subquery its own block"""
+    blocks = []
+    block = _QueryBlock(None, 0)
+    depth = 0
+    position = 0
+    while position < len(tokens):
+        kind, text = tokens[position]
+        word = text.lower() if kind == "identifier" else ""
+        following = tokens[position + 1][1].lower() if position + 1 < len(tokens) else ""
+        position += 1
+        if text == "(":
+            depth += 1
+            if following in ("select", "with"):
+                block = _QueryBlock(block, depth)
+            continue
+        if text == ")":
+            if block.parent is not None and block.level == depth:
+                blocks.append(block)
+                block = block.parent
+                # a derived table's alias
+                if block.clause == "from":
+                    position = _read_alias(tokens, position, block)
+            depth -= 1
+            continue
+        if depth != block.level:
+            # function arguments and window specifications
+            continue
+        if word in ("union", "intersect", "except"):
+            blocks.append(block)
+            block = _QueryBlock(block.parent, block.level)
+            block.union = word == "union" and following != "all"
+            continue
+        if word == "select":
+            block.clause = "select"
+            block.columns = 1
+            continue
+        if block.clause == "select":
+            if word == "distinct":
+                block.distinct = True
+            elif word == "top":
+                block.has_limit = True
+            elif text == ",":
+                block.columns += 1
+            elif text == "*" and tokens[position - 2][1].lower() in (
+                "select",
+                "distinct",
+                "all",
+                ",",
+                ".",
+            ):
+                block.select_star = True
+        if word in ("from", "join"):
+            block.clause = "from"
+            block.has_from = True
+            position = _read_from_item(tokens, position, block)
+            continue
+        if text == "," and block.clause == "from":
+            position = _read_from_item(tokens, position, block)
+            continue
+        if word == "where":
+            block.has_where = True
+        elif word == "order" and following == "by":
+            block.order_by = True
+        elif word in LIMIT_KEYWORDS:
+            block.has_limit = True
+        if word in CLAUSE_KEYWORDS and word not in ("on", "using"):
+            block.clause = word
+        if kind == "identifier" and following == ".":
+            block.qualifiers.add(unquote(text).lower())
+    blocks.append(block)
+    return blocks
+
+
+def analyze_sql(sql: str) -> tuple:
+    """performance findings for a query, highest score first. Comments and string literals
+    are skipped with the tokenizer used for table_references"""
+    tokens = list(tokenize_sql(sql))
+    blocks = _query_blocks(tokens)
+    found = []
+    for block in blocks:
+        tables = ", ".join(block.tables) or "a subquery"
+        if block.select_star:
+            found.append(("select_star", f"SELECT * from {tables}"))
+        if block.distinct and (block.select_star or block.columns >= WIDE_SELECT_COLUMNS):
+            columns = "*" if block.select_star else f"{block.columns} columns"
+            found.append(("distinct_wide", f"DISTINCT over {columns} from {tables}"))
+        if block.order_by and not block.has_limit:
+            found.append(("order_by_subquery", f"ORDER BY over {tables}"))
+        if (
+            block.parent is None
+            and block.has_from
+            and not block.has_where
+            and not block.has_limit
+        ):
+            found.append(("missing_predicate", f"reads {tables} unfiltered"))
+        if block.parent is not None:
+            correlated = (block.qualifiers - block.aliases) & block.outer_aliases()
+            if correlated:
+                found.append(
+                    (
+                        "correlated_subquery",
+                        f"subquery over {tables} references {', '.join(sorted(correlated))}",
+                    )
+                )
+        if block.union:
+            found.append(("union_without_all", f"UNION before the branch reading {tables}"))
+
+    findings = {}
+    for rule, detail in found:
+        severity, score, description = SQL_RULES[rule]
+        if rule in findings:
+            previous = findings[rule]
+            findings[rule] = previous._replace(
+                score=previous.score + score, detail=f"{previous.detail}; {detail}"
+            )
+        else:
+            findings[rule] = SqlFinding(rule, severity, score, f"{description}: {detail}")
+    return tuple(sorted(findings.values(), key=lambda finding: -finding.score))
+
+
+def datasource_custom_sql(datasource, datasource_name=None, file_name="") -> list:
+    """the custom SQL relations of one data source element, with their tables. Named by the
+    data source caption, formatted name or name, else the stem of file_name (a .tds root
+    often has none of them)"""
+    if datasource_name is None:
+        datasource_name = (
+            datasource.get("caption")
+            or datasource.get("formatted-name")
+            or datasource.get("name")
+            or splitext(basename(file_name))[0]
+        )
+    queries = []
+    for relation in datasource.iter():
+        if (
+            relation.tag in RELATION_TAGS
+            and relation.get("type") == "text"
+            and relation.get("name") != "Extract"
+        ):
+            sql = relation.text or ""
+            queries.append(
+                CustomSqlQuery(
+                    datasource_name,
+                    relation.get("connection", ""),
+                    relation.get("name", ""),
+                    sql,
+                    table_references(sql),
+                )
+            )
+    return queries
+
+
+def find_custom_sql(root, file_name="") -> list:
+    """every custom SQL relation in a workbook or data source, with its tables"""
+    datasources = [root] if root.tag == "datasource" else root.iter("datasource")
+    queries = []
+    for datasource in datasources:
+        queries.extend(datasource_custom_sql(datasource, file_name=file_name))
+    return queries
@@ -0,0 +1,153 @@
+"""
+Estimate how expensive a dashboard is to render from what the workbook XML says about it.
+
+Every worksheet on a dashboard is at least one query and one render, each distinct data source
+a separate connection, each quick filter a domain query, and "only relevant values" filters
+re-query their domain whenever another filter changes. Dimensions with many values on rows,
+columns or the marks card multiply the marks drawn, and table calculations are computed on
+the rendered marks. The estimate is a weighted count of these, comparable across workbooks:
+
+    profiles = {name: profile_worksheet(node, fields) for each worksheet}
+    cost = estimate_dashboard(dashboard_node, profiles)
+    cost.score, cost.detail
+"""
+import re
+from typing import NamedTuple
+
+from calc_linter import FormulaAnalysis, is_high_cardinality
+
+# cost of one of each input
+COST_WEIGHTS = {
+    "worksheets": 10,
+    "datasources": 15,
+    "quick_filters": 3,
+    "relevant_filters": 8,
+    "marks_heavy_fields": 5,
+    "table_calcs": 4,
+}
+# quick filter modes that show only values relevant to the other filters
+RELEVANT_VALUE_MODES = frozenset(("cascading", "relevant"))
+# [data source].[derivation:Field:type] column instance references on shelves
+COLUMN_INSTANCE = re.compile(
+    r"\[(?:[^\]]|\]\])*\]\.\[([a-z]*):((?:[^\]]|\]\])*):[a-z]+(?::\d+)?\]"
+)
+# shelves and marks card encodings that split the view into marks
+SHELF_PATHS = (".//table/rows", ".//table/cols")
+ENCODING_PATH = ".//encodings/*[@column]"
+
+
+class WorksheetProfile(NamedTuple):
+    """what a worksheet contributes to the cost of the dashboards showing it"""
+
+    datasources: frozenset
+    marks_heavy_fields: tuple
+    table_calcs: tuple
+
+
+class DashboardCost(NamedTuple):
+    """estimated render cost of a dashboard and the counts it was computed from"""
+
+    dashboard: str
+    score: int
+    worksheets: int
+    datasources: int
+    quick_filters: int
+    relevant_filters: int
+    marks_heavy_fields: int
+    table_calcs: int
+    detail: str
+
+
+def profile_worksheet(worksheet_node, fields) -> WorksheetProfile:
+    """
+    Profile a worksheet from its XML and its fields (the Worksheet Columns records of the
+    worksheet, with datasource, caption, name, datatype and calculation). Marks heavy fields
+    are dimensions on a shelf or the marks card that likely have many values. Table calculations
+    are quick table calculations and calculations using table calculation functions
+    """
+    fields_by_name = {field["name"]: field for field in fields}
+    datasources = frozenset(
+        field["datasource"] for field in fields if field["datasource"] != "Parameters"
+    )
+
+    shelf_references = []
+    for path in SHELF_PATHS:
+        for shelf in worksheet_node.findall(path):
+            shelf_references.extend(COLUMN_INSTANCE.findall(shelf.text or ""))
+    for encoding in worksheet_node.findall(ENCODING_PATH):
+        shelf_references.extend(COLUMN_INSTANCE.findall(encoding.get("column")))
+    marks_heavy_fields = []
+    for derivation, name in shelf_references:
+        field = fields_by_name.get(f"[{name}]", {})
+        if derivation == "none" and is_high_cardinality(
+            field.get("caption") or name, field.get("datatype", "")
+        ):
+            marks_heavy_fields.append(field.get("caption") or name)
+
+    table_calcs = [
+        instance.get("name")
+        for instance in worksheet_node.findall(".//column-instance")
+        if instance.find("table-calc") is not None
+    ]
+    for field in fields:
+        if field.get("calculation") and FormulaAnalysis(field["calculation"]).table_calcs:
+            table_calcs.append(field["caption"] or field["name"])
+
+    return WorksheetProfile(
+        datasources,
+        tuple(dict.fromkeys(marks_heavy_fields)),
+        tuple(dict.fromkeys(table_calcs)),
+    )
+
+
+def _zone_type(zone):
+    return zone.get("type-v2") or zone.get("type")
+
+
+def estimate_dashboard(dashboard_node, profiles) -> DashboardCost:
+    """cost of a dashboard. profiles maps worksheet names to their WorksheetProfile"""
+    worksheets = []
+    quick_filters = []
+    for zone in dashboard_node.iter("zone"):
+        zone_type = _zone_type(zone)
+        if zone_type is None and zone.get("name") in profiles:
+            worksheets.append(zone.get("name"))
+        elif zone_type == "filter":
+            quick_filters.append(zone)
+    worksheets = list(dict.fromkeys(worksheets))
+    datasources = set()
+    marks_heavy_fields = []
+    table_calcs = []
+    for worksheet in worksheets:
+        profile = profiles[worksheet]
+        datasources.update(profile.datasources)
+        marks_heavy_fields.extend(f"{worksheet}: {field}" for field in profile.marks_heavy_fields)
+        table_calcs.extend(f"{worksheet}: {field}" for field in profile.table_calcs)
+    relevant_filters = [
+        zone for zone in quick_filters if zone.get("values") in RELEVANT_VALUE_MODES
+    ]
+
+    counts = {
+        "worksheets": len(worksheets),
+        "datasources": len(datasources),
+        "quick_filters": len(quick_filters),
+        "relevant_filters": len(relevant_filters),
+        "marks_heavy_fields": len(marks_heavy_fields),
+        "table_calcs": len(table_calcs),
+    }
+    costs = {input_name: COST_WEIGHTS[input_name] * count for input_name, count in counts.items()}
+    # the largest contributors first, with the fields behind them
+    named = {
+        "datasources": sorted(datasources),
+        "marks_heavy_fields": marks_heavy_fields,
+        "table_calcs": table_calcs,
+    }
+    detail = "; ".join(
+        f"{input_name.replace('_', ' ')} {counts[input_name]} (+{cost})"
+        + (f": {', '.join(named[input_name])}" if named.get(input_name) else "")
+        for input_name, cost in sorted(costs.items(), key=lambda item: -item[1])
+        if cost
+    )
+    return DashboardCost(
+        dashboard_node.get("name"), sum(costs.values()), *counts.values(), detail
+    )
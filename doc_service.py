@@ -0,0 +1,350 @@
+"""
+    Local HTTP service to document Tableau workbooks and data sources.
+
+    POST /document?format=xlsx|json|jsonl|parquet&name=<file name>  body: the .twb/.twbx/.tds/.tdsx
+    POST /jobs?format=...&name=...  same body, returns a job id straight away (503 when busy)
+    GET  /jobs/<job id>  status and per-file progress
+    GET  /jobs/<job id>/files/<index>  documentation of a finished file
+    GET  /jobs/<job id>/archive  zip of the files finished so far
+    GET  /health
+    GET  /metrics
+
+    Example:
+    $ python doc_service.py --port 8765
+    $ curl --data-binary @Sales.twbx "http://localhost:8765/document?format=json&name=Sales.twbx"
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, quote
+
+from documentation_worker import OUTPUT_FORMATS, document_upload_as, warm_up
+from job_queue import JobQueue, content_key_for, output_name_for
+from result_cache import ResultCache
+
+MAX_UPLOAD_BYTES = 512 * 1024 * 1024
+
+
+def content_disposition(file_name):
+    """Content-Disposition header for downloading file_name, which comes from the client.
+    Control characters are dropped; quotes, backslashes and non-ASCII characters are left out
+    of the plain filename, and the full name is sent percent-encoded in filename* (RFC 6266)"""
+    file_name = "".join(c for c in file_name if c.isprintable())
+    plain_name = "".join(c for c in file_name if c.isascii() and c not in '"\\')
+    return f"attachment; filename=\"{plain_name}\"; filename*=UTF-8''{quote(file_name, safe='')}"
+
+
+class ServiceMetrics:
+    """Request counters exposed on /metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {
+            "requests_total": 0,
+            "documents_total": 0,
+            "errors_total": 0,
+            "rejected_total": 0,
+            "cache_hits_total": 0,
+        }
+        self.in_flight = 0
+        self.processing_seconds = 0.0
+
+    def increment(self, name, value=1):
+        """add to a counter"""
+        with self._lock:
+            self.counters[name] += value
+
+    def track(self, change):
+        """add to or remove from the in flight request count"""
+        with self._lock:
+            self.in_flight += change
+
+    def record_processing(self, seconds):
+        """add the time taken to document a file"""
+        with self._lock:
+            self.processing_seconds += seconds
+
+    def as_text(self, cache, queue_limit):
+        """metrics in Prometheus text format"""
+        with self._lock:
+            lines = [f"tabdocs_{name} {value}" for name, value in self.counters.items()]
+            lines.append(f"tabdocs_in_flight {self.in_flight}")
+            lines.append(f"tabdocs_processing_seconds_total {self.processing_seconds:.3f}")
+        lines.append(f"tabdocs_queue_limit {queue_limit}")
+        lines.append(f"tabdocs_uptime_seconds {time.time() - self.started:.0f}")
+        for name, value in cache.stats().items():
+            lines.append(f"tabdocs_cache_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class DocumentationService:
+    """Pre-warmed worker pool with a bounded request queue"""
+
+    def __init__(
+        self,
+        workers=None,
+        queue_limit=None,
+        queue_timeout=5.0,
+        job_database="documentation_jobs.db",
+        job_artifact_dir="documentation_jobs",
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_limit = queue_limit or self.workers * 4
+        self.queue_timeout = queue_timeout
+        self._executor_lock = threading.Lock()
+        self.executor = self._new_executor()
+        # requests queued or running. Once full, new requests wait queue_timeout then get a 503.
+        # Job files queued or running are held to the same limit
+        self.slots = threading.BoundedSemaphore(self.queue_limit)
+        self.cache = ResultCache()
+        self.metrics = ServiceMetrics()
+        # long running jobs share the warm worker pool
+        self.jobs = JobQueue(
+            job_database,
+            job_artifact_dir,
+            self.workers,
+            executor=self.executor,
+            executor_factory=self.replace_executor,
+            cache=self.cache,
+        )
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=warm_up,
+        )
+
+    def replace_executor(self, broken):
+        """a new worker pool in place of broken, unless it was already replaced"""
+        with self._executor_lock:
+            if self.executor is broken:
+                logging.warning("Worker pool broken. Starting a new one")
+                broken.shutdown(wait=False)
+                self.executor = self._new_executor()
+            return self.executor
+
+    def start(self):
+        """start every worker process now instead of on the first requests"""
+        wait([self.executor.submit(time.sleep, 0.1) for _ in range(self.workers)])
+        logging.info("%s workers ready", self.workers)
+
+    def shutdown(self):
+        """stop the job scheduler, then the worker pool it submits to"""
+        self.jobs.close()
+        self.executor.shutdown(cancel_futures=True)
+
+    def document(self, data, output_format, name):
+        """Document one upload. Returns None when the queue is full"""
+        # the same key as the job queue's, so identical xlsx uploads share results whatever
+        # their names
+        key = content_key_for(data, output_format, name)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.metrics.increment("cache_hits_total")
+            return cached
+
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            self.metrics.increment("rejected_total")
+            return None
+        self.metrics.track(1)
+        start_time = time.perf_counter()
+        executor = self.executor
+        try:
+            result = executor.submit(document_upload_as, data, output_format, name).result()
+        except BrokenProcessPool:
+            self.replace_executor(executor)
+            raise
+        finally:
+            self.slots.release()
+            self.metrics.track(-1)
+            self.metrics.record_processing(time.perf_counter() - start_time)
+        self.cache.put(key, result)
+        self.metrics.increment("documents_total")
+        return result
+
+    def submit_job(self, data, output_format, name):
+        """Queue one upload as a job and return its id. Returns None when the queue is full"""
+        if self.jobs.pending_files() >= self.queue_limit:
+            self.metrics.increment("rejected_total")
+            return None
+        return self.jobs.submit([(name, data)], output_format)
+
+
+class DocumentationRequestHandler(BaseHTTPRequestHandler):
+    """HTTP front end for DocumentationService"""
+
+    service: DocumentationService = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logging.info("%s %s", self.address_string(), format % args)
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message, headers=None):
+        self._send(status, json.dumps({"error": message}), headers=headers)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """health and metrics endpoints"""
+        path = urlparse(self.path).path
+        if path == "/health":
+            self._send(
+                200,
+                json.dumps(
+                    {
+                        "status": "ok",
+                        "workers": self.service.workers,
+                        "in_flight": self.service.metrics.in_flight,
+                    }
+                ),
+            )
+        elif path == "/metrics":
+            self._send(
+                200,
+                self.service.metrics.as_text(
+                    self.service.cache, self.service.queue_limit
+                ),
+                "text/plain; version=0.0.4",
+            )
+        elif path.startswith("/jobs/"):
+            self._get_job(path.split("/")[2:])
+        else:
+            self._send_error(404, f"Unknown path {path}")
+
+    def _get_job(self, parts):
+        """job status, finished file or archive"""
+        jobs = self.service.jobs
+        status = jobs.status(parts[0])
+        if status is None:
+            self._send_error(404, f"Unknown or expired job {parts[0]}")
+        elif len(parts) == 1:
+            self._send(200, json.dumps(status))
+        elif parts[1] == "archive":
+            with jobs.archive(parts[0]) as file_archive:
+                self._send(
+                    200,
+                    file_archive.read(),
+                    "application/zip",
+                    {"Content-Disposition": content_disposition("Documentation.zip")},
+                )
+        elif parts[1] == "files" and len(parts) == 3 and parts[2].isdigit():
+            result_path = jobs.result_path(parts[0], int(parts[2]))
+            if result_path is None:
+                self._send_error(404, "File not finished or not in the job")
+                return
+            output_name = status["files"][int(parts[2])]["output_name"]
+            with open(result_path, "rb") as f:
+                self._send(
+                    200,
+                    f.read(),
+                    OUTPUT_FORMATS[status["output_format"]][0],
+                    {"Content-Disposition": content_disposition(output_name)},
+                )
+        else:
+            self._send_error(404, "Unknown job path")
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """document an uploaded file"""
+        self.service.metrics.increment("requests_total")
+        url = urlparse(self.path)
+        if url.path not in ("/document", "/jobs"):
+            self._send_error(404, f"Unknown path {url.path}")
+            return
+
+        query = parse_qs(url.query)
+        output_format = query.get("format", ["xlsx"])[0].lower()
+        name = query.get("name", [self.headers.get("X-File-Name", "upload")])[0]
+        if output_format not in OUTPUT_FORMATS:
+            self._send_error(
+                400, f"format must be one of {', '.join(OUTPUT_FORMATS)}"
+            )
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        if length <= 0:
+            self._send_error(400, "Request body must contain the file to document")
+            return
+        if length > MAX_UPLOAD_BYTES:
+            self._send_error(413, "File too large")
+            return
+        data = self.rfile.read(length)
+
+        if url.path == "/jobs":
+            job_id = self.service.submit_job(data, output_format, name)
+            if job_id is None:
+                self._send_error(503, "Server busy, retry later", {"Retry-After": "5"})
+                return
+            self._send(
+                202,
+                json.dumps({"job_id": job_id, "status_url": f"/jobs/{job_id}"}),
+                headers={"Location": f"/jobs/{job_id}"},
+            )
+            return
+
+        try:
+            result = self.service.document(data, output_format, name)
+        except Exception as err:  # report processing errors to the client
+            logging.exception("Error documenting %s", name)
+            self.service.metrics.increment("errors_total")
+            self._send_error(422, f"Unable to document {name}: {err}")
+            return
+        if result is None:
+            self._send_error(503, "Server busy, retry later", {"Retry-After": "5"})
+            return
+
+        self._send(
+            200,
+            result,
+            OUTPUT_FORMATS[output_format][0],
+            {"Content-Disposition": content_disposition(output_name_for(name, output_format))},
+        )
+
+
+def main():
+    """Run the documentation service"""
+    parser = argparse.ArgumentParser(description="Tableau documentation HTTP service")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: CPUs)")
+    parser.add_argument(
+        "--queue", type=int, help="Requests queued or running before returning 503"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+    service = DocumentationService(args.workers, args.queue)
+    service.start()
+    DocumentationRequestHandler.service = service
+    server = ThreadingHTTPServer((args.host, args.port), DocumentationRequestHandler)
+    logging.info("Listening on http://%s:%s", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
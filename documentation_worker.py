@@ -0,0 +1,143 @@
+"""
+    Generate documentation for uploaded Tableau files.
+    Kept free of Streamlit so the functions can run in worker processes.
+"""
+import json
+import os
+import tempfile
+import zipfile
+import xml.etree.ElementTree as ET
+from io import BytesIO
+import xml_backend
+from Handle_twbx import find_file_in_zip
+from WorkbookDocumentation import WorkbookDocumentation
+from xml_payloads import parse_document
+
+# output format -> (content type, file extension)
+OUTPUT_FORMATS = {
+    "xlsx": (
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "xlsx",
+    ),
+    "json": ("application/json", "json"),
+    "jsonl": ("application/x-ndjson", "jsonl"),
+    "parquet": ("application/zip", "zip"),
+}
+
+
+def generate_xml_root(infile) -> ET.Element:
+    """Get the root element of the object XML. infile is a binary file object, which is
+    parsed directly rather than decoded to a string first. Thumbnails and images are left
+    out of the tree (see xml_payloads)"""
+    if zipfile.is_zipfile(infile):
+        with zipfile.ZipFile(infile) as zip_object:
+            target_file = find_file_in_zip(zip_object)
+            with zip_object.open(target_file) as xml_source:
+                root, _ = parse_document(xml_source)
+
+    else:
+        # is_zipfile leaves the position wherever it stopped reading
+        infile.seek(0)
+        root, _ = parse_document(infile)
+    return root
+
+
+def convert_to_bytes(doc_workbook) -> bytes:
+    """Convert object to byte data"""
+    output = BytesIO()
+    doc_workbook.save(output)
+    return output.getvalue()
+
+
+def package_of(infile):
+    """infile when it is a packaged file, so its assets are documented, else None"""
+    return infile if zipfile.is_zipfile(infile) else None
+
+
+def process_file(uploaded_file) -> bytes:
+    """process file to generate documentation workbook"""
+    root = generate_xml_root(uploaded_file)
+    style_guide = None
+    documentation = WorkbookDocumentation(
+        root, style_guide, package=package_of(uploaded_file)
+    )
+    doc_workbook = documentation.build_excel_workbook()
+    byte_data = convert_to_bytes(doc_workbook)
+    return byte_data
+
+
+def document_upload(data: bytes) -> bytes:
+    """generate the documentation xlsx for the content of an uploaded file.
+    Takes and returns plain bytes so it can be submitted to a process pool.
+    BytesIO shares the bytes object rather than copying it until it is written to"""
+    return process_file(BytesIO(data))
+
+
+def document_records(data: bytes, source: str = "") -> list:
+    """documentation records of an uploaded file as JSON ready dicts"""
+    infile = BytesIO(data)
+    root = generate_xml_root(infile)
+    documentation = WorkbookDocumentation(root, stream=True, package=package_of(infile))
+    return [
+        record._replace(source=source or record.source)._asdict()
+        for record in documentation.iter_records()
+    ]
+
+
+def document_parquet(data: bytes, source: str = "") -> bytes:
+    """zip of one Parquet file per extracted table for an uploaded file"""
+    from output_writers import ParquetTableWriter
+
+    infile = BytesIO(data)
+    root = generate_xml_root(infile)
+    documentation = WorkbookDocumentation(root, package=package_of(infile))
+    with tempfile.TemporaryDirectory() as temp_path:
+        with ParquetTableWriter(temp_path) as writer:
+            documentation.write_tables(writer, source or documentation.workbook_id)
+        output = BytesIO()
+        with zipfile.ZipFile(output, "w") as zip_file:
+            for dir_path, _, files in os.walk(temp_path):
+                for name in files:
+                    zip_file.write(
+                        os.path.join(dir_path, name),
+                        arcname=os.path.basename(dir_path) + ".parquet",
+                    )
+    return output.getvalue()
+
+
+def document_upload_as(data: bytes, output_format: str = "xlsx", source: str = ""):
+    """generate documentation for an upload in one of OUTPUT_FORMATS"""
+    if output_format == "xlsx":
+        return document_upload(data)
+    if output_format == "json":
+        return json.dumps(document_records(data, source), default=str).encode("utf-8")
+    if output_format == "jsonl":
+        return "".join(
+            json.dumps(record, default=str) + "\n"
+            for record in document_records(data, source)
+        ).encode("utf-8")
+    if output_format == "parquet":
+        return document_parquet(data, source)
+    raise ValueError(f"Unknown output format {output_format}")
+
+
+def document_file_as(
+    input_path: str, output_path: str, output_format: str = "xlsx", source: str = ""
+) -> int:
+    """document a file on disk into output_path. Only the paths cross the process boundary.
+    Returns the size of the output"""
+    with open(input_path, "rb") as f:
+        data = f.read()
+    result = document_upload_as(data, output_format, source)
+    with open(output_path, "wb") as f:
+        f.write(result)
+    return len(result)
+
+
+def warm_up():
+    """Import the heavy dependencies ahead of the first request. Used as a pool initializer"""
+    import openpyxl  # noqa: F401
+    import output_writers  # noqa: F401
+
+    # parsed with the configured backend, so lxml is loaded too when it's used
+    WorkbookDocumentation(xml_backend.parse(b"<datasource name='warm-up' />"))
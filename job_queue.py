@@ -0,0 +1,473 @@
+"""
+Persistent queue of documentation jobs shared by the Streamlit page and the HTTP service.
+
+Submitting a job stores the uploaded files on disk and returns a job id straight away. A background
+scheduler feeds queued files to a process pool with bounded parallelism and records each result
+in SQLite, so clients can poll for progress and download finished files before the whole job is
+done. Several processes can share the database: each claims a file before processing it and
+records a heartbeat, and files left running by a process that stopped are queued again.
+Documentation generated recently is kept in a bounded ResultCache, so the same upload submitted
+again is done without being queued.
+
+    jobs = JobQueue("documentation_jobs.db", "documentation_jobs")
+    job_id = jobs.submit([("Sales.twbx", data)], "xlsx")
+    jobs.status(job_id)
+"""
+import logging
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from os.path import splitext, basename
+
+from documentation_worker import OUTPUT_FORMATS, document_file_as
+from result_cache import ResultCache
+
+# job and file statuses
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+
+# Size at which a job's download zip moves from memory to a temporary file on disk
+ZIP_SPOOL_MAX_BYTES = 32 * 1024 * 1024
+# Seconds between scheduler heartbeats, and without one after which a queue's running files are
+# taken to be abandoned and queued again
+HEARTBEAT_SECONDS = 5
+OWNER_TIMEOUT_SECONDS = 60
+
+
+def output_name_for(name, output_format):
+    """name of the documentation file for an uploaded file"""
+    return splitext(basename(name))[0] + f" Documentation.{OUTPUT_FORMATS[output_format][1]}"
+
+
+def content_key_for(data, output_format, name):
+    """ResultCache key of an upload's documentation. The record formats include the file name,
+    xlsx output only depends on the content"""
+    return ResultCache.key_for(data, output_format, "" if output_format == "xlsx" else name)
+
+
+class JobQueue:
+    """SQLite backed documentation jobs with a background scheduler"""
+
+    def __init__(
+        self,
+        database="documentation_jobs.db",
+        artifact_dir="documentation_jobs",
+        workers=None,
+        executor=None,
+        executor_factory=None,
+        max_artifact_bytes=2 * 1024 * 1024 * 1024,
+        max_age_seconds=24 * 60 * 60,
+        cache=None,
+    ):
+        self.artifact_dir = artifact_dir
+        os.makedirs(artifact_dir, exist_ok=True)
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.max_artifact_bytes = max_artifact_bytes
+        self.max_age_seconds = max_age_seconds
+        # documentation generated recently, so uploading the same file again skips the queue
+        self.cache = cache if cache is not None else ResultCache()
+        # executor_factory(broken) replaces a pool broken by a dead worker, e.g. one killed for
+        # running out of memory, and returns the pool to use from then on. The owner of a shared
+        # pool passes one to replace it for its other users too
+        self._executor_factory = executor_factory
+        self.executor = executor or self._new_executor()
+        self._owns_executor = executor is None
+
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            database, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.create_schema()
+
+        self._in_flight = 0
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        # identifies the files this queue is running to the other processes using the database
+        self.owner = uuid.uuid4().hex
+        self._heartbeat()
+        # files interrupted by a restart go back on the queue
+        self._requeue_abandoned()
+        self._scheduler = threading.Thread(
+            target=self._schedule, name="documentation-jobs", daemon=True
+        )
+        self._scheduler.start()
+
+    def _new_executor(self):
+        # spawn so workers don't inherit the threads of the web server
+        return ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def _replace_broken_executor(self, broken):
+        """a working pool in place of broken, unless it was already replaced"""
+        with self._lock:
+            if self.executor is broken:
+                logging.warning("documentation worker pool broken. Starting a new one")
+                if self._executor_factory is not None:
+                    self.executor = self._executor_factory(broken)
+                else:
+                    if self._owns_executor:
+                        broken.shutdown(wait=False)
+                    self.executor = self._new_executor()
+                    self._owns_executor = True
+            return self.executor
+
+    def create_schema(self):
+        """create the job tables if they don't exist"""
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                output_format TEXT,
+                created_at REAL,
+                accessed_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at);
+            CREATE TABLE IF NOT EXISTS job_files (
+                job_id TEXT REFERENCES jobs (job_id) ON DELETE CASCADE,
+                file_index INTEGER,
+                name TEXT,
+                content_key TEXT,
+                status TEXT,
+                error TEXT,
+                output_bytes INTEGER DEFAULT 0,
+                started_at REAL,
+                finished_at REAL,
+                owner TEXT,
+                PRIMARY KEY (job_id, file_index)
+            );
+            CREATE INDEX IF NOT EXISTS idx_job_files_status ON job_files (status, job_id);
+            CREATE TABLE IF NOT EXISTS job_owners (
+                owner TEXT PRIMARY KEY,
+                seen_at REAL
+            );
+            """
+        )
+        # databases from before files were claimed by an owner and downloads were tracked
+        for table, column in (("job_files", "owner TEXT"), ("jobs", "accessed_at REAL")):
+            columns = {row[1] for row in self.connection.execute(f"PRAGMA table_info({table})")}
+            if column.split()[0] not in columns:
+                self.connection.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+
+    def _execute(self, sql, parameters=()):
+        with self._lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def _update(self, sql, parameters=()):
+        """run a statement and return the number of rows it changed"""
+        with self._lock:
+            return self.connection.execute(sql, parameters).rowcount
+
+    def _heartbeat(self):
+        self._execute(
+            "INSERT OR REPLACE INTO job_owners VALUES (?, ?)", (self.owner, time.time())
+        )
+
+    def _requeue_abandoned(self):
+        """queue again the running files of queues without a recent heartbeat, e.g. of a
+        process that was stopped or killed"""
+        seen_after = time.time() - OWNER_TIMEOUT_SECONDS
+        requeued = self._update(
+            "UPDATE job_files SET status = ?, owner = NULL WHERE status = ? AND ("
+            "owner IS NULL OR owner NOT IN (SELECT owner FROM job_owners WHERE seen_at >= ?))",
+            (QUEUED, RUNNING, seen_after),
+        )
+        self._execute("DELETE FROM job_owners WHERE seen_at < ?", (seen_after,))
+        if requeued:
+            logging.warning("queued %d abandoned documentation file(s) again", requeued)
+            self._wake.set()
+
+    def _claim(self, job_id, file_index):
+        """Mark a queued file as running for this queue. False when another process (or an
+        earlier pass) claimed it first"""
+        return (
+            self._update(
+                "UPDATE job_files SET status = ?, owner = ?, started_at = ? "
+                "WHERE job_id = ? AND file_index = ? AND status = ?",
+                (RUNNING, self.owner, time.time(), job_id, file_index, QUEUED),
+            )
+            == 1
+        )
+
+    def _job_dir(self, job_id):
+        return os.path.join(self.artifact_dir, job_id)
+
+    def _input_path(self, job_id, file_index):
+        return os.path.join(self._job_dir(job_id), f"input-{file_index}")
+
+    def _output_path(self, job_id, file_index):
+        return os.path.join(self._job_dir(job_id), f"output-{file_index}")
+
+    def submit(self, files, output_format="xlsx"):
+        """Queue (name, bytes) pairs for documentation and return the job id. Files found in
+        the cache are done straight away"""
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format {output_format}")
+        job_id = uuid.uuid4().hex
+        os.makedirs(self._job_dir(job_id))
+        now = time.time()
+        rows = []
+        for file_index, (name, data) in enumerate(files):
+            content_key = content_key_for(data, output_format, name)
+            cached = self.cache.get(content_key)
+            if cached is not None:
+                with open(self._output_path(job_id, file_index), "wb") as f:
+                    f.write(cached)
+                rows.append((job_id, file_index, name, content_key, DONE, len(cached), now, now))
+            else:
+                with open(self._input_path(job_id, file_index), "wb") as f:
+                    f.write(data)
+                rows.append((job_id, file_index, name, content_key, QUEUED, 0, None, None))
+        with self._lock:
+            self.connection.execute("BEGIN")
+            self.connection.execute(
+                "INSERT INTO jobs VALUES (?, ?, ?, ?)", (job_id, output_format, now, now)
+            )
+            self.connection.executemany(
+                "INSERT INTO job_files (job_id, file_index, name, content_key, status, "
+                "output_bytes, started_at, finished_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.connection.execute("COMMIT")
+        self._wake.set()
+        return job_id
+
+    def _touch(self, job_id):
+        """record a download, so eviction removes the jobs downloaded least recently first"""
+        self._execute("UPDATE jobs SET accessed_at = ? WHERE job_id = ?", (time.time(), job_id))
+
+    def pending_files(self):
+        """number of files queued or running, across all jobs"""
+        return self._execute(
+            "SELECT COUNT(*) FROM job_files WHERE status IN (?, ?)", (QUEUED, RUNNING)
+        )[0][0]
+
+    def status(self, job_id):
+        """Job status with per-file progress, None for an unknown or evicted job"""
+        job = self._execute(
+            "SELECT output_format, created_at FROM jobs WHERE job_id = ?", (job_id,)
+        )
+        if not job:
+            return None
+        output_format, created_at = job[0]
+        rows = self._execute(
+            "SELECT file_index, name, status, error, output_bytes, started_at, finished_at "
+            "FROM job_files WHERE job_id = ? ORDER BY file_index",
+            (job_id,),
+        )
+        files = [
+            {
+                "index": file_index,
+                "name": name,
+                "output_name": output_name_for(name, output_format),
+                "status": status,
+                "error": error,
+                "bytes": output_bytes,
+                "seconds": None
+                if finished_at is None
+                else round(finished_at - started_at, 3),
+            }
+            for file_index, name, status, error, output_bytes, started_at, finished_at in rows
+        ]
+        finished = sum(1 for f in files if f["status"] in (DONE, ERROR))
+        if finished == len(files):
+            status = DONE
+        elif any(f["status"] != QUEUED for f in files):
+            status = RUNNING
+        else:
+            status = QUEUED
+        return {
+            "job_id": job_id,
+            "status": status,
+            "output_format": output_format,
+            "created_at": created_at,
+            "finished": finished,
+            "total": len(files),
+            "progress": finished / len(files) if files else 1.0,
+            "files": files,
+        }
+
+    def result_path(self, job_id, file_index):
+        """path of a finished file's documentation, None until it is done"""
+        row = self._execute(
+            "SELECT status FROM job_files WHERE job_id = ? AND file_index = ?",
+            (job_id, file_index),
+        )
+        if not row or row[0][0] != DONE:
+            return None
+        self._touch(job_id)
+        return self._output_path(job_id, file_index)
+
+    def archive(self, job_id):
+        """zip of the files finished so far, as a file object positioned at the start"""
+        status = self.status(job_id)
+        if status is None:
+            return None
+        self._touch(job_id)
+        file_archive = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_BYTES)
+        with zipfile.ZipFile(
+            file_archive, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True
+        ) as zip_file:
+            for f in status["files"]:
+                if f["status"] == DONE:
+                    zip_file.write(
+                        self._output_path(job_id, f["index"]), arcname=f["output_name"]
+                    )
+        file_archive.seek(0)
+        return file_archive
+
+    def remove_job(self, job_id):
+        """delete a job and its files"""
+        self._execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+
+    def evict(self):
+        """Remove finished jobs not downloaded for max_age_seconds, then the jobs downloaded
+        least recently until the stored output is within max_artifact_bytes. Jobs with queued
+        or running files are kept"""
+        finished_jobs = self._execute(
+            "SELECT j.job_id, COALESCE(j.accessed_at, j.created_at) AS used_at, "
+            "SUM(f.output_bytes) FROM jobs j JOIN job_files f ON f.job_id = j.job_id "
+            "GROUP BY j.job_id HAVING SUM(f.status IN (?, ?)) = 0 ORDER BY used_at",
+            (QUEUED, RUNNING),
+        )
+        total_bytes = self._execute("SELECT COALESCE(SUM(output_bytes), 0) FROM job_files")[0][0]
+        expire_before = time.time() - self.max_age_seconds
+        for job_id, used_at, job_bytes in finished_jobs:
+            if used_at >= expire_before and total_bytes <= self.max_artifact_bytes:
+                break
+            self.remove_job(job_id)
+            total_bytes -= job_bytes or 0
+
+    def _schedule(self):
+        """Scheduler thread: keep up to workers * 2 files submitted to the pool"""
+        last_eviction = 0
+        while not self._stopping.is_set():
+            try:
+                self._heartbeat()
+            except sqlite3.Error:
+                logging.exception("error recording the documentation jobs heartbeat")
+            if time.monotonic() - last_eviction > 60:
+                try:
+                    self._requeue_abandoned()
+                    self.evict()
+                except Exception:
+                    logging.exception("error evicting documentation jobs")
+                last_eviction = time.monotonic()
+
+            free_slots = self.workers * 2 - self._in_flight
+            if free_slots > 0:
+                for job_id, file_index, name, content_key, output_format in self._execute(
+                    "SELECT f.job_id, f.file_index, f.name, f.content_key, j.output_format "
+                    "FROM job_files f JOIN jobs j ON j.job_id = f.job_id "
+                    "WHERE f.status = ? ORDER BY j.created_at, f.file_index LIMIT ?",
+                    (QUEUED, free_slots),
+                ):
+                    if not self._claim(job_id, file_index):
+                        # taken by another process. Look for more queued files straight away
+                        self._wake.set()
+                        continue
+                    self._start_file(job_id, file_index, name, content_key, output_format)
+            self._wake.wait(timeout=HEARTBEAT_SECONDS)
+            self._wake.clear()
+
+    def _start_file(self, job_id, file_index, name, content_key, output_format):
+        """submit a file claimed by this queue to the pool"""
+        with self._lock:
+            self._in_flight += 1
+        arguments = (
+            document_file_as,
+            self._input_path(job_id, file_index),
+            self._output_path(job_id, file_index),
+            output_format,
+            name,
+        )
+        executor = self.executor
+        try:
+            try:
+                future = executor.submit(*arguments)
+            except BrokenProcessPool:
+                future = self._replace_broken_executor(executor).submit(*arguments)
+        except (BrokenProcessPool, RuntimeError) as err:
+            # RuntimeError: the pool was shut down. Either way the scheduler thread must
+            # carry on, so the file fails (or, when stopping, waits for the next start)
+            # instead of holding its slot forever
+            logging.exception("could not start %s of job %s", name, job_id)
+            if self._stopping.is_set():
+                status, error = QUEUED, None
+            else:
+                status, error = ERROR, str(err) or type(err).__name__
+            self._execute(
+                "UPDATE job_files SET status = ?, error = ?, finished_at = ? "
+                "WHERE job_id = ? AND file_index = ? AND owner = ?",
+                (status, error, time.time(), job_id, file_index, self.owner),
+            )
+            with self._lock:
+                self._in_flight -= 1
+            return
+        future.add_done_callback(
+            lambda future: self._finish_file(job_id, file_index, content_key, future, executor)
+        )
+
+    def _finish_file(self, job_id, file_index, content_key, future, executor=None):
+        if future.cancelled():
+            # the pool shut down first. Leave the file to be picked up on the next start
+            self._execute(
+                "UPDATE job_files SET status = ?, owner = NULL "
+                "WHERE job_id = ? AND file_index = ? AND owner = ?",
+                (QUEUED, job_id, file_index, self.owner),
+            )
+            with self._lock:
+                self._in_flight -= 1
+            return
+        try:
+            output_bytes = future.result()
+        except Exception as err:
+            status, error, output_bytes = ERROR, str(err) or type(err).__name__, 0
+            if isinstance(err, BrokenProcessPool) and executor is not None:
+                self._replace_broken_executor(executor)
+        else:
+            status, error = DONE, None
+            if output_bytes <= self.cache.max_bytes:
+                try:
+                    with open(self._output_path(job_id, file_index), "rb") as f:
+                        self.cache.put(content_key, f.read())
+                except OSError:
+                    pass
+        # the job may have been removed while the file was processing, or the file queued again
+        # by another process after this one missed its heartbeats. Then the input is left for it
+        if self._update(
+            "UPDATE job_files SET status = ?, error = ?, output_bytes = ?, finished_at = ? "
+            "WHERE job_id = ? AND file_index = ? AND owner = ?",
+            (status, error, output_bytes, time.time(), job_id, file_index, self.owner),
+        ):
+            try:
+                os.remove(self._input_path(job_id, file_index))
+            except OSError:
+                pass
+        with self._lock:
+            self._in_flight -= 1
+        self._wake.set()
+
+    def close(self):
+        """stop the scheduler and, when the queue created it, the worker pool"""
+        self._stopping.set()
+        self._wake.set()
+        self._scheduler.join()
+        if self._owns_executor:
+            self.executor.shutdown()
+        # files still running in a shared pool are queued again by the other queues
+        self._execute("DELETE FROM job_owners WHERE owner = ?", (self.owner,))
+        self.connection.close()
@@ -0,0 +1,223 @@
+"""
+Cross-workbook field lineage graph stored in SQLite.
+
+Lineage runs table -> column -> calculation -> worksheet -> dashboard. Tables and database
+columns are shared between workbooks, everything from calculations down is scoped to the
+workbook it came from. Edges are indexed on both ends, so upstream and downstream impact
+queries are recursive index lookups:
+
+    graph.impact_of_column("[dbo].[Orders]", "[Order ID]")
+"""
+import re
+import sqlite3
+
+# [Field], [Calculation_123], [Orders].[Sales] ... closing brackets inside names are doubled
+FIELD_REFERENCE = re.compile(r"\[(?:[^\]]|\]\])*\]")
+
+NODE_KINDS = ("table", "column", "calculation", "worksheet", "dashboard")
+
+
+def table_node(table):
+    """node id of a database table"""
+    return f"table:{table}"
+
+
+def column_node(table, column):
+    """node id of a database column"""
+    return f"column:{table}.{column}"
+
+
+def workbook_node(kind, workbook_path, *names):
+    """node id of a calculation, worksheet or dashboard within a workbook"""
+    return f"{kind}:{workbook_path}|{'|'.join(names)}"
+
+
+class LineageBuilder:
+    """Collect the parts of a workbook's documentation records needed for lineage and turn them
+    into nodes and edges. Records can be fed one at a time as they are streamed."""
+
+    def __init__(self, workbook_path):
+        self.workbook_path = workbook_path
+        self.relations = {}  # (datasource, relation name) -> table
+        # (datasource, field key) -> (relation name, column), from the field map records
+        self.columns = {}
+        self.calculations = {}  # (datasource, calc name) -> (caption, formula)
+        self.worksheet_fields = set()  # (worksheet, datasource, field name)
+        self.dashboard_worksheets = set()  # (dashboard, worksheet)
+
+    def add(self, record):
+        """add one DocumentationRecord"""
+        data = record.data
+        if record.record_type == "table":
+            self.relations[(data["datasource"], f"[{data['name']}]")] = data["table"]
+        elif record.record_type == "field_map":
+            self.columns[(data["datasource"], data["key"])] = (
+                data["relation"],
+                data["column"],
+            )
+        elif record.record_type == "calculation" and data["datasource"] != "Parameters":
+            self.calculations[(data["datasource"], data["name"])] = (
+                data["caption"],
+                data["calculation"],
+            )
+        elif record.record_type == "worksheet_column":
+            self.worksheet_fields.add(
+                (data["worksheet"], data["datasource"], data["name"])
+            )
+        elif record.record_type == "dashboard_object" and data["type"] == "worksheet":
+            self.dashboard_worksheets.add((data["dashboard"], data["dashboard_object"]))
+
+    def _column_node(self, datasource, key):
+        relation, column = self.columns[(datasource, key)]
+        table = self.relations.get((datasource, relation), relation)
+        return column_node(table, column)
+
+    def build(self):
+        """return (nodes, edges). nodes are (node_id, kind, name, workbook_path) and
+        edges are (source node_id, target node_id)"""
+        nodes = {}
+        edges = set()
+        path = self.workbook_path
+
+        for (datasource, key), (relation, column) in self.columns.items():
+            table = self.relations.get((datasource, relation), relation)
+            nodes[table_node(table)] = ("table", table, None)
+            nodes[column_node(table, column)] = ("column", f"{table}.{column}", None)
+            edges.add((table_node(table), column_node(table, column)))
+
+        for (datasource, name), (caption, formula) in self.calculations.items():
+            calc_id = workbook_node("calculation", path, datasource, name)
+            nodes[calc_id] = ("calculation", caption, path)
+            for reference in set(FIELD_REFERENCE.findall(formula or "")):
+                if (datasource, reference) in self.columns:
+                    edges.add((self._column_node(datasource, reference), calc_id))
+                elif (datasource, reference) in self.calculations and reference != name:
+                    edges.add(
+                        (workbook_node("calculation", path, datasource, reference), calc_id)
+                    )
+
+        for worksheet, datasource, name in self.worksheet_fields:
+            worksheet_id = workbook_node("worksheet", path, worksheet)
+            nodes[worksheet_id] = ("worksheet", worksheet, path)
+            if (datasource, name) in self.calculations:
+                edges.add(
+                    (workbook_node("calculation", path, datasource, name), worksheet_id)
+                )
+            elif (datasource, name) in self.columns:
+                edges.add((self._column_node(datasource, name), worksheet_id))
+
+        for dashboard, worksheet in self.dashboard_worksheets:
+            dashboard_id = workbook_node("dashboard", path, dashboard)
+            worksheet_id = workbook_node("worksheet", path, worksheet)
+            nodes[dashboard_id] = ("dashboard", dashboard, path)
+            nodes.setdefault(worksheet_id, ("worksheet", worksheet, path))
+            edges.add((worksheet_id, dashboard_id))
+
+        return [(node_id, *values) for node_id, values in nodes.items()], list(edges)
+
+
+class LineageGraph:
+    """Persistent lineage graph with adjacency indexes in both directions"""
+
+    def __init__(self, database):
+        if isinstance(database, sqlite3.Connection):
+            self.connection = database
+        else:
+            self.connection = sqlite3.connect(database)
+        self.create_schema()
+
+    def create_schema(self):
+        """create the node and edge tables if they don't exist"""
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS lineage_nodes (
+                node_id TEXT PRIMARY KEY,
+                kind TEXT,
+                name TEXT,
+                workbook_path TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_lineage_nodes_workbook ON lineage_nodes (workbook_path);
+            CREATE INDEX IF NOT EXISTS idx_lineage_nodes_kind_name ON lineage_nodes (kind, name);
+            CREATE TABLE IF NOT EXISTS lineage_edges (
+                source TEXT,
+                target TEXT,
+                workbook_path TEXT,
+                PRIMARY KEY (source, target, workbook_path)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_lineage_edges_target ON lineage_edges (target, source);
+            CREATE INDEX IF NOT EXISTS idx_lineage_edges_workbook ON lineage_edges (workbook_path);
+            """
+        )
+
+    def replace_workbook(self, workbook_path, builder):
+        """Replace the nodes and edges contributed by a workbook. Runs in the caller's transaction
+        when there is one, so the catalog can update records and lineage together."""
+        nodes, edges = builder.build()
+        self.remove_workbook(workbook_path)
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO lineage_nodes VALUES (?, ?, ?, ?)", nodes
+        )
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO lineage_edges VALUES (?, ?, ?)",
+            [(source, target, workbook_path) for source, target in edges],
+        )
+
+    def update_workbook(self, workbook_path, records):
+        """build and store the lineage of a workbook from its documentation records"""
+        builder = LineageBuilder(workbook_path)
+        for record in records:
+            builder.add(record)
+        with self.connection:
+            self.replace_workbook(workbook_path, builder)
+
+    def remove_workbook(self, workbook_path):
+        """drop a workbook's edges and workbook scoped nodes. Shared table and column nodes stay"""
+        self.connection.execute(
+            "DELETE FROM lineage_edges WHERE workbook_path = ?", (workbook_path,)
+        )
+        self.connection.execute(
+            "DELETE FROM lineage_nodes WHERE workbook_path = ?", (workbook_path,)
+        )
+
+    def _walk(self, node_id, downstream, max_depth):
+        start, end = ("source", "target") if downstream else ("target", "source")
+        return self.connection.execute(
+            f"""
+            WITH RECURSIVE impacted (node_id, depth) AS (
+                SELECT ?, 0
+                UNION
+                SELECT e.{end}, i.depth + 1
+                FROM impacted i JOIN lineage_edges e ON e.{start} = i.node_id
+                WHERE i.depth < ?
+            )
+            SELECT n.node_id, n.kind, n.name, n.workbook_path, MIN(i.depth) AS depth
+            FROM impacted i JOIN lineage_nodes n ON n.node_id = i.node_id
+            WHERE i.depth > 0
+            GROUP BY n.node_id
+            ORDER BY depth, n.kind, n.name
+            """,
+            (node_id, max_depth),
+        ).fetchall()
+
+    def downstream(self, node_id, max_depth=20):
+        """everything that depends on a node: [(node_id, kind, name, workbook_path, depth)]"""
+        return self._walk(node_id, True, max_depth)
+
+    def upstream(self, node_id, max_depth=20):
+        """everything a node depends on: [(node_id, kind, name, workbook_path, depth)]"""
+        return self._walk(node_id, False, max_depth)
+
+    def impact_of_column(self, table, column):
+        """calculations, worksheets and dashboards that break if a column is dropped,
+        grouped by kind"""
+        impact = {kind: [] for kind in NODE_KINDS[2:]}
+        for _, kind, name, workbook_path, _ in self.downstream(column_node(table, column)):
+            impact[kind].append((workbook_path, name))
+        return impact
+
+    def impact_of_table(self, table):
+        """columns and everything downstream of them for a table, grouped by kind"""
+        impact = {kind: [] for kind in NODE_KINDS[1:]}
+        for _, kind, name, workbook_path, _ in self.downstream(table_node(table)):
+            impact[kind].append((workbook_path, name))
+        return impact
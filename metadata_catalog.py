@@ -0,0 +1,409 @@
+"""
+SQLite catalog of documentation metadata across many workbooks.
+
+Each record type (see WorkbookDocumentation.EXTRACTED_TABLES) gets its own indexed table with
+a workbook_path column, and the workbooks table keeps the content hash of each documented file
+so unchanged files are skipped on the next run. Example query:
+
+    SELECT DISTINCT workbook_path FROM tables WHERE "table" = '[dbo].[Orders]'
+"""
+import argparse
+import glob
+import logging
+import os
+import sqlite3
+import time
+
+from WorkbookDocumentation import (
+    EXTRACTED_TABLES,
+    SPREADSHEET_COLUMNS,
+    WorkbookDocumentation,
+)
+from Handle_twbx import WorkbookSource
+from output_writers import table_slug
+from lineage_graph import LineageBuilder, LineageGraph
+
+# Lookup indexes created on top of the workbook_path index every table gets
+CATALOG_INDEXES = {
+    "Connections": [["type"], ["connection"]],
+    "Data Source Access": [["mode"]],
+    "Tables": [["table"], ["name"]],
+    "Custom SQL Findings": [["rule"]],
+    "Columns": [["table", "column"], ["key"]],
+    "Calculations": [["name"], ["caption"]],
+    "Worksheet Columns": [["name"], ["worksheet"]],
+    "Dashboard Objects": [["dashboard_object"], ["dashboard"]],
+    "Dashboard Cost": [["dashboard"]],
+    "Assets": [["type"]],
+    "Performance Findings": [["rule"], ["name"]],
+}
+
+WORKBOOK_EXTENSIONS = (".twb", ".twbx", ".tds", ".tdsx")
+
+
+def quote_identifier(name):
+    """quote a table or column name for SQLite"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def find_workbooks(paths):
+    """expand files and directories (recursively) into Tableau file paths"""
+    for path in paths:
+        if os.path.isdir(path):
+            # matched on the exact extension, so backups such as Sales.twb~ are left out
+            yield from sorted(
+                file_path
+                for file_path in glob.glob(os.path.join(path, "**", "*.t*"), recursive=True)
+                if os.path.splitext(file_path)[1].lower() in WORKBOOK_EXTENSIONS
+            )
+        else:
+            yield path
+
+
+class MetadataCatalog:
+    """Indexed SQLite catalog of documented workbooks"""
+
+    def __init__(self, database, style_guide=None, lineage=True):
+        self.database = database
+        self.style_guide = style_guide
+        self.connection = sqlite3.connect(database, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self._record_tables = {
+            record_type: sheet_name for sheet_name, _, record_type in EXTRACTED_TABLES
+        }
+        self._insert_sql = {}
+        self.create_schema()
+        # the lineage graph lives in the same database and is updated in the same transactions
+        self.lineage = LineageGraph(self.connection) if lineage else None
+
+    def close(self):
+        """close the database connection"""
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def create_schema(self):
+        """create the workbooks table and one table per record type if they don't exist"""
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS workbooks ("
+            "workbook_path TEXT PRIMARY KEY, "
+            "content_hash TEXT, "
+            "document_type TEXT, "
+            "documented_at REAL)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_workbooks_hash ON workbooks (content_hash)"
+        )
+        for sheet_name, _, _ in EXTRACTED_TABLES:
+            self._create_record_table(cursor, sheet_name)
+
+    def _create_record_table(self, cursor, sheet_name):
+        table = table_slug(sheet_name)
+        columns = ["workbook_path"] + SPREADSHEET_COLUMNS[sheet_name]
+        column_sql = ", ".join(f"{quote_identifier(column)} TEXT" for column in columns)
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {quote_identifier(table)} ({column_sql}, "
+            "FOREIGN KEY (workbook_path) REFERENCES workbooks (workbook_path) "
+            "ON DELETE CASCADE)"
+        )
+        # catalogs created before a column was added to the sheet get it added, empty for the
+        # workbooks already documented until they are documented again
+        existing = {
+            row[1].lower()
+            for row in cursor.execute(f"PRAGMA table_info({quote_identifier(table)})")
+        }
+        for column in columns:
+            if column.lower() not in existing:
+                cursor.execute(
+                    f"ALTER TABLE {quote_identifier(table)} "
+                    f"ADD COLUMN {quote_identifier(column)} TEXT"
+                )
+        index_columns = [["workbook_path"]] + CATALOG_INDEXES.get(sheet_name, [])
+        for index in index_columns:
+            index_name = quote_identifier(f"idx_{table}_{'_'.join(index)}")
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {index_name} ON {quote_identifier(table)} "
+                f"({', '.join(quote_identifier(column) for column in index)})"
+            )
+        # columns named as the order of a migrated table differs
+        placeholders = ", ".join("?" * len(columns))
+        self._insert_sql[sheet_name] = (
+            f"INSERT INTO {quote_identifier(table)} "
+            f"({', '.join(quote_identifier(column) for column in columns)}) "
+            f"VALUES ({placeholders})"
+        )
+
+    def stored_hash(self, workbook_path):
+        """content hash recorded for a workbook, None if it isn't in the catalog"""
+        row = self.connection.execute(
+            "SELECT content_hash FROM workbooks WHERE workbook_path = ?",
+            (workbook_path,),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _write_workbook(self, workbook_path, content_hash, documentation):
+        """replace a workbook's rows. Must be called inside a transaction"""
+        cursor = self.connection.cursor()
+        # rows in the record tables are removed by the cascade
+        cursor.execute("DELETE FROM workbooks WHERE workbook_path = ?", (workbook_path,))
+        cursor.execute(
+            "INSERT INTO workbooks VALUES (?, ?, ?, ?)",
+            (workbook_path, content_hash, documentation.document_type, time.time()),
+        )
+
+        lineage = LineageBuilder(workbook_path) if self.lineage is not None else None
+        rows = {}
+        for record in documentation.iter_records():
+            if lineage is not None:
+                lineage.add(record)
+            sheet_name = self._record_tables[record.record_type]
+            rows.setdefault(sheet_name, []).append(
+                [workbook_path]
+                + [
+                    None if record.data.get(column) is None else str(record.data[column])
+                    for column in SPREADSHEET_COLUMNS[sheet_name]
+                ]
+            )
+        for sheet_name, table_rows in rows.items():
+            cursor.executemany(self._insert_sql[sheet_name], table_rows)
+        if lineage is not None:
+            self.lineage.replace_workbook(workbook_path, lineage)
+
+    def upsert_workbook(self, workbook_path, force=False):
+        """Document a single workbook into the catalog in its own transaction.
+        Returns False when the workbook is unchanged since it was last catalogued."""
+        workbook_path = os.path.normpath(workbook_path)
+        return self.upsert_workbooks([workbook_path], force=force)[workbook_path]
+
+    def upsert_workbooks(self, workbook_paths, batch_size=100, force=False):
+        """Document many workbooks, committing once per batch. Unchanged workbooks are skipped and
+        a workbook that fails to process is rolled back on its own without losing the batch.
+        Returns {path: True (updated) / False (unchanged) / None (error)}"""
+        results = {}
+        pending = 0
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN")
+        try:
+            for workbook_path in workbook_paths:
+                workbook_path = os.path.normpath(workbook_path)
+                try:
+                    # hashed and parsed from the same memory mapped read
+                    with WorkbookSource(workbook_path) as source:
+                        content_hash = source.sha256()
+                        if not force and self.stored_hash(workbook_path) == content_hash:
+                            logging.info("%s unchanged. Skipping", workbook_path)
+                            results[workbook_path] = False
+                            continue
+
+                        cursor.execute("SAVEPOINT workbook")
+                        try:
+                            documentation = WorkbookDocumentation(
+                                source, self.style_guide, stream=True
+                            )
+                            self._write_workbook(workbook_path, content_hash, documentation)
+                        except Exception:
+                            cursor.execute("ROLLBACK TO workbook")
+                            raise
+                        finally:
+                            cursor.execute("RELEASE workbook")
+                except Exception:  # e.g. an unreadable file: skip it, not the batch
+                    logging.exception("error cataloguing %s", workbook_path)
+                    results[workbook_path] = None
+                    continue
+                results[workbook_path] = True
+                pending += 1
+
+                if pending >= batch_size:
+                    cursor.execute("COMMIT")
+                    cursor.execute("BEGIN")
+                    pending = 0
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        return results
+
+    def remove_workbook(self, workbook_path):
+        """remove a workbook and all of its records"""
+        workbook_path = os.path.normpath(workbook_path)
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN")
+        cursor.execute("DELETE FROM workbooks WHERE workbook_path = ?", (workbook_path,))
+        if self.lineage is not None:
+            self.lineage.remove_workbook(workbook_path)
+        cursor.execute("COMMIT")
+
+    def query(self, sql, parameters=()):
+        """run a read query against the catalog"""
+        return self.connection.execute(sql, parameters).fetchall()
+
+    def workbooks_using_table(self, table):
+        """workbooks with a relation to the table, matched on either the table or relation name"""
+        return [
+            row[0]
+            for row in self.query(
+                'SELECT DISTINCT workbook_path FROM tables WHERE "table" = ? OR name = ? '
+                "ORDER BY workbook_path",
+                (table, table),
+            )
+        ]
+
+    def access_summary(self):
+        """(mode, data sources, total packaged extract bytes) for live and extract"""
+        return self.query(
+            "SELECT mode, COUNT(*), SUM(CAST(extract_size AS INTEGER)) "
+            "FROM data_source_access GROUP BY mode ORDER BY mode"
+        )
+
+    def extract_candidates(self, limit=50):
+        """live data sources that would gain most from an extract, ranked by the worksheets
+        querying them plus the scores of their custom SQL and calculation findings:
+        (workbook_path, datasource, connection types, worksheets, SQL score, calculation score)"""
+        return self.query(
+            "SELECT a.workbook_path, a.datasource, a.connection_types, "
+            "(SELECT COUNT(DISTINCT w.worksheet) FROM worksheet_columns w "
+            "WHERE w.workbook_path = a.workbook_path AND w.datasource = a.datasource) "
+            "AS worksheets, "
+            "(SELECT COALESCE(SUM(CAST(f.score AS INTEGER)), 0) FROM custom_sql_findings f "
+            "WHERE f.workbook_path = a.workbook_path AND f.datasource = a.datasource) "
+            "AS sql_score, "
+            "(SELECT COALESCE(SUM(CAST(p.score AS INTEGER)), 0) FROM performance_findings p "
+            "WHERE p.workbook_path = a.workbook_path AND p.datasource = a.datasource) "
+            "AS calculation_score "
+            "FROM data_source_access a WHERE a.mode = 'live' "
+            "ORDER BY worksheets + sql_score + calculation_score DESC, a.workbook_path "
+            "LIMIT ?",
+            (limit,),
+        )
+
+    def extract_trim_candidates(self, limit=50):
+        """extracts ranked by packaged size, with how many of their columns worksheets use:
+        (workbook_path, datasource, extract file, bytes, extracted columns, used columns,
+        row limit, extract filters). Extracts of unpackaged files have no size and come last"""
+        return self.query(
+            "SELECT a.workbook_path, a.datasource, a.extract_file, "
+            "CAST(a.extract_size AS INTEGER) AS size, CAST(a.extract_columns AS INTEGER), "
+            "(SELECT COUNT(DISTINCT w.name) FROM worksheet_columns w "
+            "WHERE w.workbook_path = a.workbook_path AND w.datasource = a.datasource), "
+            "a.row_limit, CAST(a.extract_filters AS INTEGER) "
+            "FROM data_source_access a WHERE a.mode = 'extract' "
+            "ORDER BY size DESC, a.workbook_path LIMIT ?",
+            (limit,),
+        )
+
+    def dashboard_costs(self, limit=50):
+        """the dashboards with the highest estimated render cost across every workbook"""
+        return self.query(
+            "SELECT workbook_path, dashboard, score, detail FROM dashboard_cost "
+            "ORDER BY CAST(score AS INTEGER) DESC, workbook_path LIMIT ?",
+            (limit,),
+        )
+
+    def custom_sql_findings(self, limit=50):
+        """the custom SQL queries with the highest total finding score across every workbook,
+        worst first: (workbook_path, datasource, name, score, rules)"""
+        return self.query(
+            "SELECT workbook_path, datasource, name, SUM(CAST(score AS INTEGER)) AS total, "
+            "GROUP_CONCAT(rule, ', ') FROM custom_sql_findings "
+            "GROUP BY workbook_path, datasource, connection, name "
+            "ORDER BY total DESC, workbook_path LIMIT ?",
+            (limit,),
+        )
+
+    def performance_findings(self, limit=50, severity=None):
+        """the highest scoring calculation findings across every workbook, worst first"""
+        where = "WHERE severity = ? " if severity else ""
+        return self.query(
+            "SELECT workbook_path, datasource, caption, rule, severity, score, detail "
+            f"FROM performance_findings {where}"
+            "ORDER BY CAST(score AS INTEGER) DESC, workbook_path LIMIT ?",
+            (severity, limit) if severity else (limit,),
+        )
+
+
+def main():
+    """Catalog workbooks from the command line"""
+    parser = argparse.ArgumentParser(
+        description="Add Tableau workbooks and data sources to a SQLite metadata catalog"
+    )
+    parser.add_argument("catalog", help="SQLite database file")
+    parser.add_argument("paths", nargs="+", help="Files or directories to catalog")
+    parser.add_argument("--style-guide", help="Style guide json for validation")
+    parser.add_argument(
+        "--force", action="store_true", help="Re-document unchanged workbooks"
+    )
+    parser.add_argument(
+        "--report",
+        type=int,
+        metavar="N",
+        help="Print the N most expensive dashboards, custom SQL and calculations in the catalog",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        filename="metadata_catalog.log",
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+    start_time = time.perf_counter()
+    with MetadataCatalog(args.catalog, args.style_guide) as catalog:
+        results = catalog.upsert_workbooks(find_workbooks(args.paths), force=args.force)
+    updated = sum(1 for result in results.values() if result)
+    skipped = sum(1 for result in results.values() if result is False)
+    errors = [path for path, result in results.items() if result is None]
+    print(
+        f"{updated} updated, {skipped} unchanged, {len(errors)} errors "
+        f"in {round(time.perf_counter() - start_time, 2)} seconds"
+    )
+    for path in errors:
+        print(f"Error: {path}")
+    if args.report:
+        with MetadataCatalog(args.catalog, lineage=False) as catalog:
+            print_report(catalog, args.report)
+
+
+def print_report(catalog, limit):
+    """print the catalog's worst dashboards, custom SQL and calculations, and the data sources
+    to move to or trim as extracts, to know what to optimize first"""
+    print("Most expensive dashboards:")
+    for workbook_path, dashboard, score, detail in catalog.dashboard_costs(limit):
+        print(f"{score:>6}  {workbook_path}  {dashboard}")
+        print(f"        {detail}")
+    print("Slowest custom SQL:")
+    for workbook_path, datasource, name, score, rules in catalog.custom_sql_findings(limit):
+        print(f"{score:>6}  {workbook_path}  {datasource}  {name}: {rules}")
+    print("Slowest calculation patterns:")
+    for workbook_path, datasource, caption, rule, _, score, _ in catalog.performance_findings(
+        limit
+    ):
+        print(f"{score:>6}  {workbook_path}  {datasource}  {caption}: {rule}")
+    print("Data sources:")
+    for mode, count, size in catalog.access_summary():
+        print(f"{count:>6}  {mode}" + (f", {size:,} bytes of packaged extracts" if size else ""))
+    print("Live connections to consider extracting (worksheets, SQL score, calc score):")
+    for workbook_path, datasource, types, worksheets, sql_score, calc_score in (
+        catalog.extract_candidates(limit)
+    ):
+        print(
+            f"{worksheets:>6} {sql_score:>4} {calc_score:>4}  {workbook_path}  {datasource} "
+            f"({types})"
+        )
+    print("Largest extracts to consider trimming (bytes, columns used/extracted):")
+    for row in catalog.extract_trim_candidates(limit):
+        workbook_path, datasource, _, size, columns, used_columns, row_limit, filters = row
+        notes = [] if filters or row_limit else ["all rows"]
+        print(
+            f"{size or 0:>12,}  {used_columns}/{columns or '?'}  {workbook_path}  {datasource}"
+            + (f" ({', '.join(notes)})" if notes else "")
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+Columnar output writers for extracted workbook metadata.
+
+Each extracted table (Connections, Calculations, ...) is appended to a single dataset
+shared by every documented workbook, instead of one spreadsheet per workbook. All tables
+use the column layout from WorkbookDocumentation.SPREADSHEET_COLUMNS with a leading
+workbook_id column.
+
+    $ python output_writers.py --format parquet --output-dir tables/ workbooks/
+
+Parquet datasets can hold parts written by older versions with other column types. read_table
+reads a table with every part cast to the current schema:
+
+    assets = read_table("tables/", "Assets").to_pandas()
+"""
+import abc
+import argparse
+import csv
+import logging
+import os
+import sys
+import uuid
+
+from WorkbookDocumentation import SPREADSHEET_COLUMNS, workbook_documentation
+
+WORKBOOK_ID_COLUMN = "workbook_id"
+# recorded in the metadata of each Parquet part. Version 1, with no version recorded, wrote
+# every column as strings; version 2 types INTEGER_COLUMNS as int64
+SCHEMA_VERSION = 2
+# columns holding counts, sizes and scores. Typed as integers where the format has types
+INTEGER_COLUMNS = {
+    "Custom SQL Findings": ["score"],
+    "Assets": ["size", "compressed_size"],
+    "Data Source Access": [
+        "extract_size",
+        "compressed_size",
+        "rows",
+        "row_limit",
+        "extract_filters",
+        "extract_columns",
+    ],
+    "Dashboard Cost": [
+        "score",
+        "worksheets",
+        "datasources",
+        "quick_filters",
+        "relevant_filters",
+        "marks_heavy_fields",
+        "table_calcs",
+    ],
+    "Performance Findings": ["score"],
+}
+
+
+def table_schema(table_name):
+    """column names written for a table"""
+    return [WORKBOOK_ID_COLUMN] + SPREADSHEET_COLUMNS[table_name]
+
+
+def table_slug(table_name):
+    """file system friendly table name, e.g. 'Worksheet Columns' -> worksheet_columns"""
+    return table_name.lower().replace(" ", "_")
+
+
+def _as_text(value):
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return "|".join(str(item) for item in value)
+    return str(value)
+
+
+def _as_integer(value):
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        logging.warning("%r is not a whole number. Written as empty", value)
+        return None
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as err:
+        raise ImportError("pyarrow is required for Parquet output") from err
+    return pyarrow
+
+
+def parquet_schema(table_name):
+    """Arrow schema of a table's Parquet parts: INTEGER_COLUMNS are int64, the others strings"""
+    pa = _import_pyarrow()
+    integer_columns = INTEGER_COLUMNS.get(table_name, [])
+    return pa.schema(
+        [
+            (column, pa.int64() if column in integer_columns else pa.string())
+            for column in table_schema(table_name)
+        ],
+        metadata={"schema_version": str(SCHEMA_VERSION)},
+    )
+
+
+def _conform(part, schema):
+    """a part's columns in the order and types of schema. Columns the part lacks are empty;
+    text written by an older version is converted as the writer converts it now"""
+    pa = _import_pyarrow()
+    arrays = []
+    for field in schema:
+        if field.name not in part.column_names:
+            arrays.append(pa.nulls(part.num_rows, field.type))
+            continue
+        column = part.column(field.name)
+        if column.type == field.type:
+            arrays.append(column)
+        elif pa.types.is_integer(field.type) and not pa.types.is_integer(column.type):
+            arrays.append(
+                pa.array([_as_integer(value) for value in column.to_pylist()], type=field.type)
+            )
+        else:
+            arrays.append(column.cast(field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def read_table(output_dir, table_name):
+    """Read a table written by ParquetTableWriter into one pyarrow Table. Every part is cast
+    to parquet_schema(table_name), so parts from older versions combine with new ones"""
+    pa = _import_pyarrow()
+    schema = parquet_schema(table_name)
+    table_dir = os.path.join(output_dir, table_slug(table_name))
+    part_paths = sorted(
+        os.path.join(table_dir, name)
+        for name in (os.listdir(table_dir) if os.path.isdir(table_dir) else [])
+        if name.endswith(".parquet")
+    )
+    parts = [_conform(pa.parquet.read_table(path), schema) for path in part_paths]
+    return pa.concat_tables(parts) if parts else schema.empty_table()
+
+
+class TableWriter(abc.ABC):
+    """Base class for writers that append extracted tables to per-table datasets"""
+
+    extension = ""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+
+    def path_for(self, table_name):
+        """full path of the dataset holding a table"""
+        return os.path.join(self.output_dir, f"{table_slug(table_name)}.{self.extension}")
+
+    def rows_for(self, table_name, workbook_id, records):
+        """yield records as lists ordered by the table schema"""
+        columns = SPREADSHEET_COLUMNS[table_name]
+        for record in records:
+            yield [workbook_id] + [_as_text(record.get(column)) for column in columns]
+
+    @abc.abstractmethod
+    def write_table(self, table_name, workbook_id, records):
+        """append the records of one workbook to a table"""
+
+    def close(self):
+        """flush and close any open datasets"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CsvTableWriter(TableWriter):
+    """Append each table to <output_dir>/<table>.csv. The header is only written for new files,
+    so repeated runs and many workbooks build up one file per table. Appending to a file with
+    other columns, e.g. from an older version, raises ValueError."""
+
+    extension = "csv"
+
+    def __init__(self, output_dir):
+        super().__init__(output_dir)
+        self._files = {}
+
+    def _writer(self, table_name):
+        if table_name not in self._files:
+            path = self.path_for(table_name)
+            new_file = not os.path.isfile(path) or os.path.getsize(path) == 0
+            if not new_file:
+                with open(path, newline="", encoding="utf-8") as existing_file:
+                    header = next(csv.reader(existing_file), [])
+                if header != table_schema(table_name):
+                    raise ValueError(
+                        f"{path} has columns {', '.join(header)}, expected "
+                        f"{', '.join(table_schema(table_name))}. Write to a new output directory"
+                    )
+            out_file = open(path, "a", newline="", encoding="utf-8")
+            writer = csv.writer(out_file)
+            if new_file:
+                writer.writerow(table_schema(table_name))
+            self._files[table_name] = (out_file, writer)
+        return self._files[table_name][1]
+
+    def write_table(self, table_name, workbook_id, records):
+        writer = self._writer(table_name)
+        writer.writerows(self.rows_for(table_name, workbook_id, records))
+
+    def close(self):
+        for out_file, _ in self._files.values():
+            out_file.close()
+        self._files = {}
+
+
+class ParquetTableWriter(TableWriter):
+    """Write each table as a Parquet dataset directory, <output_dir>/<table>/part-<run>.parquet.
+    Every workbook becomes one row group of the run's part file, so the file stays open until
+    close() is called. Later runs add new part files to the same dataset. Columns in
+    INTEGER_COLUMNS are int64, the others strings, and each part records SCHEMA_VERSION.
+    Read datasets with read_table. Requires pyarrow."""
+
+    extension = "parquet"
+
+    def __init__(self, output_dir, compression="snappy"):
+        pyarrow = _import_pyarrow()
+
+        super().__init__(output_dir)
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.compression = compression
+        # unique across processes and hosts writing to the same dataset
+        self.run_id = uuid.uuid4().hex
+        self._writers = {}
+
+    def path_for(self, table_name):
+        table_dir = os.path.join(self.output_dir, table_slug(table_name))
+        os.makedirs(table_dir, exist_ok=True)
+        return os.path.join(table_dir, f"part-{self.run_id}.{self.extension}")
+
+    def write_table(self, table_name, workbook_id, records):
+        if not records:
+            return
+        schema = parquet_schema(table_name)
+        columns = list(zip(*self.rows_for(table_name, workbook_id, records)))
+        arrays = []
+        for field, values in zip(schema, columns):
+            if self._pa.types.is_integer(field.type):
+                values = [_as_integer(value) for value in values]
+            arrays.append(self._pa.array(values, type=field.type))
+        batch = self._pa.Table.from_arrays(arrays, schema=schema)
+        if table_name not in self._writers:
+            self._writers[table_name] = self._pq.ParquetWriter(
+                self.path_for(table_name), schema, compression=self.compression
+            )
+        self._writers[table_name].write_table(batch)
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+
+TABLE_WRITERS = {
+    "csv": CsvTableWriter,
+    "parquet": ParquetTableWriter,
+}
+
+
+def get_table_writer(output_format, output_dir):
+    """create the writer registered for an output format"""
+    try:
+        writer_class = TABLE_WRITERS[output_format.lower()]
+    except KeyError as err:
+        raise ValueError(
+            f"Unknown output format {output_format}. Use one of {', '.join(TABLE_WRITERS)}"
+        ) from err
+    logging.info("Writing %s tables to %s", output_format, output_dir)
+    return writer_class(output_dir)
+
+
+def main():
+    """Document workbooks into per-table CSV or Parquet datasets from the command line"""
+    from metadata_catalog import find_workbooks
+
+    parser = argparse.ArgumentParser(
+        description="Write the metadata tables of Tableau workbooks and data sources"
+    )
+    parser.add_argument("paths", nargs="+", help="Files or directories to document")
+    parser.add_argument("--format", default="parquet", choices=sorted(TABLE_WRITERS))
+    parser.add_argument("--output-dir", required=True, help="Directory of the datasets")
+    parser.add_argument("--style-guide", help="Style guide json for validation")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    errors = 0
+    with get_table_writer(args.format, args.output_dir) as table_writer:
+        for path in find_workbooks(args.paths):
+            try:
+                workbook_documentation(path, args.output_dir, args.style_guide, table_writer)
+            except Exception:  # reported per file so one bad file doesn't stop the run
+                logging.exception("Unable to document %s", path)
+                errors += 1
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
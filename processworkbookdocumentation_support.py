@@ -14,7 +14,6 @@ from tkinter import BooleanVar
 import logging
 import glob
 import support_functions
-from WorkbookDocumentation import workbook_documentation
 
 
 def set_tk_var():
@@ -130,6 +129,9 @@ def process_files():
     global w
     global suppress_error_dialogs
 
+    # imported on first use so the window opens without loading the documentation code
+    from WorkbookDocumentation import workbook_documentation
+
     old_foc = top_level.focus_get()
 
     input_file_dir = support_functions.validate_infile(inEntryTxt.get(), file_or_dir)
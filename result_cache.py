@@ -0,0 +1,91 @@
+"""
+Bounded in-memory cache for generated documentation, keyed by a hash of the uploaded content.
+Safe to share between threads (e.g. Streamlit sessions).
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """LRU cache with a time to live and limits on entry count and total bytes"""
+
+    def __init__(self, max_entries=128, max_bytes=256 * 1024 * 1024, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires at, value)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(data, *options) -> str:
+        """content hash of the uploaded bytes plus any options that change the output"""
+        digest = hashlib.sha256(data)
+        for option in options:
+            digest.update(b"\0" + str(option).encode("utf-8"))
+        return digest.hexdigest()
+
+    @staticmethod
+    def _sizeof(value):
+        return len(value) if isinstance(value, (bytes, bytearray, memoryview)) else 0
+
+    def get(self, key):
+        """cached value, or None when missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """store a value, evicting the least recently used entries to stay within the limits"""
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._size += size
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def get_or_compute(self, key, compute):
+        """return the cached value or compute, store and return it"""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def _remove(self, key):
+        _, value = self._entries.pop(key)
+        self._size -= self._sizeof(value)
+
+    def clear(self):
+        """remove every entry"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        """entry count, size and hit counts"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
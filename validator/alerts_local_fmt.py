@@ -69,7 +69,7 @@ def err_msg(count):
         return print(str(f'{PrintAlerts.FAIL_TESTS} {count} styles need revision.'))
 
 
-def msg(alert, value, pos=None, valid=True, level=None, kind=None):
+def msg(alert, value, pos=None, valid=True, level=None, kind=None, suggestion=None):
     # If you do not wish to see the valid statements,
     # you can comment this first "if valid" clause out.
     if valid:
@@ -81,5 +81,8 @@ def msg(alert, value, pos=None, valid=True, level=None, kind=None):
     if not valid:
         if 'font-size' in kind:
             return print(str(f'{alert} {str(value + "pt"):20s} found in {str(pos):20s} of dashboard {str(level + ".")}'))
+        elif suggestion is not None:
+            return print(str(f'{alert} {str(value):20s} found in {str(pos):20s} of dashboard {str(level + ".")} '
+                             f'Nearest allowed: {suggestion}'))
         else:
             return print(str(f'{alert} {str(value):20s} found in {str(pos):20s} of dashboard {str(level + ".")}'))
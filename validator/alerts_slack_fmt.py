@@ -59,7 +59,7 @@ def slack_err_msg(count):
         return str(f'{SlackAlerts.FAIL_TESTS}   {count} styles need revision.')
 
 
-def slack_msg(alert, value, pos=None, valid=True, level=None, kind=None):
+def slack_msg(alert, value, pos=None, valid=True, level=None, kind=None, suggestion=None):
     # If you do not wish to see the valid statements,
     # you can comment this first "if valid" clause out.
     if valid:
@@ -71,5 +71,8 @@ def slack_msg(alert, value, pos=None, valid=True, level=None, kind=None):
     if not valid:
         if 'font-size' in kind:
             return str('{}  `{:16s}` found in {:8s} of {}'.format(str(alert), str(value + "pt"), str(pos), str(level)))
+        elif suggestion is not None:
+            return str('{} `{:16s}` found in {:8s} of {}  (nearest allowed: `{}`)'.format(
+                str(alert), str(value), str(pos), str(level), str(suggestion)))
         else:
             return str('{} `{:16s}` found in {:8s} of {}'.format(str(alert), str(value), str(pos), str(level)))
@@ -0,0 +1,142 @@
+import re
+
+# numpy is imported by the functions that use it, so validating a workbook whose colors all
+# follow the style guide never loads it
+
+HEX_COLOR = re.compile(r'^#?([0-9A-Fa-f]{6})$')
+
+# sRGB (D65) -> CIE XYZ
+RGB_TO_XYZ = (
+    (0.4124564, 0.3575761, 0.1804375),
+    (0.2126729, 0.7151522, 0.0721750),
+    (0.0193339, 0.1191920, 0.9503041),
+)
+D65_WHITE = (0.95047, 1.00000, 1.08883)
+
+
+def normalize_hex(hex_code):
+    # '#abcdef' / 'abcdef' -> '#ABCDEF', None if it is not a 6 digit hex color
+    match = HEX_COLOR.match(str(hex_code).strip())
+    if match is None:
+        return None
+    return '#' + match.group(1).upper()
+
+
+def hex_to_lab(hex_codes):
+    #
+    # Convert a sequence of normalized '#RRGGBB' codes to an (N, 3) array of CIE Lab values
+    #
+    import numpy as np
+
+    if len(hex_codes) == 0:
+        return np.empty((0, 3))
+
+    packed = np.array([int(h[1:], 16) for h in hex_codes], dtype=np.uint32)
+    rgb = np.stack([(packed >> 16) & 0xFF, (packed >> 8) & 0xFF, packed & 0xFF], axis=1) / 255.0
+
+    # Undo sRGB gamma
+    linear = np.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4, rgb / 12.92)
+
+    xyz = linear @ np.array(RGB_TO_XYZ).T / np.array(D65_WHITE)
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+
+    return np.stack([
+        116 * f[:, 1] - 16,
+        500 * (f[:, 0] - f[:, 1]),
+        200 * (f[:, 1] - f[:, 2]),
+    ], axis=1)
+
+
+def nearest_palette_colors(hex_codes, palette):
+    """
+    Pair every color in 'hex_codes' with the perceptually closest color in 'palette' (CIE76 delta E).
+
+    All distinct colors in 'hex_codes' are compared against the palette in a single matrix operation.
+    validate_styles passes every color of one workbook, once per palette it looks up (see
+    PaletteSuggestions). Returns a dict keyed by the normalized color: {'#A0CBE8': ('#8EC8FF', 9.61), ...}.
+    Colors that are not 6 digit hex codes are skipped.
+    """
+    palette_hex = list(dict.fromkeys(filter(None, (normalize_hex(p) for p in palette or []))))
+    colors = list(dict.fromkeys(filter(None, (normalize_hex(h) for h in hex_codes))))
+    if not palette_hex or not colors:
+        return {}
+
+    import numpy as np
+
+    colors_lab = hex_to_lab(colors)
+    palette_lab = hex_to_lab(palette_hex)
+
+    # |a - b|^2 = |a|^2 + |b|^2 - 2ab keeps the work at N x M instead of N x M x 3
+    distances = (
+        np.einsum('ij,ij->i', colors_lab, colors_lab)[:, None]
+        + np.einsum('ij,ij->i', palette_lab, palette_lab)[None, :]
+        - 2 * colors_lab @ palette_lab.T
+    )
+    nearest = distances.argmin(axis=1)
+    delta_e = np.sqrt(np.maximum(distances[np.arange(len(colors)), nearest], 0))
+
+    return {
+        color: (palette_hex[idx], round(float(de), 2))
+        for color, idx, de in zip(colors, nearest, delta_e)
+    }
+
+
+def collect_style_colors(styles):
+    # Walk the parsed style dictionaries (see parse_xml.get_tableau_styles) and return every hex color found
+    found = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            for v in node.values():
+                walk(v)
+        elif isinstance(node, (list, tuple)):
+            for v in node:
+                walk(v)
+        elif isinstance(node, str) and normalize_hex(node) is not None and node.strip().startswith('#'):
+            found.append(node)
+
+    walk(styles)
+    return found
+
+
+class PaletteSuggestions:
+    """
+    Nearest-color lookup for each color list in the style guide, built the first time a palette is
+    looked up. A workbook with no invalid colors never asks, so the Lab conversion is skipped.
+    """
+
+    PALETTES = ('font-colors', 'background-colors', 'border-colors')
+
+    def __init__(self, styles, sg):
+        self.styles = styles
+        self.sg = sg
+        self._colors = None
+        self._palettes = {}
+
+    def get(self, palette_name, default=None):
+        if palette_name not in self.PALETTES:
+            return default
+        if palette_name not in self._palettes:
+            if self._colors is None:
+                wb_colors = (self.styles.get('workbook_styles') or {}).get('all_colors_in_wb', [])
+                self._colors = [*wb_colors, *collect_style_colors(self.styles)]
+            self._palettes[palette_name] = nearest_palette_colors(self._colors, self.sg.get(palette_name))
+        return self._palettes[palette_name]
+
+
+def suggest_palette_colors(styles, sg):
+    """
+    Build the nearest-color lookup for each color list in the style guide.
+
+    Every color in the workbook (get_all_colors plus any color found in the parsed styles) is converted
+    to Lab once and matched against each palette in turn, when the palette is first looked up.
+    """
+    return PaletteSuggestions(styles, sg)
+
+
+def nearest_color(suggestions, palette_name, hex_code):
+    # Look up the suggested replacement for one color, None if there is nothing to suggest
+    if not suggestions:
+        return None
+    match = suggestions.get(palette_name, {}).get(normalize_hex(hex_code))
+    return match[0] if match else None
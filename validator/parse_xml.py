@@ -1,11 +1,12 @@
 import collections
 
-from bs4 import BeautifulSoup
-
 from validator.helpers import get_style_rules, get_styles_from_dict, get_distinct_styles, get_all_colors
 
 
 def get_tableau_styles(workbook_file):
+    # bs4 (and the lxml parser it uses) is imported here, so importing the validator stays cheap
+    from bs4 import BeautifulSoup
+
     # Create Beautiful Soup XML object from .twb file
     wb_xml = BeautifulSoup(workbook_file, 'lxml')
 
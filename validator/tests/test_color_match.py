@@ -0,0 +1,71 @@
+import itertools
+
+import pytest
+
+from validator.color_match import (
+    hex_to_lab,
+    nearest_color,
+    nearest_palette_colors,
+    normalize_hex,
+    suggest_palette_colors,
+)
+
+PALETTE = ["#1F77B4", "#FF7F0E", "#2CA02C", "#D62728"]
+STYLE_GUIDE = {"font-colors": PALETTE, "background-colors": ["#FFFFFF"], "border-colors": []}
+
+
+def _styles(*colors):
+    return {"workbook_styles": {"all_colors_in_wb": list(colors)}}
+
+
+@pytest.mark.parametrize(
+    "hex_code, lab",
+    [
+        ("#FFFFFF", (100.0, 0.0, 0.0)),
+        ("#000000", (0.0, 0.0, 0.0)),
+        ("#FF0000", (53.24, 80.09, 67.20)),
+        ("#0000FF", (32.30, 79.19, -107.86)),
+    ],
+)
+def test_hex_to_lab(hex_code, lab):
+    assert hex_to_lab([hex_code])[0].tolist() == pytest.approx(lab, abs=0.01)
+
+
+def test_normalize_hex():
+    assert normalize_hex(" ff7f0e") == "#FF7F0E"
+    assert normalize_hex("#FFF") is None
+    assert normalize_hex("red") is None
+
+
+def test_invalid_color_maps_to_the_nearest_palette_color():
+    suggestions = suggest_palette_colors(_styles("#FF8000", "#2BA12D", "#fefefe"), STYLE_GUIDE)
+
+    assert nearest_color(suggestions, "font-colors", "#ff8000") == "#FF7F0E"
+    assert nearest_color(suggestions, "font-colors", "#2BA12D") == "#2CA02C"
+    assert nearest_color(suggestions, "background-colors", "#FEFEFE") == "#FFFFFF"
+    # colors not in the workbook have no suggestion
+    assert nearest_color(suggestions, "font-colors", "#123456") is None
+
+
+def test_batch_larger_than_the_palette():
+    colors = [
+        f"#{r:02X}{g:02X}{b:02X}" for r, g, b in itertools.product((0, 90, 180, 255), repeat=3)
+    ]
+    matches = nearest_palette_colors(colors + ["not a color"], PALETTE)
+
+    assert len(colors) > len(PALETTE)
+    assert sorted(matches) == sorted(colors)
+    colors_lab, palette_lab = hex_to_lab(colors), hex_to_lab(PALETTE)
+    for color, color_lab in zip(colors, colors_lab):
+        distances = [sum((color_lab - lab) ** 2) ** 0.5 for lab in palette_lab]
+        nearest, delta_e = matches[color]
+        assert nearest == PALETTE[distances.index(min(distances))]
+        assert delta_e == pytest.approx(min(distances), abs=0.01)
+
+
+@pytest.mark.parametrize("palette_name", ["border-colors", "missing-colors"])
+def test_empty_palette_has_no_suggestion(palette_name):
+    suggestions = suggest_palette_colors(_styles("#FF8000"), STYLE_GUIDE)
+
+    assert nearest_color(suggestions, palette_name, "#FF8000") is None
+    assert nearest_palette_colors(["#FF8000"], []) == {}
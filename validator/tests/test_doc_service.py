@@ -0,0 +1,28 @@
+import pytest
+
+from doc_service import content_disposition
+from job_queue import content_key_for
+
+
+@pytest.mark.parametrize(
+    "file_name, expected",
+    [
+        ("Sales Documentation.xlsx", "filename=\"Sales Documentation.xlsx\""),
+        ('a".xlsx\r\nSet-Cookie: x=1', "filename=\"a.xlsxSet-Cookie: x=1\""),
+        ("Ventes é\\t.json", "filename=\"Ventes t.json\""),
+    ],
+)
+def test_content_disposition_cannot_break_out_of_the_header(file_name, expected):
+    header = content_disposition(file_name)
+
+    assert header.startswith("attachment; " + expected + "; filename*=UTF-8''")
+    assert header.isprintable() and header.isascii()
+    assert header.count('"') == 2
+
+
+def test_xlsx_cache_keys_ignore_the_file_name():
+    data = b"<workbook />"
+    assert content_key_for(data, "xlsx", "a.twb") == content_key_for(data, "xlsx", "b.twb")
+    # the record formats include the file name
+    assert content_key_for(data, "json", "a.twb") != content_key_for(data, "json", "b.twb")
+    assert content_key_for(data, "json", "a.twb") != content_key_for(data, "xlsx", "a.twb")
@@ -0,0 +1,117 @@
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pytest
+
+from job_queue import DONE, RUNNING, JobQueue
+
+WORKBOOK = os.path.join(os.path.dirname(__file__), "example_workbook.twb")
+
+
+class _CountingExecutor(ThreadPoolExecutor):
+    def __init__(self):
+        super().__init__(max_workers=2)
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append(args[0])
+        return super().submit(fn, *args)
+
+
+class _StalledExecutor:
+    """pool whose files never finish, like one still busy in another process"""
+
+    def submit(self, fn, *args):
+        return Future()
+
+
+@pytest.fixture
+def workbook():
+    with open(WORKBOOK, "rb") as f:
+        return f.read()
+
+
+def _wait_for(jobs, job_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while jobs.status(job_id)["status"] != DONE:
+        assert time.monotonic() < deadline, jobs.status(job_id)
+        time.sleep(0.05)
+
+
+def _statuses(jobs, job_id):
+    return [f["status"] for f in jobs.status(job_id)["files"]]
+
+
+def test_queues_sharing_a_database_claim_each_file_once(tmp_path, workbook):
+    executors = [_CountingExecutor(), _CountingExecutor()]
+    queues = [
+        JobQueue(str(tmp_path / "jobs.db"), str(tmp_path / "jobs"), workers=2, executor=executor)
+        for executor in executors
+    ]
+    try:
+        # different names, so no file reuses the output of another
+        job_id = queues[0].submit(
+            [(f"Sales {index}.twb", workbook) for index in range(8)], "json"
+        )
+        _wait_for(queues[1], job_id)
+        assert _statuses(queues[1], job_id) == [DONE] * 8
+    finally:
+        for queue in queues:
+            queue.close()
+        for executor in executors:
+            executor.shutdown()
+
+    submitted = executors[0].submitted + executors[1].submitted
+    assert sorted(submitted) == sorted(set(submitted))
+    assert len(submitted) == 8
+
+
+def _owner(jobs, job_id):
+    return jobs._execute("SELECT owner FROM job_files WHERE job_id = ?", (job_id,))[0][0]
+
+
+def test_only_abandoned_running_files_are_queued_again(tmp_path, workbook):
+    database, artifact_dir = str(tmp_path / "jobs.db"), str(tmp_path / "jobs")
+    running = JobQueue(database, artifact_dir, workers=1, executor=_StalledExecutor())
+    job_id = running.submit([("Sales.twb", workbook)])
+    deadline = time.monotonic() + 10
+    while _statuses(running, job_id) != [RUNNING]:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+    # a queue started alongside a live one leaves its files alone
+    started = JobQueue(database, artifact_dir, workers=1, executor=_StalledExecutor())
+    assert _statuses(started, job_id) == [RUNNING]
+    assert _owner(started, job_id) == running.owner
+
+    # once the queue running it is gone, the file is queued again and claimed by the other
+    running.close()
+    started._requeue_abandoned()
+    while _owner(started, job_id) != started.owner:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert _statuses(started, job_id) == [RUNNING]
+    started.close()
+
+
+def test_documentation_generated_recently_skips_the_queue(tmp_path, workbook):
+    executor = _CountingExecutor()
+    jobs = JobQueue(str(tmp_path / "jobs.db"), str(tmp_path / "jobs"), executor=executor)
+    try:
+        first = jobs.submit([("Sales.twb", workbook)])
+        _wait_for(jobs, first)
+        second = jobs.submit([("Sales copy.twb", workbook)])
+        assert _statuses(jobs, second) == [DONE]
+        outputs = []
+        for job_id in (first, second):
+            with open(jobs.result_path(job_id, 0), "rb") as f:
+                outputs.append(f.read())
+        assert outputs[0] == outputs[1]
+        # the record formats include the file name, so they are documented again
+        third = jobs.submit([("Sales copy.twb", workbook)], "json")
+        _wait_for(jobs, third)
+    finally:
+        jobs.close()
+        executor.shutdown()
+    assert len(executor.submitted) == 2
@@ -0,0 +1,150 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from calc_linter import lint_calculations, tokenize_formula
+from connection_rules import custom_sql_to_review
+from custom_sql import analyze_sql, find_custom_sql, table_references
+
+SERVER_INFO = {"database_server": "db", "database_schema": "public", "database_user": "me"}
+
+
+def _calculation(name, formula, caption=None):
+    return {
+        "datasource": "Sales",
+        "caption": caption or name.strip("[]"),
+        "name": name,
+        "calculation": formula,
+    }
+
+
+def _rules(findings):
+    return {(finding.name, finding.rule) for finding in findings}
+
+
+#
+# CALCULATIONS
+#
+@pytest.mark.parametrize(
+    "formula, rule",
+    [
+        ("COUNTD(UPPER([Customer Name]))", "countd_string"),
+        ("{FIXED [Region] : SUM({FIXED [State] : SUM([Sales])})}", "nested_fixed"),
+        ("RUNNING_SUM(SUM(IF CONTAINS([Product], 'x') THEN 1 ELSE 0 END))", "table_calc_string"),
+        ("ATTR([Customer ID])", "attr_high_cardinality"),
+        (
+            "IF [Region] = 'East' THEN 1 ELSEIF [Region] = 'West' THEN 2 "
+            "ELSEIF [Region] = 'North' THEN 3 ELSEIF [Region] = 'South' THEN 4 END",
+            "if_chain",
+        ),
+    ],
+)
+def test_calculation_rules(formula, rule):
+    assert _rules(lint_calculations([_calculation("[calc]", formula)])) == {("[calc]", rule)}
+
+
+@pytest.mark.parametrize(
+    "formula",
+    [
+        "SUM([Sales]) // COUNTD(UPPER([Customer Name]))",
+        "SUM([Sales]) /* {FIXED [Region] : SUM({FIXED [State] : SUM([Sales])})} */",
+        "IF [Region] = 'East' THEN 1 ELSEIF [Segment] = 'x' THEN 2 END",
+        "COUNTD([Order ID])",
+        "'COUNTD(UPPER([Customer Name]))'",
+    ],
+)
+def test_calculations_without_findings(formula):
+    assert lint_calculations([_calculation("[calc]", formula)]) == []
+
+
+def test_references_are_followed_into_other_calculations():
+    calculations = [
+        _calculation("[upper_name]", "UPPER([Customer Name])"),
+        _calculation("[distinct_names]", "COUNTD([upper_name])"),
+        _calculation("[region_sales]", "{FIXED [Region] : SUM([Sales])}"),
+        _calculation("[nested]", "{FIXED [State] : AVG([region_sales])}"),
+    ]
+    findings = lint_calculations(calculations)
+
+    assert _rules(findings) == {
+        ("[distinct_names]", "countd_string"),
+        ("[nested]", "nested_fixed"),
+    }
+    # highest score first
+    assert [finding.score for finding in findings] == [8, 6]
+
+
+def test_tokenizer_skips_comments_and_keeps_strings_whole():
+    assert tokenize_formula("upper([a]) // countd([b])\n+ 'x [c]'") == [
+        ("word", "UPPER"),
+        ("symbol", "("),
+        ("field", "[a]"),
+        ("symbol", ")"),
+        ("symbol", "+"),
+        ("string", "'x [c]'"),
+    ]
+
+
+#
+# CUSTOM SQL
+#
+@pytest.mark.parametrize(
+    "sql, rules",
+    [
+        (
+            "SELECT * FROM sales.orders o WHERE o.id IN "
+            "(SELECT r.id FROM returns r WHERE r.order_id = o.id) ORDER BY o.id",
+            {"correlated_subquery", "order_by_subquery", "select_star"},
+        ),
+        ("SELECT a FROM x UNION SELECT a FROM y", {"missing_predicate", "union_without_all"}),
+        ("SELECT DISTINCT a, b, c, d, e, f, g, h FROM t WHERE a = 1", {"distinct_wide"}),
+        ("SELECT TOP 10 a FROM t WHERE a = 1 ORDER BY a", set()),
+        ("SELECT a FROM t WHERE a = 1 UNION ALL SELECT a FROM u WHERE a = 2", set()),
+    ],
+)
+def test_sql_rules(sql, rules):
+    assert {finding.rule for finding in analyze_sql(sql)} == rules
+
+
+def test_table_references_skip_comments_strings_and_functions():
+    sql = "SELECT EXTRACT(YEAR FROM d) FROM db.s.t -- FROM fake\n WHERE 'FROM x' = b"
+    assert [str(table) for table in table_references(sql)] == ["db.s.t"]
+
+
+def _datasource(sql, **attributes):
+    datasource = ET.Element("datasource", attributes)
+    connection = ET.SubElement(datasource, "connection", {"class": "federated"})
+    relation = ET.SubElement(
+        connection, "relation", {"connection": "postgres.1", "name": "Query", "type": "text"}
+    )
+    relation.text = sql
+    return datasource
+
+
+def test_custom_sql_outside_the_new_schema_is_reported():
+    root = ET.Element("workbook")
+    datasources = ET.SubElement(root, "datasources")
+    datasources.append(
+        _datasource("SELECT a FROM public.orders JOIN sales.returns r ON 1 = 1", caption="Sales")
+    )
+    datasources.append(_datasource("SELECT a FROM public.orders", caption="Orders"))
+
+    queries = custom_sql_to_review(root, SERVER_INFO)
+    assert [(query.datasource, query.name) for query in queries] == [("Sales", "Query")]
+    assert [str(table) for table in queries[0].schema_references("public")] == ["sales.returns"]
+    # nothing is moved without a server, schema and user
+    assert custom_sql_to_review(root, {"database_schema": "public"}) == []
+
+
+@pytest.mark.parametrize(
+    "attributes, datasource_name",
+    [
+        ({"caption": "Sales", "formatted-name": "federated.1", "name": "ds"}, "Sales"),
+        ({"formatted-name": "federated.1", "name": "ds"}, "federated.1"),
+        ({}, "Sales Extract"),
+    ],
+)
+def test_root_data_source_naming(attributes, datasource_name):
+    root = _datasource("SELECT a FROM t", **attributes)
+    queries = find_custom_sql(root, "extracts/Sales Extract.tds")
+    assert [query.datasource for query in queries] == [datasource_name]
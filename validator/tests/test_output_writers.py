@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.parquet as pq  # noqa: E402
+
+from output_writers import (  # noqa: E402
+    SCHEMA_VERSION,
+    ParquetTableWriter,
+    read_table,
+    table_schema,
+)
+
+ASSET = {"file": "Image/logo.png", "type": "image", "size": 2048, "compressed_size": "1024"}
+
+
+def _write_version_1_part(output_dir):
+    """a part as written before INTEGER_COLUMNS were typed: every column a string"""
+    table_dir = os.path.join(output_dir, "assets")
+    os.makedirs(table_dir)
+    columns = table_schema("Assets")
+    row = ["old", "Data/sales.hyper", "extract", "4096", "", None]
+    pq.write_table(
+        pa.table({column: pa.array([value], pa.string()) for column, value in zip(columns, row)}),
+        os.path.join(table_dir, "part-old.parquet"),
+    )
+
+
+def test_parts_of_older_versions_are_read_with_the_current_schema(tmp_path):
+    _write_version_1_part(str(tmp_path))
+    with ParquetTableWriter(str(tmp_path)) as writer:
+        writer.write_table("Assets", "new", [ASSET])
+
+    new_part = pq.read_schema(writer.path_for("Assets"))
+    assert new_part.metadata[b"schema_version"] == str(SCHEMA_VERSION).encode()
+    # the parts can't be read as one dataset directly
+    with pytest.raises(pa.ArrowException):
+        pq.read_table(str(tmp_path / "assets")).to_pylist()
+
+    table = read_table(str(tmp_path), "Assets")
+    assert table.schema.field("size").type == pa.int64()
+    assert sorted(table.to_pylist(), key=lambda row: row["workbook_id"]) == [
+        {
+            "workbook_id": "new",
+            "file": "Image/logo.png",
+            "type": "image",
+            "size": 2048,
+            "compressed_size": 1024,
+            "modified": None,
+        },
+        {
+            "workbook_id": "old",
+            "file": "Data/sales.hyper",
+            "type": "extract",
+            "size": 4096,
+            "compressed_size": None,
+            "modified": None,
+        },
+    ]
+
+
+def test_missing_table_reads_as_empty(tmp_path):
+    table = read_table(str(tmp_path), "Assets")
+    assert table.num_rows == 0
+    assert table.column_names == table_schema("Assets")
@@ -0,0 +1,86 @@
+import io
+import shutil
+import subprocess
+import zipfile
+
+import pytest
+
+from Handle_twbx import copy_member_raw, rewrite_archive
+
+WORKBOOK = b"<?xml version='1.0' encoding='utf-8' ?><workbook><datasources /></workbook>"
+EXTRACT = bytes(range(256)) * 4096
+
+
+class _Unseekable(io.RawIOBase):
+    """write only stream, so zipfile writes a data descriptor after each member"""
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+
+def _archive_with_data_descriptors(path):
+    stream = _Unseekable()
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr("Sales.twb", WORKBOOK)
+        zip_file.writestr("Data/Extracts/sales.hyper", EXTRACT)
+        zip_file.writestr("Image/logo.png", b"\x89PNG" + EXTRACT[:1000], zipfile.ZIP_STORED)
+    path.write_bytes(stream.buffer.getvalue())
+    with zipfile.ZipFile(path) as zip_file:
+        assert all(info.flag_bits & 0x08 for info in zip_file.infolist())
+    return path
+
+
+def _check_archive(path):
+    with zipfile.ZipFile(path) as zip_file:
+        assert zip_file.testzip() is None
+    if shutil.which("unzip"):
+        result = subprocess.run(["unzip", "-t", str(path)], capture_output=True, text=True)
+        assert result.returncode == 0, result.stdout + result.stderr
+
+
+def test_copy_member_raw_drops_the_data_descriptor(tmp_path):
+    source = _archive_with_data_descriptors(tmp_path / "source.twbx")
+    target = tmp_path / "target.twbx"
+    with open(source, "rb") as source_file, zipfile.ZipFile(source_file) as source_zip:
+        with zipfile.ZipFile(target, "w") as target_zip:
+            for info in source_zip.infolist():
+                copy_member_raw(source_file, info, target_zip)
+
+    _check_archive(target)
+    with zipfile.ZipFile(source) as source_zip, zipfile.ZipFile(target) as target_zip:
+        for source_info, target_info in zip(source_zip.infolist(), target_zip.infolist()):
+            assert target_info.filename == source_info.filename
+            assert not target_info.flag_bits & 0x08
+            # copied, not recompressed
+            assert target_info.compress_size == source_info.compress_size
+            assert target_info.CRC == source_info.CRC
+            assert target_zip.read(target_info) == source_zip.read(source_info)
+
+
+@pytest.mark.parametrize("as_file_objects", [False, True])
+def test_rewrite_archive_replaces_one_member(tmp_path, as_file_objects):
+    source = _archive_with_data_descriptors(tmp_path / "source.twbx")
+    target = tmp_path / "target.twbx"
+    updated = WORKBOOK.replace(b"<datasources />", b"<datasources><datasource /></datasources>")
+    if as_file_objects:
+        with open(source, "rb") as source_file, open(target, "wb") as target_file:
+            rewrite_archive(source_file, target_file, "Sales.twb", updated)
+    else:
+        rewrite_archive(source, target, "Sales.twb", updated)
+
+    _check_archive(target)
+    with zipfile.ZipFile(target) as zip_file:
+        assert zip_file.namelist() == [
+            "Sales.twb",
+            "Data/Extracts/sales.hyper",
+            "Image/logo.png",
+        ]
+        assert zip_file.read("Sales.twb") == updated
+        assert zip_file.read("Data/Extracts/sales.hyper") == EXTRACT
+        assert zip_file.getinfo("Image/logo.png").compress_type == zipfile.ZIP_STORED
@@ -0,0 +1,150 @@
+import base64
+import zipfile
+
+import pytest
+
+import xml_backend
+import xml_payloads
+from Handle_twbx import WorkbookSource, save_file, xml_open
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 64
+THUMBNAIL = base64.b64encode(PNG)
+WORKBOOK = (
+    b"<?xml version='1.0' encoding='utf-8' ?>\n"
+    b"<workbook xmlns:user='http://www.tableausoftware.com/xml/user'>"
+    b"<datasources><datasource name='Sales' user:ui-name='Sales' /></datasources>"
+    b"<thumbnails>"
+    b"<thumbnail height='192' name='Overview' width='192'>" + THUMBNAIL + b"</thumbnail>"
+    b"<thumbnail height='192' name='Empty' width='192' />"
+    b"</thumbnails>"
+    b"<!-- <thumbnail name='commented'>abc</thumbnail> -->"
+    b"</workbook>"
+)
+# Application Data Models use the user: prefix without declaring it
+UNDECLARED_PREFIX = b"<datasource name='Model' user:ui-builder='data-model'><thumbnail>QUJD</thumbnail></datasource>"
+
+BACKENDS = [
+    "etree",
+    pytest.param(
+        "lxml",
+        marks=pytest.mark.skipif(not xml_backend.lxml_available(), reason="lxml not installed"),
+    ),
+]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_payloads_are_left_out_and_decoded_on_request(backend):
+    root, payloads = xml_payloads.parse_document(WORKBOOK, backend=backend)
+
+    thumbnail = root.find("./thumbnails/thumbnail[@name='Overview']")
+    assert not thumbnail.text
+    assert list(payloads) == [thumbnail]
+    assert payloads[thumbnail].read() == THUMBNAIL
+    assert payloads[thumbnail].decode() == PNG
+    # the rest of the tree is parsed as usual
+    assert root.find("./datasources/datasource").get("name") == "Sales"
+    assert root.find("./thumbnails/thumbnail[@name='Empty']") is not None
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_keep_payloads_matches_elementtree(backend):
+    root, payloads = xml_payloads.parse_document(WORKBOOK, keep_payloads=True, backend=backend)
+    expected = xml_backend.ET.fromstring(WORKBOOK)
+
+    assert payloads == {}
+    assert root.find("./thumbnails/thumbnail").text == THUMBNAIL.decode()
+    assert [element.tag for element in root.iter()] == [
+        element.tag for element in expected.iter()
+    ]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_undeclared_user_prefix_is_dropped(backend):
+    root, payloads = xml_payloads.parse_document(UNDECLARED_PREFIX, backend=backend)
+
+    assert root.get("ui-builder") == "data-model"
+    assert [reference.decode() for reference in payloads.values()] == [b"ABC"]
+
+
+@pytest.mark.parametrize("keep_payloads", [False, True])
+@pytest.mark.parametrize(
+    "prolog", [b"", b"<?xml version='1.0' encoding='utf-8' ?>\n<!-- <a user:b='c'> -->\n"]
+)
+def test_undeclared_user_prefix_is_parsed_once(monkeypatch, keep_payloads, prolog):
+    parsers = []
+    xml_parser = xml_backend.ET.XMLParser
+
+    def counting_parser(*args, **kwargs):
+        parsers.append(args)
+        return xml_parser(*args, **kwargs)
+
+    def no_fallback(*args):
+        raise AssertionError("parsed again by _parse_expat")
+
+    monkeypatch.setattr(xml_backend.ET, "XMLParser", counting_parser)
+    monkeypatch.setattr(xml_payloads, "_parse_expat", no_fallback)
+    document = prolog + UNDECLARED_PREFIX.replace(b"</datasource>", b"<user:note /></datasource>")
+    root, _ = xml_payloads.parse_document(document, keep_payloads=keep_payloads, backend="etree")
+
+    assert len(parsers) == 1
+    assert root.attrib == {"name": "Model", "ui-builder": "data-model"}
+    assert [element.tag for element in root] == ["thumbnail", "note"]
+
+
+@pytest.mark.parametrize("packaged", [False, True])
+def test_workbook_source_reads_payloads_back_from_the_file(tmp_path, packaged):
+    if packaged:
+        path = tmp_path / "Sales.twbx"
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.writestr("Sales.twb", WORKBOOK)
+    else:
+        path = tmp_path / "Sales.twb"
+        path.write_bytes(WORKBOOK)
+
+    with WorkbookSource(str(path)) as source:
+        source.parse()
+        assert [reference.decode() for reference in source.payloads.values()] == [PNG]
+        # the markup handed to the style validator has the payload text cut out
+        assert source.markup() == WORKBOOK.replace(THUMBNAIL, b"")
+        assert THUMBNAIL.decode() not in source.text
+
+
+def _outline(root):
+    return [(element.tag, dict(element.attrib), element.text) for element in root.iter()]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_without_payloads_round_trip(backend):
+    root, payloads = xml_payloads.parse_document(WORKBOOK, backend=backend)
+    markup = xml_payloads.without_payloads(WORKBOOK, payloads)
+
+    reparsed, _ = xml_payloads.parse_document(markup, keep_payloads=True, backend=backend)
+    assert _outline(reparsed) == _outline(root)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("document", [b"", b"<a><b></a>", b"<a>&undefined;</a>"])
+def test_malformed_xml_raises_parse_error(backend, document):
+    with pytest.raises(xml_backend.ET.ParseError):
+        xml_payloads.parse_document(document, backend=backend)
+
+
+@pytest.mark.parametrize("packaged", [False, True])
+def test_xml_open_keeps_payloads_through_save_file(tmp_path, packaged):
+    path = tmp_path / ("Sales.twbx" if packaged else "Sales.twb")
+    if packaged:
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.writestr("Sales.twb", WORKBOOK)
+    else:
+        path.write_bytes(WORKBOOK)
+
+    tree, _ = xml_open(str(path))
+    tree.getroot().find("./datasources/datasource").set("caption", "Renamed")
+    saved = tmp_path / path.name.replace("Sales", "Saved")
+    save_file(str(path), tree, str(saved))
+
+    root = xml_open(str(saved))[0].getroot()
+    assert root.find("./datasources/datasource").get("caption") == "Renamed"
+    assert root.find("./thumbnails/thumbnail[@name='Overview']").text == THUMBNAIL.decode()
+    # trees that are only read can still leave the payloads out
+    assert not xml_open(str(saved), keep_payloads=False)[0].find(".//thumbnail").text
@@ -0,0 +1,87 @@
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import web_ui
+from job_queue import DONE, JobQueue
+
+WORKBOOK = os.path.join(os.path.dirname(__file__), "example_workbook.twb")
+
+
+class _StalledExecutor:
+    """pool whose files never finish"""
+
+    def submit(self, fn, *args):
+        return Future()
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch):
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        queue = JobQueue(
+            str(tmp_path / "jobs.db"), str(tmp_path / "jobs"), workers=2, executor=executor
+        )
+        monkeypatch.setattr(web_ui, "get_job_queue", lambda: queue)
+        yield queue
+        queue.close()
+
+
+def _wait_for(jobs, job_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while jobs.status(job_id)["status"] != DONE:
+        assert time.monotonic() < deadline, jobs.status(job_id)
+        time.sleep(0.05)
+
+
+def _show_job(job_id):
+    import web_ui
+
+    web_ui.show_job(job_id)
+
+
+@pytest.mark.parametrize("file_count", [1, 2])
+def test_finished_job_renders_its_download(jobs, file_count):
+    with open(WORKBOOK, "rb") as f:
+        data = f.read()
+    job_id = jobs.submit([(f"Sales {index}.twb", data) for index in range(file_count)])
+    _wait_for(jobs, job_id)
+
+    app = AppTest.from_function(_show_job, args=(job_id,)).run(timeout=30)
+
+    assert not app.exception
+    assert len(app.get("download_button")) == 1
+
+
+def _submit(file_count):
+    import web_ui
+
+    class Upload:
+        def __init__(self, name):
+            self.name = name
+
+        def getvalue(self):
+            return b"<workbook />"
+
+    web_ui.submit_uploaded_files([Upload(f"{index}.twb") for index in range(file_count)])
+
+
+def test_uploads_are_limited_per_session(tmp_path, monkeypatch):
+    queue = JobQueue(
+        str(tmp_path / "jobs.db"), str(tmp_path / "jobs"), executor=_StalledExecutor()
+    )
+    monkeypatch.setattr(web_ui, "get_job_queue", lambda: queue)
+    try:
+        app = AppTest.from_function(_submit, args=(10,)).run()
+        assert not app.warning
+        # the first job is still running, so a second one would go over the session's limit
+        app.run()
+        assert len(app.warning) == 1
+        assert queue.pending_files() == 10
+        # other sessions have their own share of the queue
+        assert not AppTest.from_function(_submit, args=(10,)).run().warning
+        assert queue.pending_files() == 20
+    finally:
+        queue.close()
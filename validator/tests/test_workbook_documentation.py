@@ -0,0 +1,15 @@
+import os
+
+from WorkbookDocumentation import SPREADSHEET_COLUMNS, WorkbookDocumentation
+
+WORKBOOK = os.path.join(os.path.dirname(__file__), "example_workbook.twb")
+
+
+def test_field_map_sheet_is_written():
+    documentation = WorkbookDocumentation(WORKBOOK)
+    workbook = documentation.build_excel_workbook()
+
+    rows = list(workbook["Field Map"].values)
+    assert list(rows[0]) == SPREADSHEET_COLUMNS["Field Map"]
+    assert len(rows) - 1 == len(documentation.field_map) > 0
+    assert ("Sample - Superstore", "[Order ID]", "[Orders]", "[Order ID]") in rows
@@ -1,7 +1,7 @@
 from textwrap import dedent
 
-from validator.alerts_local_fmt import PrintAlerts, msg, err_msg
 from validator.alerts_slack_fmt import SlackAlerts, slack_msg, slack_err_msg
+from validator.color_match import suggest_palette_colors, nearest_color
 from validator.helpers import left_align_list
 from validator.parse_xml import get_tableau_styles
 
@@ -12,17 +12,20 @@ def validate_styles(style_guide_json, workbook_file):
     #
     styles = get_tableau_styles(workbook_file)
 
+    # Nearest allowed palette color for every color in the workbook, computed in one batch
+    nearest = suggest_palette_colors(styles, style_guide_json)
+
     # Workbook styles
     wb_styles = styles.get('workbook_styles')
-    wb_invalid, wb_valid = test_workbook(wb_styles, style_guide_json)
+    wb_invalid, wb_valid = test_workbook(wb_styles, style_guide_json, nearest)
 
     # Dashboard styles
     db_styles = styles.get('dashboard_styles')
-    db_invalid, db_valid = test_dashboards(db_styles, style_guide_json)
+    db_invalid, db_valid = test_dashboards(db_styles, style_guide_json, nearest)
 
     # Worksheet styles
     ws_styles = styles.get('worksheet_styles')
-    ws_invalid, ws_valid = test_worksheets(ws_styles, style_guide_json)
+    ws_invalid, ws_valid = test_worksheets(ws_styles, style_guide_json, nearest)
 
     styles_list = [*wb_invalid, *wb_valid, *db_invalid, *db_valid, *ws_invalid, *ws_valid]
     styles_objects = [{'styles': style} for style in styles_list]
@@ -33,7 +36,10 @@ def validate_styles(style_guide_json, workbook_file):
 #
 # WORKBOOK
 #
-def test_workbook(workbook_styles, sg):
+def test_workbook(workbook_styles, sg, nearest=None):
+    # colorama wraps stdout when imported, so it's only loaded once styles are reported
+    from validator.alerts_local_fmt import PrintAlerts, msg, err_msg
+
     # print('Workbook Styles at time of testing:\n', pp(workbook_styles))
     print(dedent('''
     
@@ -140,14 +146,16 @@ def test_workbook(workbook_styles, sg):
                                           item,
                                           valid=False,
                                           kind='font-color',
-                                          level='Workbook'))
+                                          level='Workbook',
+                                          suggestion=nearest_color(nearest, 'font-colors', s)))
 
                             msg(PrintAlerts.INVALID_FONT_COLOR,
                                 s.upper(),
                                 item,
                                 valid=False,
                                 kind='font-color',
-                                level='Workbook')
+                                level='Workbook',
+                                suggestion=nearest_color(nearest, 'font-colors', s))
                             wb_err_count += 1
                         else:
                             valid_wb_styles_list.append(
@@ -191,7 +199,9 @@ def test_workbook(workbook_styles, sg):
 #
 # DASHBOARDS
 #
-def test_dashboards(dashboard_styles, sg):
+def test_dashboards(dashboard_styles, sg, nearest=None):
+    from validator.alerts_local_fmt import PrintAlerts, msg, err_msg
+
     # print('Dashboard Styles at time of testing:\n', pp(dashboard_styles))
     print(dedent('''
 
@@ -286,14 +296,16 @@ def test_dashboards(dashboard_styles, sg):
                                                   item,
                                                   valid=False,
                                                   kind='font-color',
-                                                  level=db_name))
+                                                  level=db_name,
+                                                  suggestion=nearest_color(nearest, 'font-colors', s)))
 
                                     msg(PrintAlerts.INVALID_FONT_COLOR,
                                         s.upper(),
                                         item,
                                         valid=False,
                                         kind='font-color',
-                                        level=db_name)
+                                        level=db_name,
+                                        suggestion=nearest_color(nearest, 'font-colors', s))
                                     db_err_count += 1
                                 else:
                                     valid_db_styles_list.append(
@@ -327,7 +339,8 @@ def test_dashboards(dashboard_styles, sg):
                                             item,
                                             valid=False,
                                             kind='border-color',
-                                            level=db_name)
+                                            level=db_name,
+                                            suggestion=nearest_color(nearest, 'border-colors', val))
                                         db_err_count += 1
                                     else:
                                         msg(PrintAlerts.VALID_BORDER_COLOR,
@@ -429,7 +442,8 @@ def test_dashboards(dashboard_styles, sg):
                                             item,
                                             valid=False,
                                             kind='bg-color',
-                                            level=db_name)
+                                            level=db_name,
+                                            suggestion=nearest_color(nearest, 'background-colors', val))
                                         db_err_count += 1
                                     else:
                                         msg(PrintAlerts.VALID_BACKGROUND_COLOR,
@@ -483,7 +497,9 @@ def test_dashboards(dashboard_styles, sg):
 #
 # WORKSHEETS
 #
-def test_worksheets(worksheet_styles, sg):
+def test_worksheets(worksheet_styles, sg, nearest=None):
+    from validator.alerts_local_fmt import PrintAlerts, msg, err_msg
+
     # print('Worksheet Styles at time of testing:\n', pp(worksheet_styles))
     print(dedent('''
 
@@ -577,14 +593,16 @@ def test_worksheets(worksheet_styles, sg):
                                                   item,
                                                   valid=False,
                                                   kind='font-color',
-                                                  level=ws_name))
+                                                  level=ws_name,
+                                                  suggestion=nearest_color(nearest, 'font-colors', s)))
 
                                     msg(PrintAlerts.INVALID_FONT_COLOR,
                                         s.upper(),
                                         item,
                                         valid=False,
                                         kind='font-color',
-                                        level=ws_name)
+                                        level=ws_name,
+                                        suggestion=nearest_color(nearest, 'font-colors', s))
                                     ws_err_count += 1
                                 else:
                                     valid_ws_styles_list.append(
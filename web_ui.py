@@ -1,77 +1,116 @@
 """
     Web UI to parse tableau workbooks and data sources for documentation
 """
-import zipfile
-from os.path import splitext, basename
-import xml.etree.ElementTree as ET
-from io import StringIO, BytesIO
+import time
 import streamlit as st
-from WorkbookDocumentation import WorkbookDocumentation
+from job_queue import JobQueue, DONE, ERROR
+from result_cache import ResultCache
+
+# Limits for documentation cached across sessions
+CACHE_MAX_ENTRIES = 128
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+CACHE_TTL_SECONDS = 60 * 60
+
+# Job database and generated documentation, shared with doc_service.py when run from the same folder
+JOB_DATABASE = "documentation_jobs.db"
+JOB_ARTIFACT_DIR = "documentation_jobs"
+# Limits on finished documentation kept for download
+JOB_MAX_ARTIFACT_BYTES = 2 * 1024 * 1024 * 1024
+JOB_MAX_AGE_SECONDS = 24 * 60 * 60
+# Files waiting for or being processed, across all sessions and for one session
+MAX_QUEUED_FILES = 64
+MAX_SESSION_QUEUED_FILES = 16
+# Seconds between status checks while a job is running
+POLL_SECONDS = 1
+
+
+@st.cache_resource
+def get_result_cache() -> ResultCache:
+    """Documentation cache shared by every session of the app"""
+    return ResultCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_TTL_SECONDS)
+
+
+@st.cache_resource
+def get_job_queue() -> JobQueue:
+    """Job queue and worker pool shared by every session of the app"""
+    return JobQueue(
+        JOB_DATABASE,
+        JOB_ARTIFACT_DIR,
+        max_artifact_bytes=JOB_MAX_ARTIFACT_BYTES,
+        max_age_seconds=JOB_MAX_AGE_SECONDS,
+        cache=get_result_cache(),
+    )
 
 
-def find_file_in_zip(zip_file) -> str:
-    """Find workbook or data source in zip file"""
-    candidate_files = filter(
-        lambda x: x.split(".")[-1] in ("twb", "tds"), zip_file.namelist()
+def session_pending_files() -> int:
+    """files of this session's jobs that are waiting for or being processed"""
+    jobs = get_job_queue()
+    pending = 0
+    for job_id in st.session_state.setdefault("job_ids", []):
+        status = jobs.status(job_id)
+        if status is not None:
+            pending += status["total"] - status["finished"]
+    return pending
+
+
+def submit_uploaded_files(uploaded_files):
+    """Queue the uploads as one job and return its id. Returns None, with a warning, when
+    the queue or this session's share of it is full"""
+    if len(uploaded_files) > MAX_SESSION_QUEUED_FILES:
+        st.warning(f"Please upload at most {MAX_SESSION_QUEUED_FILES} files at a time")
+        return None
+    jobs = get_job_queue()
+    if (
+        jobs.pending_files() + len(uploaded_files) > MAX_QUEUED_FILES
+        or session_pending_files() + len(uploaded_files) > MAX_SESSION_QUEUED_FILES
+    ):
+        st.warning("Too many files are waiting to be processed. Please try again shortly")
+        return None
+    job_id = jobs.submit(
+        [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
     )
-
-    for filename in candidate_files:
-        with zip_file.open(filename) as xml_candidate:
-            try:
-                ET.parse(xml_candidate)
-                return filename
-            except ET.ParseError:
-                # That's not an XML file by gosh
-                pass
-
-
-def generate_xml_root(infile) -> ET.Element:
-    """Get the root element of the object XML"""
-    if zipfile.is_zipfile(infile):
-        with zipfile.ZipFile(infile) as zip_object:
-            target_file = find_file_in_zip(zip_object)
-            with zip_object.open(target_file) as xml_source:
-                object_tree = ET.parse(xml_source)
-                root = object_tree.getroot()
-
-    else:
-        stringio = StringIO(infile.getvalue().decode("utf-8"))
-        root = ET.fromstring(stringio.read())
-    return root
-
-
-def convert_to_bytes(doc_workbook) -> BytesIO:
-    """Convert object to byte data"""
-    with BytesIO() as output:
-        doc_workbook.save(output)
-        output.seek(0)
-        byte_data = output.read()
-    return byte_data
-
-
-def process_file(uploaded_file) -> BytesIO:
-    """process file to generate documentation workbook"""
-    root = generate_xml_root(uploaded_file)
-    style_guide = None
-    documentation = WorkbookDocumentation(root, style_guide)
-    doc_workbook = documentation.build_excel_workbook()
-    byte_data = convert_to_bytes(doc_workbook)
-    return byte_data
-
-
-def process_uploaded_files(uploaded_files):
-    """process list of files and generate document files"""
-    file_archive = BytesIO()
-    with zipfile.ZipFile(
-        file_archive, "a", compression=zipfile.ZIP_DEFLATED, allowZip64=False
-    ) as zip_file:
-        for uploaded_file in uploaded_files:
-            byte_data = process_file(uploaded_file)
-            out_file_name = (
-                splitext(basename(uploaded_file.name))[0] + " Documentation.xlsx"
+    st.session_state["job_ids"].append(job_id)
+    return job_id
+
+
+def show_job(job_id):
+    """Show the progress of a job and download buttons for the finished files.
+    Returns False once the job is done or no longer exists"""
+    jobs = get_job_queue()
+    status = jobs.status(job_id)
+    if status is None:
+        st.warning("This documentation job has expired. Please process the files again")
+        return False
+
+    st.progress(
+        status["progress"],
+        text=f"Processed {status['finished']} of {status['total']} file(s)",
+    )
+    icons = {DONE: "✅", ERROR: "❌"}
+    for job_file in status["files"]:
+        line = f"{icons.get(job_file['status'], '⏳')} {job_file['name']}"
+        if job_file["error"]:
+            line += f": {job_file['error']}"
+        st.write(line)
+
+    done_files = [f for f in status["files"] if f["status"] == DONE]
+    if status["status"] == DONE and not done_files:
+        st.warning("No documentation could be generated")
+    elif len(status["files"]) == 1 and done_files:
+        with open(jobs.result_path(job_id, done_files[0]["index"]), "rb") as f:
+            st.download_button(
+                "Download documentation file",
+                f.read(),
+                file_name=done_files[0]["output_name"],
             )
-            zip_file.writestr(out_file_name, byte_data)
-    return file_archive, byte_data, out_file_name
+    elif status["status"] == DONE:
+        # zipped once the job is done: while it runs the page reruns every second.
+        # download_button takes bytes, not the spooled file archive returns
+        with jobs.archive(job_id) as file_archive:
+            st.download_button("Download zip file", file_archive.read(), "Documentation.zip")
+    elif done_files:
+        st.write("The zip file can be downloaded once all files are processed")
+    return status["status"] != DONE
 
 
 def main():
@@ -88,14 +127,16 @@ def main():
 
         submitted = st.form_submit_button("Process file(s)")
 
-    if submitted is not None and len(uploaded_files) != 0:
-        file_archive, byte_data, out_file_name = process_uploaded_files(uploaded_files)
-        if len(uploaded_files) == 1:
-            st.download_button(
-                "Download documentation file", byte_data, file_name=out_file_name
-            )
-        elif len(uploaded_files) > 1:
-            st.download_button("Download zip file", file_archive, "Documentation.zip")
+    if submitted and len(uploaded_files) != 0:
+        job_id = submit_uploaded_files(uploaded_files)
+        if job_id is not None:
+            # the job id goes in the URL, so a reloaded or reopened page picks the job up again
+            st.query_params["job"] = job_id
+
+    job_id = st.query_params.get("job")
+    if job_id is not None and show_job(job_id):
+        time.sleep(POLL_SECONDS)
+        st.rerun()
 
 
 if __name__ == "__main__":
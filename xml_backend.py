@@ -0,0 +1,205 @@
+"""
+Choose the XML parser: lxml when it is installed, the standard library's ElementTree otherwise.
+
+Both build trees with the same find/findall/iter/attrib interface, so the extractors don't care
+which one they get. lxml parses in C and evaluates compiled XPath; the stdlib backend needs no
+extra package. The choice is made once per process, from TABLEAU_XML_BACKEND ("lxml" or
+"etree") if set, so worker processes follow the environment:
+
+    root = xml_backend.parse(data)
+    COLUMN_MAPS = xml_backend.XPath(".//connection/cols/map")
+    column_maps = COLUMN_MAPS.index(root, "key")  # {"[Sales]": [<map>], ...}
+
+lxml is only imported when something is parsed or queried with it.
+"""
+import copy
+import importlib.util
+import mmap
+import os
+import re
+import xml.etree.ElementTree as ET
+
+BACKENDS = ("lxml", "etree")
+# sources parsed in place rather than read. mmap covers memory mapped workbooks
+BYTES_LIKE = (bytes, bytearray, memoryview, mmap.mmap)
+# bytes handed to the parser at a time
+PARSE_CHUNK_SIZE = 1 << 20
+# prefixes dropped when used without a declaration. Application Data Models write user:
+# attributes without declaring the namespace
+UNDECLARED_PREFIXES = frozenset(("user",))
+UNDECLARED_PREFIX_MESSAGE = re.compile(r"Namespace prefix (\S+) ")
+
+
+def lxml_available() -> bool:
+    """True when lxml is installed, without importing it"""
+    return importlib.util.find_spec("lxml") is not None
+
+
+def _default_backend():
+    backend = os.environ.get("TABLEAU_XML_BACKEND")
+    if backend:
+        if backend not in BACKENDS:
+            raise ValueError(f"TABLEAU_XML_BACKEND must be one of {BACKENDS}, not {backend!r}")
+        return backend
+    return "lxml" if lxml_available() else "etree"
+
+
+BACKEND = _default_backend()
+
+
+def set_backend(name):
+    """Use name ("lxml" or "etree") for the rest of this process"""
+    global BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"backend must be one of {BACKENDS}, not {name!r}")
+    if name == "lxml" and not lxml_available():
+        raise ValueError("lxml is not installed")
+    BACKEND = name
+
+
+def is_lxml(element) -> bool:
+    """True for an element (or tree) built by lxml"""
+    return type(element).__module__.startswith("lxml")
+
+
+def parse(source, backend=None, huge_tree=True, remove_comments=True, remove_pis=True):
+    """
+    Parse XML bytes (or another BYTES_LIKE source, such as a memory mapped file) or a binary
+    file object and return the root element. Attributes with an
+    undeclared user: prefix lose the prefix instead of failing the parse. huge_tree lifts
+    lxml's limits on text size and nesting depth, which large packaged workbooks can exceed.
+    Comments and processing instructions are dropped by default; the stdlib backend always
+    drops them, as ET.parse does. Raises ET.ParseError on malformed XML with either backend
+    """
+    if (backend or BACKEND) == "lxml":
+        return parse_lxml_chunks(iter_chunks(source), huge_tree, remove_comments, remove_pis)
+    # ElementTree's C parser, through the payload skipping parser with every payload kept
+    import xml_payloads
+
+    return xml_payloads.parse_document(source, keep_payloads=True, backend="etree")[0]
+
+
+def iter_chunks(source, start=0, end=None):
+    """bytes of a bytes-like source (from start to end) or a binary file object, a chunk at a
+    time, so a memory mapped file is never copied whole"""
+    if not isinstance(source, BYTES_LIKE):
+        yield from iter(lambda: source.read(PARSE_CHUNK_SIZE), b"")
+        return
+    view = memoryview(source)
+    end = len(view) if end is None else end
+    with view:
+        for position in range(start, end, PARSE_CHUNK_SIZE):
+            yield bytes(view[position : min(position + PARSE_CHUNK_SIZE, end)])
+
+
+def parse_lxml_chunks(chunks, huge_tree=True, remove_comments=True, remove_pis=True):
+    """parse with lxml from an iterable of byte chunks (see parse)"""
+    from lxml import etree
+
+    # recover so an undeclared prefix doesn't stop the parse. Every other error is raised
+    parser = etree.XMLParser(
+        recover=True,
+        huge_tree=huge_tree,
+        remove_comments=remove_comments,
+        remove_pis=remove_pis,
+    )
+    for chunk in chunks:
+        parser.feed(chunk)
+    try:
+        root = parser.close()
+    except etree.XMLSyntaxError:
+        root = None
+    undeclared = set()
+    # errors of the feed interface are only logged in feed_error_log
+    for entry in parser.feed_error_log:
+        if entry.type_name == "NS_ERR_UNDEFINED_NAMESPACE":
+            prefix = UNDECLARED_PREFIX_MESSAGE.match(entry.message)
+            if prefix and prefix.group(1) in UNDECLARED_PREFIXES:
+                undeclared.add(prefix.group(1) + ":")
+                continue
+        if entry.level >= etree.ErrorLevels.ERROR:
+            error = ET.ParseError(f"{entry.message}: line {entry.line}, column {entry.column}")
+            error.code, error.position = entry.type, (entry.line, entry.column)
+            raise error
+    if root is None:
+        raise ET.ParseError("no element found")
+    if undeclared:
+        _drop_prefixes(root, tuple(undeclared))
+    return root
+
+
+def _drop_prefixes(root, prefixes):
+    """rename prefix:name tags and attributes to name, keeping attribute order"""
+    for element in root.iter():
+        if not isinstance(element.tag, str):
+            continue
+        if element.tag.startswith(prefixes):
+            element.tag = element.tag.partition(":")[2]
+        if any(key.startswith(prefixes) for key in element.attrib):
+            attributes = list(element.attrib.items())
+            element.attrib.clear()
+            for key, value in attributes:
+                element.set(key.partition(":")[2] if key.startswith(prefixes) else key, value)
+
+
+def element_tree(root):
+    """the ElementTree holding root, of root's backend"""
+    return root.getroottree() if is_lxml(root) else ET.ElementTree(root)
+
+
+def tostring(element, pretty_print=False, xml_declaration=False) -> bytes:
+    """UTF-8 serialization of element with either backend"""
+    if is_lxml(element):
+        from lxml import etree
+
+        return etree.tostring(
+            element, encoding="utf-8", pretty_print=pretty_print, xml_declaration=xml_declaration
+        )
+    if pretty_print:
+        element = copy.deepcopy(element)
+        ET.indent(element)
+    return ET.tostring(element, encoding="utf-8", xml_declaration=xml_declaration)
+
+
+def write(tree, file, pretty_print=False):
+    """Write an ElementTree or element to a path or binary file object with an XML declaration.
+    pretty_print indents with either backend; the stdlib backend indents a copy"""
+    if is_lxml(tree):
+        tree.write(file, encoding="utf-8", pretty_print=pretty_print, xml_declaration=True)
+        return
+    root = tree.getroot() if isinstance(tree, ET.ElementTree) else tree
+    if pretty_print:
+        root = copy.deepcopy(root)
+        ET.indent(root)
+    ET.ElementTree(root).write(file, encoding="utf-8", xml_declaration=True)
+
+
+class XPath:
+    """
+    A path expression compiled once and evaluated against elements from either backend: with
+    lxml's compiled XPath for lxml elements, with ElementPath for stdlib elements, so
+    expressions must stay within what findall accepts. index() answers repeated lookups by
+    attribute value from a single evaluation
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self._compiled = None
+
+    def __call__(self, element) -> list:
+        if is_lxml(element):
+            if self._compiled is None:
+                from lxml import etree
+
+                self._compiled = etree.XPath(self.expression)
+            return self._compiled(element)
+        return element.findall(self.expression)
+
+    def index(self, element, attribute) -> dict:
+        """{attribute value: [matches in document order]}, for matches with the attribute"""
+        matches = {}
+        for match in self(element):
+            value = match.get(attribute)
+            if value is not None:
+                matches.setdefault(value, []).append(match)
+        return matches
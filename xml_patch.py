@@ -0,0 +1,102 @@
+"""
+Edit attributes of an XML document in place, leaving every other byte as it was.
+
+The document is parsed once into an ElementTree that remembers where each start tag begins.
+After the tree's attributes are changed only those attribute values are rewritten in the
+original bytes, so the declaration, namespaces, whitespace and attribute order are untouched:
+
+    root, offsets = parse_with_offsets(data)
+    root.find(".//connection").set("server", "new-server")
+    new_data = patch_attributes(data, offsets, [(element, "server", "new-server")])
+"""
+import re
+import xml.etree.ElementTree as ET
+from xml.parsers import expat
+
+# name="value" or name='value' inside a start tag, and the end of the start tag
+ATTRIBUTE = re.compile(rb"""\s+([^\s=/>]+)\s*=\s*("[^"]*"|'[^']*')""")
+START_TAG_END = re.compile(rb"\s*/?>")
+TAG_NAME = re.compile(rb"<[^\s/>]+")
+# characters escaped in attribute values. Whitespace is escaped so it survives normalization
+ATTRIBUTE_ESCAPES = {"&": "&amp;", "<": "&lt;", "\n": "&#10;", "\r": "&#13;", "\t": "&#9;"}
+
+
+def parse_with_offsets(data: bytes):
+    """Parse XML bytes into an Element tree. Returns (root, {element: byte offset of its start
+    tag}). Names are kept as written, prefixes included, so documents with undeclared
+    prefixes such as user: still parse"""
+    builder = ET.TreeBuilder()
+    offsets = {}
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+
+    def start(name, attributes):
+        offsets[builder.start(name, attributes)] = parser.CurrentByteIndex
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = builder.end
+    parser.CharacterDataHandler = builder.data
+    parser.Parse(data, True)
+    return builder.close(), offsets
+
+
+def _escape(value: str, quote: bytes) -> bytes:
+    escaped = "".join(ATTRIBUTE_ESCAPES.get(character, character) for character in value)
+    if quote == b'"':
+        escaped = escaped.replace('"', "&quot;")
+    else:
+        escaped = escaped.replace("'", "&apos;")
+    return escaped.encode("utf-8")
+
+
+def _patch_start_tag(data, offset, attributes):
+    """byte edits [(start, end, replacement)] to set attributes on the start tag at offset"""
+    position = TAG_NAME.match(data, offset).end()
+    edits = []
+    remaining = dict(attributes)
+    while True:
+        match = ATTRIBUTE.match(data, position)
+        if match is None:
+            break
+        name = match.group(1).decode("utf-8")
+        if name in remaining:
+            quote = match.group(2)[:1]
+            edits.append(
+                (
+                    match.start(2) + 1,
+                    match.end(2) - 1,
+                    _escape(remaining.pop(name), quote),
+                )
+            )
+        position = match.end()
+    if remaining:
+        # new attributes go at the end of the start tag
+        end = START_TAG_END.match(data, position).start()
+        added = b"".join(
+            f' {name}="'.encode("utf-8") + _escape(value, b'"') + b'"'
+            for name, value in remaining.items()
+        )
+        edits.append((end, end, added))
+    return edits
+
+
+def patch_attributes(data: bytes, offsets: dict, changes) -> bytes:
+    """Apply (element, attribute, new value) changes to the original bytes. Each element must
+    come from parse_with_offsets on the same data"""
+    by_element = {}
+    for element, attribute, value in changes:
+        by_element.setdefault(element, {})[attribute] = value
+
+    edits = []
+    for element, attributes in by_element.items():
+        edits.extend(_patch_start_tag(data, offsets[element], attributes))
+    edits.sort()
+
+    pieces = []
+    position = 0
+    for start, end, replacement in edits:
+        pieces.append(data[position:start])
+        pieces.append(replacement)
+        position = end
+    pieces.append(data[position:])
+    return b"".join(pieces)
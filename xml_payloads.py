@@ -0,0 +1,346 @@
+"""
+Parse Tableau XML without materializing embedded binary payloads.
+
+Saved workbooks carry base64 sheet thumbnails and can embed images. They are often most of the
+file's bytes and nothing documented uses them. parse_document builds the same tree ET.parse
+would, but the text of payload elements is left empty and recorded as a PayloadReference
+(offset and length into the source) that is only read and decoded on request:
+
+    root, payloads = parse_document(data)
+    for element, reference in payloads.items():
+        png = reference.decode()
+"""
+import base64
+import contextlib
+import io
+import re
+import xml.etree.ElementTree as ET
+import zipfile
+from xml.parsers import expat
+
+import xml_backend
+from xml_backend import UNDECLARED_PREFIXES
+
+# elements whose text is a base64 payload
+PAYLOAD_TAGS = frozenset(("thumbnail", "image"))
+# bytes handed to expat at a time
+PARSE_CHUNK_SIZE = xml_backend.PARSE_CHUNK_SIZE
+XML_NAMESPACES = {"xml": "http://www.w3.org/XML/1998/namespace"}
+# namespace declared for an undeclared prefix before the C parser sees the document, and
+# dropped from the parsed names again
+UNDECLARED_NAMESPACE = "urn:undeclared-prefix:{}"
+# the root element's start tag, after any XML declaration, comments and doctype
+ROOT_START_TAG = re.compile(
+    rb"(?:\xef\xbb\xbf)?(?:\s+|<\?.*?\?>|<!--.*?-->|<!DOCTYPE[^>]*>)*"
+    rb"<[^\s/>!?]+((?:[^>\"']|\"[^\"]*\"|'[^']*')*)",
+    re.DOTALL,
+)
+
+
+class PayloadReference:
+    """Location of an element's text in the source document. open_source returns a binary
+    file object of the document (e.g. the .twb inside a .twbx)"""
+
+    __slots__ = ("open_source", "offset", "length")
+
+    def __init__(self, open_source, offset, length):
+        self.open_source = open_source
+        self.offset = offset
+        self.length = length
+
+    def read(self) -> bytes:
+        """the raw (base64) text of the element"""
+        with self.open_source() as source:
+            source.seek(self.offset)
+            return source.read(self.length)
+
+    def decode(self) -> bytes:
+        """the decoded payload, e.g. PNG bytes of a thumbnail"""
+        return base64.b64decode(self.read())
+
+    def __repr__(self):
+        return f"PayloadReference(offset={self.offset}, length={self.length})"
+
+
+def file_opener(path):
+    """open_source for a file on disk"""
+    return lambda: open(path, "rb")
+
+
+def bytes_opener(data):
+    """open_source for a document held in memory"""
+    return lambda: io.BytesIO(data)
+
+
+def zip_member_opener(path, member):
+    """open_source for a member of a packaged file"""
+
+    @contextlib.contextmanager
+    def open_member():
+        with zipfile.ZipFile(path) as zip_file, zip_file.open(member) as source:
+            yield source
+
+    return open_member
+
+
+def _resolve(name, namespaces, default_namespace=True):
+    """{uri}local for a prefixed (or, for elements, default namespace) name as written.
+    Prefixes in UNDECLARED_PREFIXES that the document never declares are dropped"""
+    prefix, colon, local = name.rpartition(":")
+    if not colon:
+        uri = namespaces.get("") if default_namespace else None
+        return "{" + uri + "}" + name if uri else name
+    uri = namespaces.get(prefix)
+    if uri is not None:
+        return "{" + uri + "}" + local
+    if prefix in UNDECLARED_PREFIXES:
+        return local
+    raise ValueError(f"unbound prefix {prefix!r}")
+
+
+def parse_document(
+    source, open_source=None, keep_payloads=False, payload_tags=PAYLOAD_TAGS, backend=None
+):
+    """
+    Parse XML from bytes or a binary file object into an Element tree, leaving the text of
+    payload_tags elements out. Returns (root, {element: PayloadReference}). open_source is
+    used by the references to read the payloads back; it defaults to the bytes passed in.
+    With keep_payloads the text is kept, as with ET.parse, and no references are returned.
+    Attributes with an undeclared user: prefix (application Data Models) lose the prefix
+    instead of failing the parse. The tree is built by backend, xml_backend.BACKEND by
+    default. Raises ET.ParseError on malformed XML
+    """
+    if open_source is None and isinstance(source, xml_backend.BYTES_LIKE):
+        open_source = bytes_opener(source)
+    if (backend or xml_backend.BACKEND) == "lxml":
+        return _parse_lxml(source, open_source, keep_payloads, payload_tags)
+    return _parse_etree(source, open_source, keep_payloads, payload_tags)
+
+
+def _payload_spans(data, payload_tags):
+    """(offset, length) of the text of each payload_tags start tag in data, in document order,
+    None for elements with no text to skip (empty, self-closing or holding other elements)"""
+    start_tag = re.compile(
+        rb"<("
+        + b"|".join(re.escape(tag.encode("utf-8")) for tag in sorted(payload_tags))
+        + rb")(?=[\s/>])[^>]*>"
+    )
+    spans = []
+    for match in start_tag.finditer(data):
+        text_start = match.end()
+        text_end = data.find(b"<", text_start)
+        end_tag = b"</" + match.group(1)
+        if (
+            match.group().endswith(b"/>")
+            or text_end <= text_start
+            or data[text_end : text_end + len(end_tag)] != end_tag
+        ):
+            spans.append(None)
+        else:
+            spans.append((text_start, text_end - text_start))
+    return spans
+
+
+def _chunks_without(data, spans, position=0):
+    """the document from position around the payload text of spans, a chunk at a time,
+    without joining it into one copy"""
+    for span in filter(None, spans):
+        yield from xml_backend.iter_chunks(data, position, span[0])
+        position = span[0] + span[1]
+    yield from xml_backend.iter_chunks(data, position)
+
+
+def _parse_lxml(source, open_source, keep_payloads, payload_tags):
+    """parse_document with lxml: the payload text is cut from the bytes before lxml parses
+    them, so it's never held in the tree"""
+    if keep_payloads:
+        return xml_backend.parse(source, "lxml"), {}
+    data = source if isinstance(source, xml_backend.BYTES_LIKE) else source.read()
+    spans = _payload_spans(data, payload_tags)
+    root = xml_backend.parse_lxml_chunks(_chunks_without(data, spans))
+    return _payload_references(root, data, spans, open_source, payload_tags)
+
+
+def _undeclared_prefixes(data):
+    """(end of the root element's name, UNDECLARED_PREFIXES used but not declared on it)"""
+    match = ROOT_START_TAG.match(data)
+    if match is None:
+        return 0, []
+    return match.start(1), [
+        prefix
+        for prefix in sorted(UNDECLARED_PREFIXES)
+        if f"xmlns:{prefix}".encode() not in match.group(1)
+        and re.search(re.escape(prefix.encode()) + b":", data)
+    ]
+
+
+def _drop_namespaces(root, uris):
+    """rename {uri}name tags and attributes to name, keeping attribute order"""
+    namespaces = tuple("{" + uri + "}" for uri in uris)
+    for element in root.iter():
+        # joined, the names of most elements are checked without a Python level loop
+        if "}" not in element.tag + "".join(element.keys()):
+            continue
+        if element.tag.startswith(namespaces):
+            element.tag = element.tag.partition("}")[2]
+        if any(key.startswith(namespaces) for key in element.attrib):
+            attributes = list(element.attrib.items())
+            element.attrib.clear()
+            for key, value in attributes:
+                element.set(key.partition("}")[2] if key.startswith(namespaces) else key, value)
+
+
+def _parse_etree(source, open_source, keep_payloads, payload_tags):
+    """parse_document with ElementTree's C accelerated parser, the payload text cut from the
+    bytes as for lxml. Undeclared user: prefixes, which the C parser rejects, are declared on
+    the root element as it is fed to the parser and dropped from the tree afterwards. Other
+    unbound prefixes go through _parse_expat"""
+    data = source if isinstance(source, xml_backend.BYTES_LIKE) else source.read()
+    spans = [] if keep_payloads else _payload_spans(data, payload_tags)
+    root_name_end, prefixes = _undeclared_prefixes(data)
+    uris = [UNDECLARED_NAMESPACE.format(prefix) for prefix in prefixes]
+    parser = ET.XMLParser()
+    try:
+        if uris:
+            parser.feed(memoryview(data)[:root_name_end])
+            for prefix, uri in zip(prefixes, uris):
+                parser.feed(f' xmlns:{prefix}="{uri}"'.encode())
+        # with nothing to cut, the whole buffer is fed at once: splitting long text across
+        # chunks is slower than the copy it saves
+        if any(spans):
+            chunks = _chunks_without(data, spans, root_name_end if uris else 0)
+        else:
+            chunks = (memoryview(data)[root_name_end:] if uris else data,)
+        for chunk in chunks:
+            parser.feed(chunk)
+        root = parser.close()
+    except ET.ParseError as err:
+        if err.code != expat.errors.codes[expat.errors.XML_ERROR_UNBOUND_PREFIX]:
+            raise
+        return _parse_expat(data, open_source or bytes_opener(data), keep_payloads, payload_tags)
+    if uris:
+        _drop_namespaces(root, uris)
+    if keep_payloads:
+        return root, {}
+    return _payload_references(root, data, spans, open_source, payload_tags)
+
+
+def _payload_references(root, data, spans, open_source, payload_tags):
+    """(root, payloads) for a tree parsed from data with the text of spans cut out"""
+    if open_source is None:
+        open_source = bytes_opener(data)
+    if xml_backend.is_lxml(root):
+        elements = list(root.iter(*payload_tags))
+    else:
+        elements = [element for element in root.iter() if element.tag in payload_tags]
+    if len(elements) != len(spans):
+        # a payload tag the byte scan misread (e.g. inside a comment or CDATA)
+        return _parse_expat(data, open_source, False, payload_tags)
+    payloads = {
+        element: PayloadReference(open_source, *span)
+        for element, span in zip(elements, spans)
+        if span is not None
+    }
+    return root, payloads
+
+
+def _parse_expat(source, open_source, keep_payloads, payload_tags):
+    """parse_document with expat and ElementTree. Namespaces are resolved here rather than
+    by expat, so undeclared prefixes can be dropped"""
+    if keep_payloads:
+        payload_tags = frozenset()
+
+    builder = ET.TreeBuilder()
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.ordered_attributes = False
+    payloads = {}
+    # prefix: uri in scope for each open element, and the tag it was built with
+    scopes = [(XML_NAMESPACES, None)]
+    # element being skipped and where its text starts
+    current = {"element": None, "start": None, "depth": 0}
+
+    def start(name, attributes):
+        namespaces = scopes[-1][0]
+        # most elements use no prefixes, and their names and attributes are kept as they are
+        if any(":" in key or key == "xmlns" for key in attributes):
+            declarations = [
+                key for key in attributes if key == "xmlns" or key.startswith("xmlns:")
+            ]
+            if declarations:
+                namespaces = dict(namespaces)
+                for key in declarations:
+                    namespaces[key[6:]] = attributes.pop(key)
+            attributes = {
+                _resolve(key, namespaces, False) if ":" in key else key: value
+                for key, value in attributes.items()
+            }
+        tag = _resolve(name, namespaces) if ":" in name or "" in namespaces else name
+        scopes.append((namespaces, tag))
+        element = builder.start(tag, attributes)
+        if current["element"] is not None:
+            current["depth"] += 1
+        elif tag in payload_tags:
+            current.update(element=element, start=None, depth=0)
+            # unbuffered so the first text callback reports where the payload starts
+            parser.buffer_text = False
+
+    def data(text):
+        if current["element"] is None:
+            builder.data(text)
+        elif current["start"] is None:
+            current["start"] = parser.CurrentByteIndex
+
+    def end(name):
+        element = current["element"]
+        if element is not None:
+            if current["depth"]:
+                current["depth"] -= 1
+            else:
+                if current["start"] is not None:
+                    payloads[element] = PayloadReference(
+                        open_source,
+                        current["start"],
+                        parser.CurrentByteIndex - current["start"],
+                    )
+                current["element"] = None
+                parser.buffer_text = True
+        builder.end(scopes.pop()[1])
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = data
+    try:
+        if isinstance(source, xml_backend.BYTES_LIKE):
+            parser.Parse(source, True)
+        else:
+            for chunk in iter(lambda: source.read(PARSE_CHUNK_SIZE), b""):
+                parser.Parse(chunk, False)
+            parser.Parse(b"", True)
+    except expat.ExpatError as err:
+        error = ET.ParseError(str(err))
+        error.code, error.position = err.code, (err.lineno, err.offset)
+        raise error from err
+    except ValueError as err:
+        error = ET.ParseError(
+            f"{err}: line {parser.CurrentLineNumber}, column {parser.CurrentColumnNumber}"
+        )
+        error.code = expat.errors.codes[expat.errors.XML_ERROR_UNBOUND_PREFIX]
+        error.position = (parser.CurrentLineNumber, parser.CurrentColumnNumber)
+        raise error from err
+    return builder.close(), payloads
+
+
+def without_payloads(data: bytes, payloads) -> bytes:
+    """the document bytes with the payload text cut out, for consumers of the raw text"""
+    ranges = sorted(
+        (reference.offset, reference.offset + reference.length)
+        for reference in payloads.values()
+    )
+    pieces = []
+    position = 0
+    for start, end in ranges:
+        pieces.append(data[position:start])
+        position = end
+    pieces.append(data[position:])
+    return b"".join(pieces)